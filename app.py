@@ -1,9 +1,29 @@
-from flask import Flask, render_template, jsonify, request, send_file, redirect, url_for, session
+from flask import Flask, Response, render_template, jsonify, request, redirect, url_for, session, g
 from config import Config
-from models import db, File, Folder, User, generate_codeword
-from telegram_manager import get_manager, remove_manager
+from models import db, File, Folder, Job, User, UploadSession, generate_codeword
+from jobs import job_runner
+from migrations import upgrade
+from tree_ops import create_folders
+from packing import store_pack
+from dedup import chunk_digest, content_hash, stored_copies, attach_blobs
+from usage import add_usage, add_folder_sizes, reconcile
+from listing_cache import listing_cache, invalidate, folder_key, storage_key
+from part_cache import part_cache
+from call_scheduler import call_stats
+from upload_tuning import recent_uploads
+from telegram_manager import get_manager, remove_manager, pool_stats, part_spans, UPLOAD_PART_SIZE
+import metrics
 import os
+import base64
+import hashlib
+import hmac
+import json
 import shutil
+import threading
+import time
+import unicodedata
+from urllib.parse import quote
+from datetime import datetime, timedelta
 from functools import wraps
 import jwt
 
@@ -15,6 +35,8 @@ app.config.from_object(Config)
 
 # Initialize DB
 db.init_app(app)
+listing_cache.init_app(app)
+part_cache.init_app(app)
 
 # Trigger new commit for GitHub sync
 
@@ -23,6 +45,50 @@ with app.app_context():
     # Drop everything to handle schema changes for this task
     # In production, use migrations
     db.create_all()
+    upgrade()
+
+# Background workers for copy/delete jobs, started by the server process
+# only (wsgi.py, or the __main__ block below), not by every import
+job_runner.init_app(app)
+
+# --- Metrics ---
+_request_seconds = metrics.histogram(
+    'http_request_seconds', 'Requests by endpoint, until the response is returned', ['endpoint', 'method', 'status']
+)
+
+def tmp_dir_bytes():
+    """Bytes staged in tmp/ by legacy uploads and packs."""
+    try:
+        return sum(entry.stat().st_size for entry in os.scandir(os.path.join(BASE_DIR, 'tmp')) if entry.is_file())
+    except FileNotFoundError:
+        return 0
+
+metrics.gauge('tmp_dir_bytes', 'Bytes of upload files staged in tmp/', tmp_dir_bytes)
+metrics.gauge('part_cache_bytes', 'Bytes held by the on-disk part cache', lambda: part_cache.stats()['bytes'])
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.monotonic()
+    # Opt-in per request: the Telegram calls it makes come back as a Server-Timing header
+    if app.config['REQUEST_TRACING'] and request.headers.get('X-Trace'):
+        g.trace = metrics.start_trace()
+
+@app.after_request
+def record_request_metrics(response):
+    # Streamed bodies (downloads) are sent after this, their Telegram time shows in telegram_manager_seconds
+    _request_seconds.observe(
+        time.monotonic() - g.request_started,
+        endpoint=request.endpoint or 'unmatched', method=request.method, status=response.status_code
+    )
+    if g.get('trace') is not None:
+        response.headers['Server-Timing'] = metrics.server_timing(g.trace)
+    return response
+
+@app.teardown_request
+def stop_request_trace(error=None):
+    # Request threads are reused, the next request must not inherit the trace
+    if g.get('trace') is not None:
+        metrics.stop_trace()
 
 
 def token_required(f):
@@ -62,23 +128,69 @@ def get_current_user_id():
         return request.user_id
     return session.get('user_id')
 
+# Per-process cache of user_id -> session string, so hot endpoints don't
+# query the users table just to find the session to rebuild a manager from
+_session_strings = {}
+_session_strings_lock = threading.Lock()
+
+def get_session_string(user_id):
+    with _session_strings_lock:
+        if user_id in _session_strings:
+            return _session_strings[user_id]
+
+    user = User.query.get(user_id)
+    session_string = user.session_string if user else None
+    with _session_strings_lock:
+        _session_strings[user_id] = session_string
+    return session_string
+
+def forget_session_string(user_id):
+    with _session_strings_lock:
+        _session_strings.pop(user_id, None)
+
+# Per-process count of upload requests in flight per user, for admission control
+_upload_slots = {}
+_upload_slots_lock = threading.Lock()
+
+metrics.gauge('uploads_in_progress', 'Upload requests being handled', lambda: sum(_upload_slots.values()))
+
+def upload_admission(f):
+    """Caps the user's concurrent upload requests at UPLOAD_USER_CONCURRENCY, answering 429 beyond it."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        user_id = get_current_user_id()
+        with _upload_slots_lock:
+            if _upload_slots.get(user_id, 0) >= app.config['UPLOAD_USER_CONCURRENCY']:
+                response = jsonify({'error': 'Too many uploads in progress'})
+                response.status_code = 429
+                response.headers['Retry-After'] = str(app.config['UPLOAD_RETRY_AFTER'])
+                return response
+            _upload_slots[user_id] = _upload_slots.get(user_id, 0) + 1
+        try:
+            return f(*args, **kwargs)
+        finally:
+            with _upload_slots_lock:
+                _upload_slots[user_id] -= 1
+                if not _upload_slots[user_id]:
+                    del _upload_slots[user_id]
+
+    return decorated
+
 # Helper to get current manager
 def get_current_manager():
     user_id = get_current_user_id()
     if user_id:
-        # Fetch user to get session string
-        user = User.query.get(user_id)
-        if user and user.session_string:
-             manager = get_manager(user_id, session_string=user.session_string)
+        session_string = get_session_string(user_id)
+        if session_string:
+             manager = get_manager(user_id, session_string=session_string)
         else:
              # Fallback or error state?
              # For now, if no session string, we can't connect, so just get a blank manager or None?
              # But get_manager creates new one.
              manager = get_manager(user_id)
         
-        # Ensure connected if we have a user_id (should be authorized)
-        # However, checking connection every time might be slow?
-        # Let's rely on manager state
+        # Authorization is checked lazily: connect() caches the answer and
+        # auth errors from Telegram invalidate it
         return manager
     return None
 
@@ -89,12 +201,21 @@ def index():
         return redirect(url_for('login_page'))
 
     manager = get_current_manager()
-    if not manager.connect(): # verify authorization
+    if not manager.connect(): # verify authorization (cached for AUTH_CACHE_TTL)
         # Session invalid?
+        forget_session_string(user_id)
         session.pop('user_id', None)
         return redirect(url_for('login_page'))
 
-    return render_template('index.html')
+    # Lets the client batch small files for /api/uploads/pack
+    pack_limits = {
+        'threshold': app.config['PACK_THRESHOLD'],
+        'max_files': app.config['PACK_MAX_FILES'],
+        'max_size': app.config['PACK_MAX_SIZE']
+    }
+    # The client keeps its upload requests within the per-user cap instead of meeting 429s
+    upload_limits = {'concurrency': app.config['UPLOAD_USER_CONCURRENCY']}
+    return render_template('index.html', pack_limits=pack_limits, upload_limits=upload_limits)
 
 @app.route('/login')
 def login_page():
@@ -159,6 +280,7 @@ def verify():
         # Save session string
         user.session_string = manager.get_session_string()
         db.session.commit()
+        forget_session_string(user.id)
 
         # No need to move files anymore.
         # Close pending manager
@@ -196,6 +318,7 @@ def logout():
             remove_manager(get_current_user_id())
         except Exception as e:
             print(f"Error removing manager: {e}")
+        forget_session_string(get_current_user_id())
             
         # No file deletion needed for StringSession
 
@@ -204,9 +327,72 @@ def logout():
     return jsonify({'status': 'logged_out'})
 
 # --- File Routes ---
+LIST_SORTS = ('name', 'size', 'created_at')
+
+def sort_column(model, sort):
+    if sort == 'size' and model is File:
+        return db.func.coalesce(File.size, 0)
+    return getattr(model, sort)
+
+def sort_value(item, sort):
+    if sort == 'size':
+        return item.size or 0
+    if sort == 'created_at':
+        return item.created_at.isoformat()
+    return getattr(item, sort)
+
+def encode_cursor(item, sort):
+    """Opaque keyset cursor for the page after item: its type, sort value and id."""
+    key = ['folder' if isinstance(item, Folder) else 'file', sort_value(item, sort), item.id]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def decode_cursor(cursor, sort):
+    """Returns (type, (sort value, id)), or raises ValueError for a malformed cursor."""
+    try:
+        item_type, value, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if sort == 'created_at':
+            value = datetime.fromisoformat(value)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if item_type not in ('folder', 'file'):
+        raise ValueError("Invalid cursor")
+    return item_type, (value, item_id)
+
+def list_page(model, user_id, parent_id, sort, descending, after=None, limit=None):
+    """Rows of model under parent_id in (sort column, id) order, starting past the after key."""
+    column = sort_column(model, sort)
+    query = model.query.filter_by(user_id=user_id, parent_id=parent_id)
+    if after is not None:
+        key = db.tuple_(column, model.id)
+        query = query.filter(key < after if descending else key > after)
+    direction = db.desc if descending else db.asc
+    query = query.order_by(direction(column), direction(model.id))
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+def cached_json(body, etag):
+    """A JSON response clients must revalidate, with a conditional GET, before reusing."""
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Authorization')
+    return response
+
+def not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.vary.add('Authorization')
+    return response
+
 @app.route('/api/files')
 @token_required
 def list_files():
+    """
+    Folders first, then files. With ?limit= the listing is paginated by
+    keyset: it returns {'items', 'next'} and ?after=<next> gives the page
+    that follows. ?sort= is name, size or created_at, ?order= asc or desc.
+    """
     user_id = get_current_user_id()
     if not user_id:
         return jsonify({'error': 'Not authenticated'}), 401
@@ -215,11 +401,54 @@ def list_files():
     if parent_id == 'null' or parent_id == '':
         parent_id = None
 
-    folders = Folder.query.filter_by(parent_id=parent_id, user_id=user_id).order_by(Folder.name.asc()).all()
-    files = File.query.filter_by(parent_id=parent_id, user_id=user_id).order_by(File.name.asc()).all()
-
-    result = [f.to_dict() for f in folders] + [f.to_dict() for f in files]
-    return jsonify(result)
+    # Read before the rows, so a change committed meanwhile can't be cached as current
+    version = listing_cache.version(folder_key(user_id, parent_id))
+    etag = listing_cache.etag(user_id, version)
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
+
+    query = tuple(sorted((k, v) for k, v in request.args.items() if k not in ('parent_id', 'token')))
+    cache_key = (folder_key(user_id, parent_id), version, query)
+    body = listing_cache.get(cache_key)
+    if body is not None:
+        return cached_json(body, etag)
+
+    sort = request.args.get('sort', 'name')
+    if sort not in LIST_SORTS:
+        return jsonify({'error': f"sort must be one of {', '.join(LIST_SORTS)}"}), 400
+    descending = request.args.get('order') == 'desc'
+    limit = request.args.get('limit', type=int)
+
+    if not limit:
+        # Unpaginated, the whole folder at once
+        folders = list_page(Folder, user_id, parent_id, sort, descending)
+        files = list_page(File, user_id, parent_id, sort, descending)
+        result = [f.to_dict() for f in folders] + [f.to_dict() for f in files]
+    else:
+        limit = min(max(limit, 1), app.config['LIST_PAGE_LIMIT'])
+        after_type, after = None, None
+        if request.args.get('after'):
+            try:
+                after_type, after = decode_cursor(request.args['after'], sort)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+
+        items = []
+        if after_type != 'file':
+            items += list_page(Folder, user_id, parent_id, sort, descending, after, limit)
+        if len(items) < limit:
+            # Files start from the top once the folders run out
+            file_after = after if after_type == 'file' else None
+            items += list_page(File, user_id, parent_id, sort, descending, file_after, limit - len(items))
+
+        result = {
+            'items': [item.to_dict() for item in items],
+            'next': encode_cursor(items[-1], sort) if len(items) == limit else None
+        }
+
+    body = app.json.dumps(result)
+    listing_cache.put(cache_key, body)
+    return cached_json(body, etag)
 
 @app.route('/api/storage')
 @token_required
@@ -227,14 +456,45 @@ def get_storage_usage():
     user_id = get_current_user_id()
     if not user_id:
         return jsonify({'error': 'Not authenticated'}), 401
-        
-    # Calculate sum of all file sizes for the user
-    total_bytes = db.session.query(db.func.sum(File.size)).filter(File.user_id == user_id).scalar() or 0
-    
-    return jsonify({'used': total_bytes})
+
+    version = listing_cache.version(storage_key(user_id))
+    etag = listing_cache.etag(user_id, version)
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
+
+    cache_key = (storage_key(user_id), version)
+    body = listing_cache.get(cache_key)
+    if body is None:
+        # Maintained counter, see usage.py
+        total_bytes = db.session.query(User.used_bytes).filter(User.id == user_id).scalar() or 0
+        body = app.json.dumps({'used': total_bytes})
+        listing_cache.put(cache_key, body)
+    return cached_json(body, etag)
+
+@app.route('/api/stats')
+@token_required
+def get_stats():
+    return jsonify({
+        'managers': pool_stats(),
+        'listing_cache': listing_cache.stats(),
+        'part_cache': part_cache.stats(),
+        'telegram_calls': call_stats(),
+        'uploads': recent_uploads()
+    })
+
+@app.route('/metrics')
+def get_metrics():
+    """Requires the METRICS_TOKEN bearer token, and is off without one."""
+    token = app.config['METRICS_TOKEN']
+    if not token:
+        return jsonify({'error': 'Not found'}), 404
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/upload', methods=['POST'])
 @token_required
+@upload_admission
 def upload_file():
     user_id = get_current_user_id()
     if not user_id:
@@ -256,7 +516,20 @@ def upload_file():
     codeword = generate_codeword()
     temp_path = os.path.join(BASE_DIR, 'tmp', codeword)
     os.makedirs(os.path.join(BASE_DIR, 'tmp'), exist_ok=True)
-    file.save(temp_path)
+
+    # Hashed while it is saved, in the chunks a chunked upload would use
+    chunk_size = upload_chunk_size()
+    digests = []
+    with open(temp_path, 'wb') as out:
+        while True:
+            data = file.stream.read(chunk_size)
+            if not data and digests:
+                break
+            digests.append(chunk_digest(data))
+            out.write(data)
+            if len(data) < chunk_size:
+                break
+    content = content_hash(digests, chunk_size)
 
     try:
         new_file = File(
@@ -267,10 +540,16 @@ def upload_file():
             size=os.path.getsize(temp_path),
             mime_type=file.content_type
         )
-        db.session.add(new_file)
 
-        message_ids = manager.upload_file(temp_path, codeword, file_name=file.filename)
-        new_file.message_ids = message_ids
+        # Nothing is written (and on SQLite locked) before the upload to Telegram is done
+        spans = stored_copies(user_id, [content]).get(content)
+        if spans is None:
+            message_ids = manager.upload_file(temp_path, codeword, file_name=file.filename)
+            spans = part_spans(new_file.size, message_ids)
+        db.session.add(new_file)
+        new_file.set_parts(spans)
+        attach_blobs(user_id, [(new_file, content)])
+        add_usage(user_id, {parent_id: new_file.size})
         db.session.commit()
 
         return jsonify(new_file.to_dict()), 201
@@ -281,47 +560,334 @@ def upload_file():
         if os.path.exists(temp_path):
             os.remove(temp_path)
 
-@app.route('/api/download/<file_id>')
+# --- Chunked Upload Sessions ---
+# Chunks are piped straight into Telegram upload parts as they arrive, so
+# nothing is staged on disk. Telegram keeps the saved parts until the session
+# is completed, which turns them into documents.
+def upload_chunk_size():
+    """Size of upload chunks, rounded so every chunk starts on a Telegram part boundary."""
+    return max(UPLOAD_PART_SIZE, app.config['UPLOAD_CHUNK_SIZE'] // UPLOAD_PART_SIZE * UPLOAD_PART_SIZE)
+
+def purge_stale_upload_sessions():
+    """Drops upload sessions nobody finished within UPLOAD_SESSION_TTL."""
+    cutoff = datetime.utcnow() - timedelta(seconds=app.config['UPLOAD_SESSION_TTL'])
+    UploadSession.query.filter(UploadSession.created_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+
+@app.route('/api/uploads', methods=['POST'])
 @token_required
-def download_file(file_id):
+def init_upload():
     user_id = get_current_user_id()
     if not user_id:
         return jsonify({'error': 'Not authenticated'}), 401
 
-    file = File.query.filter_by(id=file_id, user_id=user_id).first_or_404()
+    data = request.json
+    name = data.get('name')
+    size = data.get('size')
+    parent_id = data.get('parent_id')
+    if parent_id == 'null' or parent_id == '':
+        parent_id = None
+
+    if not name:
+        return jsonify({'error': 'Name required'}), 400
+    if not isinstance(size, int) or size < 0:
+        return jsonify({'error': 'Size required'}), 400
 
+    purge_stale_upload_sessions()
     manager = get_current_manager()
 
-    temp_path = os.path.join(BASE_DIR, 'tmp', f"download_{file_id}")
-    os.makedirs(os.path.join(BASE_DIR, 'tmp'), exist_ok=True)
+    upload = UploadSession(
+        user_id=user_id,
+        name=name,
+        parent_id=parent_id,
+        size=size,
+        mime_type=data.get('mime_type'),
+        chunk_size=upload_chunk_size()
+    )
+    upload.received = '0' * upload.chunk_count
+    upload.chunk_hashes = '0' * 64 * upload.chunk_count
+    upload.file_ids = manager.new_upload(size)
+    db.session.add(upload)
+    db.session.commit()
+
+    return jsonify(upload.to_dict()), 201
 
+@app.route('/api/uploads/<upload_id>')
+@token_required
+def upload_status(upload_id):
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    upload = UploadSession.query.filter_by(id=upload_id, user_id=user_id).first_or_404()
+    return jsonify(upload.to_dict())
+
+@app.route('/api/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+@token_required
+@upload_admission
+def upload_chunk(upload_id, index):
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    upload = UploadSession.query.filter_by(id=upload_id, user_id=user_id).first_or_404()
+
+    if index < 0 or index >= upload.chunk_count:
+        return jsonify({'error': 'Chunk index out of range'}), 400
+    offset = request.args.get('offset', type=int)
+    if offset != index * upload.chunk_size:
+        return jsonify({'error': 'Offset does not match chunk index'}), 400
+    length = upload.chunk_length(index)
+    if (request.content_length or 0) != length:
+        return jsonify({'error': f'Chunk {index} must be {length} bytes'}), 400
+
+    manager = get_current_manager()
+    digest = hashlib.sha256()
     try:
-        manager.download_file(file.message_ids, temp_path)
-        response = send_file(
-            temp_path,
-            as_attachment=True,
-            download_name=file.name,
-            mimetype=file.mime_type
+        manager.upload_stream(
+            request.stream, upload.file_ids, upload.size, offset, length,
+            workers=app.config['UPLOAD_WORKERS'],
+            queue_size=app.config['UPLOAD_QUEUE_PARTS'],
+            digest=digest
         )
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-        @response.call_on_close
-        def cleanup():
-            if os.path.exists(temp_path):
-                try:
-                    os.remove(temp_path)
-                except Exception as e:
-                    print(f"Error deleting temp file: {e}")
-        
+    # Flip this chunk's bit and store its hash in a single statement so parallel chunks don't race
+    updates = {
+        UploadSession.received: db.func.substr(UploadSession.received, 1, index) + '1'
+        + db.func.substr(UploadSession.received, index + 2)
+    }
+    if upload.chunk_digests() is not None:
+        updates[UploadSession.chunk_hashes] = (
+            db.func.substr(UploadSession.chunk_hashes, 1, 64 * index) + digest.hexdigest()
+            + db.func.substr(UploadSession.chunk_hashes, 64 * (index + 1) + 1)
+        )
+    UploadSession.query.filter_by(id=upload.id).update(updates, synchronize_session=False)
+    db.session.commit()
+    db.session.refresh(upload)
+
+    return jsonify(upload.to_dict())
+
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+@token_required
+@upload_admission
+def complete_upload(upload_id):
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    upload = UploadSession.query.filter_by(id=upload_id, user_id=user_id).first_or_404()
+    missing = upload.missing_chunks()
+    if missing:
+        return jsonify({'error': 'Upload incomplete', 'missing': missing}), 409
+
+    manager = get_current_manager()
+    codeword = generate_codeword()
+
+    try:
+        new_file = File(
+            id=codeword,
+            name=upload.name,
+            parent_id=upload.parent_id,
+            user_id=user_id,
+            size=upload.size,
+            mime_type=upload.mime_type
+        )
+
+        digests = upload.chunk_digests()
+        content = content_hash(digests, upload.chunk_size) if digests else None
+        # Content already stored: the saved parts are left to expire on Telegram.
+        # Nothing is written before the documents are sent, see upload_file
+        spans = stored_copies(user_id, [content]).get(content) if content else None
+        if spans is None:
+            message_ids = manager.finish_upload(upload.file_ids, upload.size, codeword, file_name=upload.name)
+            spans = part_spans(upload.size, message_ids)
+        db.session.add(new_file)
+        new_file.set_parts(spans)
+        if content:
+            attach_blobs(user_id, [(new_file, content)])
+        add_usage(user_id, {upload.parent_id: upload.size})
+        db.session.delete(upload)
+        db.session.commit()
+    except Exception as e:
+        # Keep the session so finalizing can be retried
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+    return jsonify(new_file.to_dict()), 201
+
+@app.route('/api/uploads/pack', methods=['POST'])
+@token_required
+@upload_admission
+def upload_pack():
+    """
+    Uploads many small files in one request, stored together as one pack (see
+    packing.py). Form fields: files, and parent_ids in the same order.
+    """
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    threshold = app.config['PACK_THRESHOLD']
+    if threshold <= 0:
+        return jsonify({'error': 'Packing is disabled'}), 404
+
+    files = request.files.getlist('files')
+    parent_ids = request.form.getlist('parent_ids')
+    if not files:
+        return jsonify({'error': 'No files'}), 400
+    if len(parent_ids) != len(files):
+        return jsonify({'error': 'One parent_id per file required'}), 400
+    if len(files) > app.config['PACK_MAX_FILES']:
+        return jsonify({'error': f"At most {app.config['PACK_MAX_FILES']} files per pack"}), 400
+
+    entries = []
+    total = 0
+    for file, parent_id in zip(files, parent_ids):
+        if not file.filename:
+            return jsonify({'error': 'No selected file'}), 400
+        # Packed files are smaller than threshold, reading that much tells one that isn't
+        data = file.read(threshold)
+        if len(data) >= threshold:
+            return jsonify({'error': f'{file.filename} is too big to be packed'}), 400
+        total += len(data)
+        if total > app.config['PACK_MAX_SIZE']:
+            return jsonify({'error': 'Pack too big'}), 400
+        entries.append((file.filename, parent_id if parent_id not in ('', 'null') else None, file.content_type, data))
+
+    manager = get_current_manager()
+    try:
+        new_files = store_pack(entries, user_id, manager, upload_chunk_size())
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+    return jsonify({'files': [f.to_dict() for f in new_files]}), 201
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+@token_required
+def abort_upload(upload_id):
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    # Parts already saved on Telegram expire there on their own
+    upload = UploadSession.query.filter_by(id=upload_id, user_id=user_id).first_or_404()
+    db.session.delete(upload)
+    db.session.commit()
+    return jsonify({'status': 'aborted'})
+
+def content_disposition(file_name):
+    """Builds Content-Disposition options, encoding non-ASCII names per RFC 5987."""
+    try:
+        file_name.encode('ascii')
+        return {'filename': file_name}
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', file_name).encode('ascii', 'ignore').decode('ascii')
+        return {'filename': simple, 'filename*': f"UTF-8''{quote(file_name, safe='!#$&+-.^_`|~')}"}
+
+def requested_ranges(size, etag, last_modified):
+    """
+    Resolves the Range header against a file of the given size.
+    Returns None to send the whole file, otherwise a list of (start, end)
+    byte spans (end exclusive), which is empty if none can be satisfied.
+    """
+    rng = request.range
+    if rng is None or rng.units != 'bytes':
+        return None
+
+    # If-Range: only honour the range if the client still has this version
+    if_range = request.if_range
+    if if_range.etag and if_range.etag != etag.strip('"'):
+        return None
+    if if_range.date and if_range.date.replace(tzinfo=None) != last_modified.replace(microsecond=0):
+        return None
+
+    spans = []
+    for start, end in rng.ranges:
+        if start < 0:
+            start, end = max(size + start, 0), size
+        else:
+            end = size if end is None else min(end, size)
+        if start < end:
+            spans.append((start, end))
+    return spans
+
+@app.route('/api/download/<file_id>')
+@token_required
+def download_file(file_id):
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    file = File.query.filter_by(id=file_id, user_id=user_id).first_or_404()
+
+    manager = get_current_manager()
+    mimetype = file.mime_type or 'application/octet-stream'
+    # Contents never change for a given id, so id and size identify the version
+    etag = f'"{file.id}-{file.size}"'
+
+    spans = requested_ranges(file.size, etag, file.created_at)
+    if spans == []:
+        response = Response(status=416)
+        response.headers['Content-Range'] = f'bytes */{file.size}'
         return response
 
+    # Byte spans of the parts come from the database, no lookup on Telegram
+    spans_of_parts = file.spans
+
+    def stream(offset=0, length=None):
+        return manager.iter_file(
+            spans_of_parts, file.size, offset, length,
+            chunk_size=app.config['DOWNLOAD_CHUNK_SIZE'],
+            workers=app.config['DOWNLOAD_WORKERS'],
+            connections=app.config['DOWNLOAD_CONNECTIONS'],
+            cache=part_cache
+        )
+
+    try:
+        # Streamed from Telegram (or the part cache), nothing is staged in tmp/
+        if spans is None:
+            response = Response(stream(), mimetype=mimetype)
+            # Known up front, so browsers can show progress from the first byte
+            response.content_length = file.size
+        elif len(spans) == 1:
+            start, end = spans[0]
+            response = Response(stream(start, end - start), status=206, mimetype=mimetype)
+            response.content_length = end - start
+            response.headers['Content-Range'] = f'bytes {start}-{end - 1}/{file.size}'
+        else:
+            boundary = generate_codeword(24)
+            heads = [
+                (f'--{boundary}\r\nContent-Type: {mimetype}\r\n'
+                 f'Content-Range: bytes {start}-{end - 1}/{file.size}\r\n\r\n').encode()
+                for start, end in spans
+            ]
+            tail = f'--{boundary}--\r\n'.encode()
+            streams = [stream(start, end - start) for start, end in spans]
+
+            def multipart():
+                for head, stream in zip(heads, streams):
+                    yield head
+                    yield from stream
+                    yield b'\r\n'
+                yield tail
+
+            response = Response(multipart(), status=206, mimetype=f'multipart/byteranges; boundary={boundary}')
+            response.content_length = (
+                sum(len(head) + (end - start) + 2 for head, (start, end) in zip(heads, spans)) + len(tail)
+            )
     except Exception as e:
-        if os.path.exists(temp_path):
-            try:
-                os.remove(temp_path)
-            except:
-                pass
         return jsonify({'error': str(e)}), 500
 
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['ETag'] = etag
+    response.last_modified = file.created_at
+    response.headers.set('Content-Disposition', 'attachment', **content_disposition(file.name))
+    return response
+
 @app.route('/api/folders', methods=['POST'])
 @token_required
 def create_folder():
@@ -337,12 +903,75 @@ def create_folder():
     if not name:
         return jsonify({'error': 'Name required'}), 400
 
-    new_folder = Folder(name=name, parent_id=parent_id, user_id=user_id)
+    parent = None
+    if parent_id:
+        parent = Folder.query.filter_by(id=parent_id, user_id=user_id).first()
+        if not parent:
+            return jsonify({'error': 'Parent folder not found'}), 404
+
+    new_folder = Folder(name=name, user_id=user_id)
+    new_folder.place(parent)
     db.session.add(new_folder)
+    invalidate(user_id, [parent_id])
     db.session.commit()
 
     return jsonify(new_folder.to_dict()), 201
 
+@app.route('/api/folders/bulk', methods=['POST'])
+@token_required
+def create_folder_tree():
+    """
+    Creates a whole tree of folders under parent_id in one transaction, for
+    folder uploads. Takes relative paths ('a', 'a/b', ...), creating missing
+    intermediate folders too, and returns the path -> folder id map.
+    """
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    data = request.json
+    paths = data.get('paths')
+    parent_id = data.get('parent_id')
+    if parent_id == 'null': parent_id = None
+
+    if not isinstance(paths, list) or not all(isinstance(path, str) for path in paths):
+        return jsonify({'error': 'Paths required'}), 400
+
+    parent = None
+    if parent_id:
+        parent = Folder.query.filter_by(id=parent_id, user_id=user_id).first()
+        if not parent:
+            return jsonify({'error': 'Parent folder not found'}), 404
+
+    # path -> (parent path, name) for every folder along every path
+    tree = {}
+    for path in paths:
+        names = path.strip('/').split('/')
+        if any(name in ('', '.', '..') or len(name) > 255 for name in names):
+            return jsonify({'error': f'Invalid path: {path}'}), 400
+        for depth in range(1, len(names) + 1):
+            tree.setdefault('/'.join(names[:depth]), ('/'.join(names[:depth - 1]) or None, names[depth - 1]))
+
+    # Parents first
+    ordered = sorted(tree.items(), key=lambda item: item[0].count('/'))
+    ids = create_folders([(path, parent_path, name) for path, (parent_path, name) in ordered], user_id, parent)
+    db.session.commit()
+
+    return jsonify({'folders': ids}), 201
+
+@app.route('/api/folders/<folder_id>/path')
+@token_required
+def folder_path(folder_id):
+    """The folders from the root down to folder_id, for breadcrumbs."""
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    folder = Folder.query.filter_by(id=folder_id, user_id=user_id).first_or_404()
+    ancestor_ids = folder.ancestor_ids
+    ancestors = {f.id: f for f in Folder.query.filter(Folder.id.in_(ancestor_ids), Folder.user_id == user_id)}
+    return jsonify([ancestors[i].to_dict() for i in ancestor_ids if i in ancestors])
+
 @app.route('/api/move', methods=['POST'])
 @token_required
 def move_item():
@@ -365,30 +994,37 @@ def move_item():
         else:
             return jsonify({'error': 'No items specified'}), 400
 
+    new_parent = None
+    if new_parent_id:
+        new_parent = Folder.query.filter_by(id=new_parent_id, user_id=user_id).first()
+        if not new_parent:
+            return jsonify({'error': 'Destination folder not found'}), 404
+
     try:
         for item_data in items:
             item_id = item_data.get('id')
             item_type = item_data.get('type')
 
-            # Prevent moving folder into itself or its children
             if item_type == 'folder':
+                item = Folder.query.filter_by(id=item_id, user_id=user_id).first_or_404()
+
+                # Prevent moving folder into itself or its children
                 if item_id == new_parent_id:
                     return jsonify({'error': 'Cannot move folder into itself'}), 400
+                if new_parent and item.contains(new_parent):
+                    return jsonify({'error': 'Cannot move folder into its own subfolder'}), 400
 
-                # Check if new_parent_id is a child of item_id
-                # Only check folders belonging to user
-                current = Folder.query.filter_by(id=new_parent_id, user_id=user_id).first()
-                while current:
-                    if current.id == item_id:
-                        return jsonify({'error': 'Cannot move folder into its own subfolder'}), 400
-                    current = Folder.query.filter_by(id=current.parent_id, user_id=user_id).first() if current.parent_id else None
-
-            if item_type == 'folder':
-                item = Folder.query.filter_by(id=item_id, user_id=user_id).first_or_404()
+                # The folder's size moves with it
+                sizes = {item.parent_id: -item.size}
+                item.move_to(new_parent)
             else:
                 item = File.query.filter_by(id=item_id, user_id=user_id).first_or_404()
+                sizes = {item.parent_id: -(item.size or 0)}
+                item.parent_id = new_parent_id
 
-            item.parent_id = new_parent_id
+            sizes[new_parent_id] = sizes.get(new_parent_id, 0) + (item.size or 0)
+            add_folder_sizes(user_id, sizes)
+            invalidate(user_id, sizes)
 
         db.session.commit()
         return jsonify({'status': 'success'})
@@ -396,45 +1032,23 @@ def move_item():
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
-def copy_recursive(item, new_parent_id, user_id, manager):
-    if isinstance(item, File):
-        new_codeword = generate_codeword()
-
-        # Copy Telegram messages
-        try:
-            new_message_ids = manager.copy_file(item.message_ids, new_codeword)
-
-            new_file = File(
-                id=new_codeword,
-                name=item.name,
-                parent_id=new_parent_id,
-                user_id=user_id,
-                size=item.size,
-                mime_type=item.mime_type
-            )
-            new_file.message_ids = new_message_ids
-            db.session.add(new_file)
-        except Exception as e:
-            print(f"Error copying file {item.name}: {e}")
-            raise e
-
-    elif isinstance(item, Folder):
-        new_folder = Folder(
-            name=item.name,
-            parent_id=new_parent_id,
-            user_id=user_id
-        )
-        db.session.add(new_folder)
-        db.session.flush()
-
-        # Copy children
-        children_files = File.query.filter_by(parent_id=item.id, user_id=user_id).all()
-        for child in children_files:
-            copy_recursive(child, new_folder.id, user_id, manager)
+def item_list(data):
+    """The items of a copy/delete request, accepting the older single id/type form too."""
+    items = data.get('items')
+    if not items:
+        item_id = data.get('id')
+        item_type = data.get('type')
+        if item_id and item_type:
+            items = [{'id': item_id, 'type': item_type}]
+    return [{'id': item.get('id'), 'type': item.get('type')} for item in items or []]
 
-        children_folders = Folder.query.filter_by(parent_id=item.id, user_id=user_id).all()
-        for child in children_folders:
-            copy_recursive(child, new_folder.id, user_id, manager)
+def submit_job(user_id, kind, payload):
+    job = Job(user_id=user_id, kind=kind)
+    job.payload = payload
+    db.session.add(job)
+    db.session.commit()
+    job_runner.submit(job)
+    return jsonify({'job_id': job.id, **job.to_dict()}), 202
 
 @app.route('/api/copy', methods=['POST'])
 @token_required
@@ -443,40 +1057,20 @@ def copy_item():
     if not user_id:
         return jsonify({'error': 'Not authenticated'}), 401
 
-    manager = get_current_manager()
-
     data = request.json
-    items = data.get('items')
+    items = item_list(data)
     new_parent_id = data.get('new_parent_id')
 
     if new_parent_id == 'null':
         new_parent_id = None
 
     if not items:
-        item_id = data.get('id')
-        item_type = data.get('type')
-        if item_id and item_type:
-            items = [{'id': item_id, 'type': item_type}]
-        else:
-            return jsonify({'error': 'No items specified'}), 400
-
-    try:
-        for item_data in items:
-            item_id = item_data.get('id')
-            item_type = item_data.get('type')
-
-            if item_type == 'folder':
-                item = Folder.query.filter_by(id=item_id, user_id=user_id).first_or_404()
-            else:
-                item = File.query.filter_by(id=item_id, user_id=user_id).first_or_404()
-
-            copy_recursive(item, new_parent_id, user_id, manager)
+        return jsonify({'error': 'No items specified'}), 400
+    if new_parent_id and not Folder.query.filter_by(id=new_parent_id, user_id=user_id).first():
+        return jsonify({'error': 'Destination folder not found'}), 404
 
-        db.session.commit()
-        return jsonify({'status': 'success'})
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'error': str(e)}), 500
+    # Copying runs in the background, the client polls /api/jobs/<job_id>
+    return submit_job(user_id, 'copy', {'items': items, 'new_parent_id': new_parent_id})
 
 @app.route('/api/rename', methods=['POST'])
 @token_required
@@ -499,71 +1093,71 @@ def rename_item():
         item = File.query.filter_by(id=item_id, user_id=user_id).first_or_404()
 
     item.name = new_name
+    invalidate(user_id, [item.parent_id])
     db.session.commit()
     return jsonify({'status': 'success'})
 
-def delete_folder_recursive(folder_id, user_id, manager):
-    # 1. Delete all files in this folder
-    files = File.query.filter_by(parent_id=folder_id, user_id=user_id).all()
-    for file in files:
-        try:
-            manager.delete_file(file.message_ids)
-        except Exception as e:
-            print(f"Error deleting file from Telegram: {e}")
-        db.session.delete(file)
+@app.route('/api/delete', methods=['POST'])
+@token_required
+def delete_item():
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({'error': 'Not authenticated'}), 401
 
-    # 2. Delete all subfolders recursively
-    subfolders = Folder.query.filter_by(parent_id=folder_id, user_id=user_id).all()
-    for subfolder in subfolders:
-        delete_folder_recursive(subfolder.id, user_id, manager)
+    items = item_list(request.json)
+    if not items:
+        return jsonify({'error': 'No items specified'}), 400
 
-    # 3. Delete the folder itself
-    folder = Folder.query.filter_by(id=folder_id, user_id=user_id).first()
-    if folder:
-        db.session.delete(folder)
+    # Deleting runs in the background, the client polls /api/jobs/<job_id>
+    return submit_job(user_id, 'delete', {'items': items})
 
-@app.route('/api/delete', methods=['POST'])
+# --- Job Routes ---
+@app.route('/api/jobs/<job_id>')
 @token_required
-def delete_item():
+def job_status(job_id):
     user_id = get_current_user_id()
     if not user_id:
         return jsonify({'error': 'Not authenticated'}), 401
 
-    manager = get_current_manager()
+    job = Job.query.filter_by(id=job_id, user_id=user_id).first_or_404()
+    return jsonify(job.to_dict())
 
-    data = request.json
-    items = data.get('items')
+@app.route('/api/jobs/<job_id>/events')
+@token_required
+def job_events(job_id):
+    """
+    Server-sent events with the job's progress until it finishes. Each
+    stream holds a server thread, so it ends after JOB_EVENTS_TIMEOUT
+    seconds and EventSource reconnects to continue.
+    """
+    user_id = get_current_user_id()
+    if not user_id:
+        return jsonify({'error': 'Not authenticated'}), 401
 
-    # Backward compatibility or single item delete
-    if not items:
-        item_id = data.get('id')
-        item_type = data.get('type')
-        if item_id and item_type:
-            items = [{'id': item_id, 'type': item_type}]
-        else:
-            return jsonify({'error': 'No items specified'}), 400
+    Job.query.filter_by(id=job_id, user_id=user_id).first_or_404()
+    deadline = time.monotonic() + app.config['JOB_EVENTS_TIMEOUT']
 
-    try:
-        for item in items:
-            item_id = item.get('id')
-            item_type = item.get('type')
+    def stream():
+        yield "retry: 1000\n\n"
+        while True:
+            with app.app_context():
+                job = Job.query.get(job_id)
+                data = job.to_dict()
+            yield f"data: {json.dumps(data)}\n\n"
+            if data['status'] in ('done', 'failed') or time.monotonic() >= deadline:
+                return
+            time.sleep(1)
 
-            if item_type == 'folder':
-                delete_folder_recursive(item_id, user_id, manager)
-            else:
-                file = File.query.filter_by(id=item_id, user_id=user_id).first()
-                if file:
-                    try:
-                        manager.delete_file(file.message_ids)
-                    except:
-                        pass
-                    db.session.delete(file)
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
-        db.session.commit()
-        return jsonify({'status': 'success'})
-    except Exception as e:
-        db.session.rollback()
-        return jsonify({'error': str(e)}), 500
+@app.cli.command('reconcile-usage')
+def reconcile_usage():
+    """Recomputes the storage usage counters from the files."""
+    users, folders = reconcile()
+    print(f"Repaired usage of {users} users and {folders} folders")
 
 if __name__ == '__main__':
+    # The reloader's parent process only watches files, the server runs in its child
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        job_runner.start()
     app.run(debug=True, port=5000,host='0.0.0.0')
@@ -0,0 +1,64 @@
+"""
+Compares download throughput of the old single-stream path
+(get_messages + download_media) against fast_download.
+
+Needs a logged-in session and a message in Saved Messages holding a document:
+
+    SESSION_STRING=... API_ID=... API_HASH=... \\
+        python benchmarks/download_benchmark.py <message_id> [workers ...]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram_manager import TelegramManager
+
+
+class CountingSink:
+    """File-like object that only counts what is written to it."""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+    def flush(self):
+        pass
+
+
+def measure(label, run):
+    sink = CountingSink()
+    start = time.perf_counter()
+    run(sink)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {sink.size / 1024 / 1024:8.1f} MB {elapsed:8.2f} s {sink.size / 1024 / 1024 / elapsed:8.2f} MB/s")
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    msg_id = int(sys.argv[1])
+    worker_counts = [int(w) for w in sys.argv[2:]] or [1, 4, 8, 16]
+    connections = int(os.environ.get('DOWNLOAD_CONNECTIONS') or 1)
+
+    manager = TelegramManager(session_string=os.environ['SESSION_STRING'])
+    manager.ensure_connected()
+    msg = manager._run_with_retry(manager.client.get_messages, "me", ids=msg_id)
+
+    measure("download_media (current)", lambda sink: manager._run(manager.client.download_media(msg, sink)))
+    for workers in worker_counts:
+        measure(
+            f"fast_download workers={workers} conns={connections}",
+            lambda sink: manager._run(manager.fast_download(msg.media, sink, workers=workers, connections=connections))
+        )
+
+    manager.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+"""
+Compares copying and deleting a large folder tree the old way (walking
+parent_id one folder at a time through the ORM) against the bulk subtree
+operations the copy/delete jobs use.
+
+Runs against a throwaway SQLite database, Telegram calls are stubbed out:
+
+    python benchmarks/tree_benchmark.py [nodes] [fanout]
+
+Set DATABASE_URL to measure against another (empty) database instead.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import event
+
+from config import Config
+from models import db, Blob, File, FilePart, Folder, Job, User, generate_codeword
+from jobs import run_copy, run_delete
+from migrations import backfill_folder_paths
+from telegram_manager import part_spans
+
+
+class StubManager:
+    """Stands in for TelegramManager, handing out fake message ids."""
+
+    def __init__(self):
+        self.next_id = 1
+
+    def forward_messages(self, message_ids):
+        """What the legacy copy did on Telegram: forward each file's messages to new ones."""
+        new_ids = list(range(self.next_id, self.next_id + len(message_ids)))
+        self.next_id += len(message_ids)
+        return new_ids
+
+    def delete_file(self, message_ids):
+        pass
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self.on_execute)
+
+    def on_execute(self, *args):
+        self.count += 1
+
+
+def build_tree(user_id, nodes, fanout):
+    """A tree of about nodes folders and files, one folder per fanout nodes."""
+    root = Folder(name='root', user_id=user_id)
+    root.place(None)
+    folders = [root]
+    rows, parts = [], []
+    for i in range(nodes // fanout):
+        parent = random.choice(folders)
+        folder = Folder(name=f'folder-{i}', user_id=user_id)
+        folder.place(parent)
+        folders.append(folder)
+    db.session.add_all(folders)
+
+    blobs = []
+    for i in range(nodes - len(folders)):
+        file_id = generate_codeword()
+        # Distinct content each, so copies lock and count a blob per file
+        blobs.append({'id': file_id, 'user_id': user_id, 'hash': f'{i:064x}', 'size': 1024, 'ref_count': 1})
+        rows.append({
+            'id': file_id,
+            'name': f'file-{i}',
+            'parent_id': random.choice(folders).id,
+            'user_id': user_id,
+            'size': 1024,
+            'mime_type': 'application/octet-stream',
+            'blob_id': file_id
+        })
+        parts.append({'file_id': file_id, 'part_index': 0, 'message_id': i, 'offset': 0, 'size': 1024})
+    db.session.execute(db.insert(Blob), blobs)
+    db.session.execute(db.insert(File), rows)
+    db.session.execute(db.insert(FilePart), parts)
+    db.session.commit()
+    return root.id
+
+
+def legacy_copy(item, new_parent_id, user_id, manager):
+    """The pre-bulk copy: per-folder queries, one flush per folder, ORM rows."""
+    if isinstance(item, File):
+        message_ids = manager.forward_messages(item.message_ids)
+        new_file = File(name=item.name, parent_id=new_parent_id, user_id=user_id, size=item.size, mime_type=item.mime_type)
+        new_file.set_parts(part_spans(item.size, message_ids))
+        db.session.add(new_file)
+        return
+
+    new_folder = Folder(name=item.name, parent_id=new_parent_id, user_id=user_id, path='/legacy/')
+    db.session.add(new_folder)
+    db.session.flush()
+    for child in File.query.filter_by(parent_id=item.id, user_id=user_id).all():
+        legacy_copy(child, new_folder.id, user_id, manager)
+    for child in Folder.query.filter_by(parent_id=item.id, user_id=user_id).all():
+        legacy_copy(child, new_folder.id, user_id, manager)
+
+
+def legacy_delete(folder_id, user_id, manager):
+    """The pre-bulk delete: walk parent_id, then delete row by row."""
+    files, folders = [], []
+
+    def collect(folder_id):
+        folders.append(Folder.query.filter_by(id=folder_id, user_id=user_id).first())
+        files.extend(File.query.filter_by(parent_id=folder_id, user_id=user_id).all())
+        for subfolder in Folder.query.filter_by(parent_id=folder_id, user_id=user_id).all():
+            collect(subfolder.id)
+
+    collect(folder_id)
+    manager.delete_file([msg_id for file in files for msg_id in file.message_ids])
+    for file in files:
+        db.session.delete(file)
+    for folder in reversed(folders):
+        db.session.delete(folder)
+
+
+def measure(label, counter, run):
+    db.session.expunge_all()
+    counter.count = 0
+    start = time.perf_counter()
+    run()
+    db.session.commit()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<24} {counter.count:8d} queries {elapsed:8.2f} s")
+
+
+def run_job(user_id, kind, payload, runner):
+    job = Job(user_id=user_id, kind=kind)
+    job.payload = payload
+    db.session.add(job)
+    db.session.commit()
+    runner(job)
+
+
+def main():
+    nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    fanout = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    batch_size = Config.JOB_BATCH_SIZE
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = (
+        os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'tree.db')
+    )
+    db.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        counter = QueryCounter(db.engine)
+        manager = StubManager()
+        user = User(phone='+0000000000')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+        root_id = build_tree(user_id, nodes, fanout)
+        print(f"Tree of {nodes} nodes, {Folder.query.count()} folders")
+
+        measure("legacy copy", counter, lambda: legacy_copy(db.session.get(Folder, root_id), None, user_id, manager))
+        measure("bulk copy (job)", counter, lambda: run_job(
+            user_id, 'copy', {'items': [{'id': root_id, 'type': 'folder'}], 'new_parent_id': None},
+            lambda job: run_copy(job, batch_size)
+        ))
+
+        copies = [f.id for f in Folder.query.filter_by(parent_id=None, name='root').all() if f.id != root_id]
+        # The legacy copy left placeholder paths, give them real ones to delete by
+        backfill_folder_paths()
+
+        measure("legacy delete", counter, lambda: legacy_delete(copies[0], user_id, manager))
+        measure("bulk delete (job)", counter, lambda: run_job(
+            user_id, 'delete', {'items': [{'id': copies[1], 'type': 'folder'}]},
+            lambda job: run_delete(job, manager, batch_size)
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Compares fast_upload with a fixed 4 workers of 512KB parts against the
+adaptive worker count and part size, on a simulated link instead of
+Telegram: part requests share a fixed bandwidth, each pays a round trip,
+and more than a given number in flight earns a FloodWait.
+
+    python benchmarks/upload_benchmark.py [size_mb ...]
+
+Link parameters come from LINK_MBPS (default 40), LINK_RTT (seconds,
+default 0.1) and LINK_MAX_IN_FLIGHT (default 32; set it below
+UPLOAD_MAX_WORKERS to see the controller back off from FloodWaits).
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The client is never connected, any credentials do
+os.environ.setdefault('API_ID', '1')
+os.environ.setdefault('API_HASH', 'benchmark')
+
+from telethon import errors
+from telethon.sessions import StringSession
+
+from call_scheduler import CallScheduler
+from config import Config
+from telegram_manager import ScheduledClient, TelegramManager
+from upload_tuning import recent_uploads
+
+
+class FakeLink:
+    """
+    Stands in for the MTProto sender and Telegram's saveFilePart/saveBigFilePart
+    endpoint behind it. The bandwidth is split evenly between the requests in
+    flight when one starts.
+    """
+
+    def __init__(self, bandwidth, rtt, max_in_flight):
+        self.bandwidth = bandwidth
+        self.rtt = rtt
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.parts = {}
+
+    def send(self, request, ordered=False):
+        return asyncio.ensure_future(self.save(request))
+
+    async def save(self, request):
+        if self.in_flight >= self.max_in_flight:
+            raise errors.FloodWaitError(request=request, capture=1)
+        self.in_flight += 1
+        try:
+            await asyncio.sleep(self.rtt + len(request.bytes) * self.in_flight / self.bandwidth)
+        finally:
+            self.in_flight -= 1
+        self.parts.setdefault(request.file_id, set()).add(request.file_part)
+        return True
+
+
+def measure(label, manager, link, path, size, chunk_size=None, workers=None):
+    start = time.perf_counter()
+    input_file = manager._run(manager.fast_upload(path, chunk_size=chunk_size, workers=workers))
+    elapsed = time.perf_counter() - start
+    assert len(link.parts[input_file.id]) == input_file.parts, "parts missing"
+    report = recent_uploads()[-1]
+    print(
+        f"{label:<10} {size / 1024 / 1024:7.1f} MB {elapsed:7.2f} s {size / 1024 / 1024 / elapsed:7.2f} MB/s"
+        f"  part={report['part_size'] // 1024}KB workers peak={report['workers_peak']}"
+        f" end={report['workers_end']} decreases={report['decreases']}"
+    )
+
+
+def main():
+    sizes = [float(s) for s in sys.argv[1:]] or [3, 20, 100]
+    link = FakeLink(
+        float(os.environ.get('LINK_MBPS') or 40) * 1024 * 1024,
+        float(os.environ.get('LINK_RTT') or 0.1),
+        int(os.environ.get('LINK_MAX_IN_FLIGHT') or 32)
+    )
+    manager = TelegramManager('benchmark')
+    # A real client, so FloodWaits take the same path through Telethon as against Telegram
+    manager.client = ScheduledClient(StringSession(), 1, 'benchmark', scheduler=CallScheduler.from_config(Config))
+    manager.client._sender = link
+
+    for size_mb in sizes:
+        size = int(size_mb * 1024 * 1024)
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(os.urandom(size))
+        try:
+            measure("fixed", manager, link, f.name, size, chunk_size=512 * 1024, workers=4)
+            measure("adaptive", manager, link, f.name, size)
+        finally:
+            os.remove(f.name)
+
+
+if __name__ == '__main__':
+    main()
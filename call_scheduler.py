@@ -0,0 +1,186 @@
+"""
+Pacing of Telegram requests.
+
+Every request a client sends goes through its account's CallScheduler (see
+ScheduledClient in telegram_manager.py), which:
+
+- takes a token from the account's bucket and from the bucket of the
+  request's method, waiting while either is empty;
+- serves interactive requests (listings, auth, sending finished uploads)
+  first: bulk transfer parts only take tokens while none is waiting;
+- on a FloodWaitError parks the method for the seconds Telegram asks and
+  then retries, holding back the method's other requests meanwhile,
+  instead of failing the upload or download it belongs to;
+- retries transient network and server errors with exponential backoff
+  and full jitter, except for requests that could have sent a message.
+
+A scheduler lives on its client's event loop and is not thread safe; only
+its metrics, summed up by call_stats(), are shared.
+"""
+import asyncio
+import contextvars
+import random
+import time
+
+from telethon import errors
+
+import metrics
+
+# Errors worth retrying after a pause: dropped connections, timeouts, Telegram having internal issues,
+# and a migration, the client has switched to the account's DC by the time it raises
+TRANSIENT_ERRORS = (
+    OSError, asyncio.TimeoutError, errors.ServerError, errors.RpcCallFailError, errors.TimedOutError,
+    errors.UserMigrateError
+)
+
+# Requests that may have taken effect before failing; retrying them could send a message twice
+NOT_RETRIED = {'SendMediaRequest', 'SendMessageRequest', 'SendMultiMediaRequest', 'ForwardMessagesRequest'}
+
+# How often a bulk request held back by waiting interactive ones looks again
+_YIELD_INTERVAL = 0.01
+
+_bulk = contextvars.ContextVar('telegram_bulk', default=False)
+
+_request_seconds = metrics.histogram(
+    'telegram_request_seconds', 'Telegram requests by method, one observation per attempt', ['method']
+)
+_retries = metrics.counter('telegram_retries', 'Telegram requests retried after a transient error', ['method'])
+_flood_waits = metrics.counter('telegram_flood_waits', 'FloodWaitErrors received', ['method'])
+_flood_wait_seconds = metrics.counter('telegram_flood_wait_seconds', 'Seconds of FloodWait requested by Telegram')
+_throttled = metrics.counter('telegram_throttled', 'Telegram requests that had to wait for a rate budget', ['method'])
+reconnects = metrics.counter('telegram_reconnects', 'Reconnects after a dropped Telegram connection')
+
+
+def mark_bulk():
+    """
+    Marks the Telegram requests of the current task as bulk transfer. Call it
+    at the top of a coroutine that runs as its own task (ensure_future,
+    gather), the mark goes away with the task.
+    """
+    _bulk.set(True)
+
+
+def call_stats():
+    """Totals over every account since the process started."""
+    return {
+        'calls': _request_seconds.total(),
+        'retries': _retries.total(),
+        'flood_waits': _flood_waits.total(),
+        'flood_wait_seconds': _flood_wait_seconds.total(),
+        'throttled': _throttled.total(),
+        'reconnects': reconnects.total()
+    }
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def wait_time(self, now):
+        """Seconds until a token is available, 0 if one is now."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class CallScheduler:
+    def __init__(self, rate, burst=None, method_rates=None, max_attempts=5, backoff=0.5, max_backoff=30, max_flood_wait=3600):
+        self.account = TokenBucket(rate, burst or 2 * rate)
+        self.method_rates = method_rates or {}
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_flood_wait = max_flood_wait
+        self._methods = {}
+        # Method -> monotonic time its FloodWait ends
+        self._parked = {}
+        self._interactive_waiting = 0
+        # This account's FloodWaits, for callers adapting their pace to them
+        self.flood_waits = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            config.TELEGRAM_RATE,
+            burst=config.TELEGRAM_BURST,
+            method_rates=config.TELEGRAM_METHOD_RATES,
+            max_attempts=config.TELEGRAM_MAX_ATTEMPTS,
+            backoff=config.TELEGRAM_BACKOFF,
+            max_backoff=config.TELEGRAM_MAX_BACKOFF,
+            max_flood_wait=config.TELEGRAM_MAX_FLOOD_WAIT
+        )
+
+    def _bucket(self, method):
+        if method not in self._methods:
+            rate = self.method_rates.get(method)
+            self._methods[method] = TokenBucket(rate, 2 * rate) if rate else None
+        return self._methods[method]
+
+    async def _acquire(self, method, interactive):
+        """Waits for the budgets to allow a request of method. Returns whether it had to wait."""
+        if interactive:
+            self._interactive_waiting += 1
+        try:
+            throttled = False
+            while True:
+                now = time.monotonic()
+                wait = self._parked.get(method, 0) - now
+                if wait <= 0 and not interactive and self._interactive_waiting:
+                    wait = _YIELD_INTERVAL
+                if wait <= 0:
+                    bucket = self._bucket(method)
+                    wait = max(self.account.wait_time(now), bucket.wait_time(now) if bucket else 0)
+                    if wait <= 0:
+                        self.account.take()
+                        if bucket:
+                            bucket.take()
+                        return throttled
+                if not throttled:
+                    throttled = True
+                    _throttled.inc(method=method)
+                await asyncio.sleep(wait)
+        finally:
+            if interactive:
+                self._interactive_waiting -= 1
+
+    async def call(self, method, send, reconnect=None):
+        """
+        Awaits send() once the budgets allow a request of method, retrying
+        through FloodWaits and transient errors. reconnect, if given, is
+        awaited before retrying a request that failed on a dropped connection.
+        """
+        interactive = not _bulk.get()
+        attempt = 0
+        while True:
+            queued = time.monotonic()
+            if await self._acquire(method, interactive):
+                metrics.record_span(f'{method} (queued)', queued)
+            try:
+                with metrics.span(method), _request_seconds.time(method=method):
+                    return await send()
+            except errors.FloodWaitError as e:
+                if e.seconds > self.max_flood_wait:
+                    raise
+                print(f"CallScheduler: FloodWait of {e.seconds}s on {method}, parking it")
+                self.flood_waits += 1
+                _flood_waits.inc(method=method)
+                _flood_wait_seconds.inc(e.seconds)
+                self._parked[method] = max(self._parked.get(method, 0), time.monotonic() + e.seconds + 1)
+            except TRANSIENT_ERRORS as e:
+                attempt += 1
+                if attempt >= self.max_attempts or method in NOT_RETRIED:
+                    raise
+                _retries.inc(method=method)
+                if reconnect is not None and isinstance(e, ConnectionError):
+                    reconnects.inc()
+                    try:
+                        await reconnect()
+                    except Exception as connect_err:
+                        print(f"CallScheduler: reconnect failed: {connect_err}")
+                await asyncio.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1))))
@@ -14,3 +14,109 @@ class Config:
     BOT_TOKEN = os.environ.get('BOT_TOKEN')
     # Chat ID to store files (can be a channel or "me")
     STORAGE_CHAT_ID = os.environ.get('STORAGE_CHAT_ID') or "me"
+
+    # Size of each chunk pulled from Telegram while streaming a download.
+    # Bounds the memory held per in-flight download.
+    DOWNLOAD_CHUNK_SIZE = int(os.environ.get('DOWNLOAD_CHUNK_SIZE') or 512 * 1024)
+    # Concurrent GetFileRequest workers per download, and how many MTProto
+    # connections they are spread over (1 shares the client's own connection)
+    DOWNLOAD_WORKERS = int(os.environ.get('DOWNLOAD_WORKERS') or 4)
+    DOWNLOAD_CONNECTIONS = int(os.environ.get('DOWNLOAD_CONNECTIONS') or 1)
+
+    # On-disk cache of downloaded bytes (see part_cache.py): where it lives,
+    # how many bytes it may use (0 turns it off), and the size of its blocks
+    PART_CACHE_DIR = os.environ.get('PART_CACHE_DIR') or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'cache', 'parts'
+    )
+    PART_CACHE_SIZE = int(os.environ.get('PART_CACHE_SIZE') or 1024 * 1024 * 1024)
+    PART_CACHE_BLOCK_SIZE = int(os.environ.get('PART_CACHE_BLOCK_SIZE') or 1024 * 1024)
+    # Seconds a download waits for a block another one is fetching before
+    # fetching it from Telegram itself
+    PART_CACHE_WAIT_TIMEOUT = int(os.environ.get('PART_CACHE_WAIT_TIMEOUT') or 30)
+
+    # Chunked uploads: size of each client chunk (rounded to 512KB Telegram
+    # parts), and how long an unfinished upload session is kept around
+    UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE') or 4 * 1024 * 1024)
+    UPLOAD_SESSION_TTL = int(os.environ.get('UPLOAD_SESSION_TTL') or 24 * 60 * 60)
+    # Concurrent part uploads per incoming chunk, and how many read-ahead parts
+    # may wait in memory before reading the request body pauses
+    UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS') or 4)
+    # Uploads from disk start at UPLOAD_WORKERS parts in flight and adapt up
+    # to this many (see upload_tuning.py)
+    UPLOAD_MAX_WORKERS = int(os.environ.get('UPLOAD_MAX_WORKERS') or 16)
+    # Files above 2000MB are stored as several documents: how many of them
+    # upload at once, sharing one limit on parts in flight
+    UPLOAD_PARALLEL_DOCUMENTS = int(os.environ.get('UPLOAD_PARALLEL_DOCUMENTS') or 3)
+    UPLOAD_QUEUE_PARTS = int(os.environ.get('UPLOAD_QUEUE_PARTS') or 8)
+    # Request threads of the waitress server (wsgi.py; pass the same number as
+    # --threads to waitress-serve)
+    SERVER_THREADS = int(os.environ.get('SERVER_THREADS') or 16)
+    # Upload requests a single user may have pushing to Telegram at once; more
+    # are turned away with 429 and told to retry after UPLOAD_RETRY_AFTER seconds.
+    # Each one holds a server thread, so by default a user gets half of them
+    UPLOAD_USER_CONCURRENCY = int(os.environ.get('UPLOAD_USER_CONCURRENCY') or max(1, SERVER_THREADS // 2))
+    UPLOAD_RETRY_AFTER = int(os.environ.get('UPLOAD_RETRY_AFTER') or 2)
+
+    # Small-file packing: files below PACK_THRESHOLD bytes are uploaded in
+    # batches of at most PACK_MAX_FILES files and PACK_MAX_SIZE bytes, each
+    # stored as one Telegram document (0 turns packing off). Packs whose live
+    # bytes drop below PACK_COMPACT_RATIO of their size are rewritten.
+    PACK_THRESHOLD = int(os.environ.get('PACK_THRESHOLD') or 1024 * 1024)
+    PACK_MAX_FILES = int(os.environ.get('PACK_MAX_FILES') or 200)
+    PACK_MAX_SIZE = int(os.environ.get('PACK_MAX_SIZE') or 32 * 1024 * 1024)
+    PACK_COMPACT_RATIO = float(os.environ.get('PACK_COMPACT_RATIO') or 0.5)
+
+    # Pacing of Telegram requests, per account (see call_scheduler.py):
+    # requests per second and burst, plus tighter per-method rates given as
+    # "Method=rate" pairs separated by commas
+    TELEGRAM_RATE = float(os.environ.get('TELEGRAM_RATE') or 30)
+    TELEGRAM_BURST = int(os.environ.get('TELEGRAM_BURST') or 60)
+    TELEGRAM_METHOD_RATES = {
+        method.strip(): float(rate)
+        for method, rate in (
+            pair.split('=') for pair in (
+                os.environ.get('TELEGRAM_METHOD_RATES')
+                or 'SendMediaRequest=5,EditMessageRequest=5,ForwardMessagesRequest=2,DeleteMessagesRequest=4'
+            ).split(',') if pair.strip()
+        )
+    }
+    # Transient errors are retried up to TELEGRAM_MAX_ATTEMPTS times, backing
+    # off from TELEGRAM_BACKOFF up to TELEGRAM_MAX_BACKOFF seconds; FloodWaits
+    # longer than TELEGRAM_MAX_FLOOD_WAIT seconds fail instead of waiting
+    TELEGRAM_MAX_ATTEMPTS = int(os.environ.get('TELEGRAM_MAX_ATTEMPTS') or 5)
+    TELEGRAM_BACKOFF = float(os.environ.get('TELEGRAM_BACKOFF') or 0.5)
+    TELEGRAM_MAX_BACKOFF = float(os.environ.get('TELEGRAM_MAX_BACKOFF') or 30)
+    TELEGRAM_MAX_FLOOD_WAIT = int(os.environ.get('TELEGRAM_MAX_FLOOD_WAIT') or 15 * 60)
+
+    # Background threads hosting the asyncio loops all Telegram clients run on
+    TELEGRAM_RUNTIME_THREADS = int(os.environ.get('TELEGRAM_RUNTIME_THREADS') or 1)
+
+    # Manager pool: most connected clients kept at once, seconds before an idle
+    # (or abandoned pending login) client is dropped, and keepalive period
+    MANAGER_POOL_SIZE = int(os.environ.get('MANAGER_POOL_SIZE') or 200)
+    MANAGER_IDLE_TIMEOUT = int(os.environ.get('MANAGER_IDLE_TIMEOUT') or 15 * 60)
+    PENDING_LOGIN_TIMEOUT = int(os.environ.get('PENDING_LOGIN_TIMEOUT') or 10 * 60)
+    MANAGER_KEEPALIVE_INTERVAL = int(os.environ.get('MANAGER_KEEPALIVE_INTERVAL') or 60)
+    # Seconds a successful is_user_authorized check is trusted before asking again
+    AUTH_CACHE_TTL = int(os.environ.get('AUTH_CACHE_TTL') or 5 * 60)
+
+    # Bearer token /metrics requires (it is off while unset); and whether requests
+    # sent with an X-Trace header get a Server-Timing breakdown of their Telegram calls (1 on)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    REQUEST_TRACING = int(os.environ.get('REQUEST_TRACING') or 0)
+
+    # Most items a single /api/files page may return
+    LIST_PAGE_LIMIT = int(os.environ.get('LIST_PAGE_LIMIT') or 1000)
+    # Serialized listings kept in memory, see listing_cache.py
+    LISTING_CACHE_SIZE = int(os.environ.get('LISTING_CACHE_SIZE') or 2000)
+
+    # Background copy/delete jobs: worker threads, and items handled per
+    # checkpointed step (each step is one commit; keep it under SQLite's
+    # 999 parameters per statement)
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS') or 2)
+    JOB_BATCH_SIZE = int(os.environ.get('JOB_BATCH_SIZE') or 500)
+    # Seconds a running job may go without a checkpoint before another worker
+    # takes it over, as if its process had died
+    JOB_LEASE_TIMEOUT = int(os.environ.get('JOB_LEASE_TIMEOUT') or 15 * 60)
+    # Longest a /api/jobs/<id>/events stream stays open, clients reconnect after
+    JOB_EVENTS_TIMEOUT = int(os.environ.get('JOB_EVENTS_TIMEOUT') or 30)
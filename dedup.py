@@ -0,0 +1,139 @@
+"""
+Content-addressed deduplication.
+
+Uploads are hashed while they stream through, chunk by chunk (see
+content_hash), and the user's files with the same content share a Blob: a
+row keyed by (user, hash) counting the files that point at it. A file whose
+content is already stored takes the parts of a stored copy instead of new
+Telegram messages, and copies share their source's parts the same way.
+
+Blob.ref_count is changed with relative UPDATEs and a blob goes when it
+drops to zero. The Telegram messages themselves are deleted once no file
+refers to them, see tree_ops.release_messages. Deletes change the refs of
+their files' blobs before looking for unused messages, so whoever takes a
+stored file's parts locks its blob first (lock_blobs): the parts are then
+either still referenced when the delete looks, or already gone when read.
+"""
+import hashlib
+from collections import Counter
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Blob, File, FilePart, generate_codeword
+
+_blob_table = Blob.__table__
+_add_refs = (
+    db.update(_blob_table)
+    .where(_blob_table.c.id == db.bindparam('blob_id'))
+    .values(ref_count=_blob_table.c.ref_count + db.bindparam('delta'))
+)
+
+
+def chunk_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def content_hash(chunk_digests, chunk_size):
+    """
+    Hash of a file from the hex digests of its chunk_size chunks, in order.
+    Chunks can be hashed as they arrive, in any order, and the chunk size is
+    part of the hash so files cut differently never match by accident.
+    """
+    outer = hashlib.sha256(f'{chunk_size}:'.encode())
+    for digest in chunk_digests:
+        outer.update(bytes.fromhex(digest))
+    return outer.hexdigest()
+
+
+def hash_bytes(data, chunk_size):
+    """content_hash of data held in memory. An empty file is one empty chunk, as in UploadSession."""
+    return content_hash(
+        [chunk_digest(data[i:i + chunk_size]) for i in range(0, max(len(data), 1), chunk_size)],
+        chunk_size
+    )
+
+
+def lock_blobs(*conditions):
+    """
+    Locks the blobs matching conditions until the transaction ends. A no-op
+    UPDATE rather than SELECT ... FOR UPDATE, which SQLite ignores: there it
+    takes the database's write lock instead.
+    """
+    db.session.execute(db.update(_blob_table).where(*conditions).values(ref_count=_blob_table.c.ref_count))
+
+
+def stored_copies(user_id, contents):
+    """
+    content hash -> (message id, start, end, message offset) spans of a stored
+    file with it, for those the user has. The blobs found stay locked until
+    the caller commits the files taking those spans, so it must not wait on
+    Telegram in between. Nothing is locked when nothing is found.
+    """
+    blob_ids = list(db.session.scalars(
+        db.select(Blob.id).where(Blob.user_id == user_id, Blob.hash.in_(set(contents)))
+    ))
+    if not blob_ids:
+        return {}
+    # Read again under the lock, a delete may have taken some meanwhile
+    lock_blobs(Blob.id.in_(blob_ids))
+    file_ids = dict(
+        db.session.query(Blob.hash, db.func.min(File.id))
+        .join(File, File.blob_id == Blob.id)
+        .filter(Blob.id.in_(blob_ids))
+        .group_by(Blob.hash)
+    )
+    if not file_ids:
+        return {}
+    spans = {file_id: [] for file_id in file_ids.values()}
+    for part in FilePart.query.filter(FilePart.file_id.in_(spans)).order_by(FilePart.file_id, FilePart.part_index):
+        spans[part.file_id].append((part.message_id, part.offset, part.offset + part.size, part.message_offset))
+    return {content: spans[file_id] for content, file_id in file_ids.items()}
+
+
+def add_blob_refs(deltas):
+    """Applies deltas, blob id -> files added (or removed, if negative), dropping blobs left unreferenced."""
+    rows = [{'blob_id': blob_id, 'delta': delta} for blob_id, delta in deltas.items() if blob_id is not None and delta]
+    if not rows:
+        return
+    db.session.execute(_add_refs, rows)
+    if any(row['delta'] < 0 for row in rows):
+        Blob.query.filter(Blob.id.in_([row['blob_id'] for row in rows]), Blob.ref_count <= 0).delete(
+            synchronize_session=False
+        )
+
+
+def attach_blobs(user_id, files):
+    """Points files, a list of (new File, content hash), at the blobs of their content, creating the missing ones."""
+    if not files:
+        return
+
+    def existing():
+        contents = {content for _, content in files}
+        return dict(db.session.query(Blob.hash, Blob.id).filter(Blob.user_id == user_id, Blob.hash.in_(contents)))
+
+    blob_ids = existing()
+    sizes = {content: new_file.size for new_file, content in files if content not in blob_ids}
+    if sizes:
+        rows = [
+            {'id': generate_codeword(), 'user_id': user_id, 'hash': content, 'size': size, 'ref_count': 0}
+            for content, size in sizes.items()
+        ]
+        # Flushed first so a concurrent upload of the same content only undoes the blobs
+        db.session.flush()
+        try:
+            with db.session.begin_nested():
+                db.session.execute(db.insert(Blob), rows)
+            blob_ids.update((row['hash'], row['id']) for row in rows)
+        except IntegrityError:
+            # A concurrent upload created some of them, add the others one by one
+            for row in rows:
+                try:
+                    with db.session.begin_nested():
+                        db.session.execute(db.insert(Blob), [row])
+                except IntegrityError:
+                    pass
+            blob_ids = existing()
+
+    for new_file, content in files:
+        new_file.blob_id = blob_ids[content]
+    add_blob_refs(Counter(blob_ids[content] for _, content in files))
@@ -0,0 +1,271 @@
+"""
+Background jobs for long-running tree operations.
+
+/api/copy and /api/delete only record a Job row, and deletes that leave
+packs sparse queue a compact job. A small pool of worker threads plans the
+work into Job.state once, then runs it in batches and commits Job.done after
+each one, so a job interrupted by a restart resumes where it stopped.
+
+Workers only run in the server process (wsgi.py, or app.py run directly),
+and a job is claimed with a conditional UPDATE before it runs, so two
+processes never run the same job. The claim is a lease renewed by every
+checkpoint: a running job whose lease ran out (its process died) is claimed
+again by the next worker that looks.
+"""
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+import metrics
+from models import db, File, Folder, Job, User
+from packing import sparse_packs, compact_packs, release_packs
+from telegram_manager import get_manager
+from tree_ops import subtree_rows, delete_files, delete_subtree, create_folders, copy_files
+
+
+class JobRunner:
+    def __init__(self):
+        self.app = None
+        self._queue = queue.Queue()
+        self._started = False
+        self._scan_lock = threading.Lock()
+        self._scanned_at = 0
+
+    def init_app(self, app):
+        self.app = app
+
+    def start(self):
+        """Starts the worker threads, once per process, and picks up unfinished jobs."""
+        if self._started:
+            return
+        self._started = True
+        for i in range(self.app.config['JOB_WORKERS']):
+            threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True).start()
+        self._queue_unfinished()
+
+    def submit(self, job):
+        self._queue.put(job.id)
+
+    def _queue_unfinished(self):
+        """Queues whatever is queued or running, those another worker holds are skipped when claimed."""
+        with self._scan_lock:
+            self._scanned_at = time.monotonic()
+            with self.app.app_context():
+                unfinished = db.session.scalars(
+                    db.select(Job.id).where(Job.status.in_(('queued', 'running'))).order_by(Job.created_at)
+                ).all()
+            for job_id in unfinished:
+                self._queue.put(job_id)
+
+    def _work(self):
+        lease = self.app.config['JOB_LEASE_TIMEOUT']
+        while True:
+            try:
+                job_id = self._queue.get(timeout=lease / 2)
+            except queue.Empty:
+                # Jobs of a process that died, or submitted by one without workers
+                if time.monotonic() - self._scanned_at >= lease / 2:
+                    self._queue_unfinished()
+                continue
+            with self.app.app_context():
+                try:
+                    run_job(job_id, self.app.config)
+                except Exception as e:
+                    print(f"JobRunner: job {job_id} crashed: {e}")
+
+
+job_runner = JobRunner()
+
+metrics.gauge('jobs_queued', 'Background jobs waiting for a worker', lambda: job_runner._queue.qsize())
+
+
+def claim_job(job_id, lease):
+    """
+    Marks the job running if it is queued, or running under a lease older
+    than lease seconds. Returns whether this worker got it.
+    """
+    now = datetime.utcnow()
+    claimed = db.session.execute(
+        db.update(Job)
+        .where(
+            Job.id == job_id,
+            db.or_(
+                Job.status == 'queued',
+                db.and_(Job.status == 'running', Job.updated_at < now - timedelta(seconds=lease))
+            )
+        )
+        .values(status='running', updated_at=now)
+    ).rowcount
+    db.session.commit()
+    return claimed == 1
+
+
+def run_job(job_id, config):
+    if not claim_job(job_id, config['JOB_LEASE_TIMEOUT']):
+        return
+    job = db.session.get(Job, job_id)
+
+    try:
+        user = User.query.get(job.user_id)
+        manager = get_manager(user.id, session_string=user.session_string)
+        if job.kind == 'copy':
+            run_copy(job, config['JOB_BATCH_SIZE'])
+        elif job.kind == 'delete':
+            run_delete(job, manager, config['JOB_BATCH_SIZE'])
+        elif job.kind == 'compact':
+            run_compact(job, manager, config)
+        else:
+            raise Exception(f"Unknown job kind {job.kind}")
+        job.status = 'done'
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        job = Job.query.get(job_id)
+        job.status = 'failed'
+        job.error = str(e)
+        db.session.commit()
+        return
+
+    # Deleted files may have left holes in their packs
+    if job.kind == 'delete':
+        queue_compaction(job.user_id, config)
+
+
+def checkpoint(job, done):
+    """
+    Saves progress together with the batch's own changes, in one commit.
+    Jobs work through the plan in Job.state in order, so job.done is also
+    where a resumed job picks up.
+    """
+    job.done = done
+    # Renews the claim on the job
+    job.updated_at = datetime.utcnow()
+    db.session.commit()
+
+
+def run_delete(job, manager, batch_size):
+    state = job.state
+    if 'files' not in state:
+        file_ids, folder_ids = [], []
+        for item in job.payload['items']:
+            if item['type'] == 'folder':
+                folder = Folder.query.filter_by(id=item['id'], user_id=job.user_id).first()
+                if folder:
+                    _, files = subtree_rows(folder, job.user_id)
+                    file_ids += [f.id for f in files]
+                    folder_ids.append(folder.id)
+            else:
+                file_ids.append(item['id'])
+
+        # Files go first in batches (their Telegram messages are deleted with
+        # them), then each selected folder with its whole subtree at once
+        state = {'files': file_ids, 'folders': folder_ids}
+        job.state = state
+        job.total = len(file_ids) + len(folder_ids)
+        checkpoint(job, 0)
+
+    files, folders = state['files'], state['folders']
+    while job.done < len(files):
+        batch = files[job.done:job.done + batch_size]
+        delete_files(batch, job.user_id, manager)
+        checkpoint(job, job.done + len(batch))
+
+    while job.done < job.total:
+        start = job.done - len(files)
+        batch = folders[start:start + batch_size]
+        for folder_id in batch:
+            delete_subtree(folder_id, job.user_id, manager)
+        checkpoint(job, job.done + len(batch))
+
+
+def run_copy(job, batch_size):
+    state = job.state
+    if 'files' not in state:
+        # [source id, source parent id(, name)], the parent is None for the copied items themselves
+        folders_plan, files_plan = [], []
+        for item in job.payload['items']:
+            if item['type'] == 'folder':
+                folder = Folder.query.filter_by(id=item['id'], user_id=job.user_id).first()
+                if folder:
+                    folders, files = subtree_rows(folder, job.user_id)
+                    folders_plan += [[f.id, f.parent_id if f.id != folder.id else None, f.name] for f in folders]
+                    files_plan += [[f.id, f.parent_id] for f in files]
+            else:
+                files_plan.append([item['id'], None])
+
+        state = {
+            'folders': folders_plan,
+            'files': files_plan,
+            # Source folder id -> id of its copy
+            'folder_map': {}
+        }
+        job.state = state
+        job.total = len(folders_plan) + len(files_plan)
+        checkpoint(job, 0)
+
+    target_id = job.payload.get('new_parent_id')
+    folders, files = state['folders'], state['files']
+
+    if job.done < len(folders):
+        # The folder structure is database only, so it is copied in one go
+        target = Folder.query.filter_by(id=target_id, user_id=job.user_id).first() if target_id else None
+        if target_id and not target:
+            raise Exception("Destination folder not found")
+        state['folder_map'] = create_folders(folders, job.user_id, target)
+        job.state = state
+        checkpoint(job, len(folders))
+
+    while job.done < job.total:
+        start = job.done - len(folders)
+        batch = files[start:start + batch_size]
+        # By key, then by owner, see owned_files
+        sources = {f.id: f for f in db.session.query(
+            File.id, File.user_id, File.name, File.size, File.mime_type, File.blob_id
+        ).filter(File.id.in_([source_id for source_id, _ in batch])) if f.user_id == job.user_id}
+
+        pending_files = []
+        for source_id, source_parent in batch:
+            parent_id = target_id if source_parent is None else state['folder_map'].get(source_parent)
+            # Skip anything removed (or whose folder was) since the job was planned
+            if source_id not in sources or (source_parent is not None and parent_id is None):
+                continue
+            pending_files.append((sources[source_id], parent_id))
+        copy_files(pending_files, job.user_id)
+        checkpoint(job, job.done + len(batch))
+
+
+def queue_compaction(user_id, config):
+    """Queues a compact job if the user has sparse packs and none is pending yet."""
+    pending = Job.query.filter(
+        Job.user_id == user_id, Job.kind == 'compact', Job.status.in_(('queued', 'running'))
+    ).first()
+    if pending or not sparse_packs(user_id, config['PACK_COMPACT_RATIO'], config['PACK_MAX_SIZE']):
+        return
+    job = Job(user_id=user_id, kind='compact')
+    db.session.add(job)
+    db.session.commit()
+    job_runner.submit(job)
+
+
+def run_compact(job, manager, config):
+    state = job.state
+    if 'groups' not in state:
+        # Pack ids, one group per new pack
+        state = {'groups': sparse_packs(job.user_id, config['PACK_COMPACT_RATIO'], config['PACK_MAX_SIZE'])}
+        job.state = state
+        job.total = len(state['groups'])
+        checkpoint(job, 0)
+
+    # Old packs of groups done before a crash may still be around
+    for group in state['groups'][:job.done]:
+        release_packs(group, job.user_id, manager)
+        db.session.commit()
+
+    while job.done < job.total:
+        group = state['groups'][job.done]
+        compact_packs(group, job.user_id, manager, config['DOWNLOAD_CHUNK_SIZE'])
+        # The new pack and the repointed parts are committed before the old packs go
+        checkpoint(job, job.done + 1)
+        release_packs(group, job.user_id, manager)
+        db.session.commit()
@@ -0,0 +1,109 @@
+"""
+Versioned in-process cache of folder listings and storage usage.
+
+Every (user, folder) listing and every user's storage usage has a version,
+which mutations bump through invalidate(). The version goes into the ETag,
+so clients revalidating an unchanged listing get a 304, and into the cache
+key of the serialized response, so repeated reads need neither a query
+nor JSON encoding.
+
+Invalidations are held on the database session and applied once it
+commits: bumping earlier would let a concurrent reader cache the old rows
+under the new version. Like the other caches in this app, it only sees
+changes made by this process.
+"""
+import secrets
+import threading
+from collections import OrderedDict
+from itertools import count
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db
+
+
+class ListingCache:
+    def __init__(self, max_entries=2000, max_versions=100000):
+        self.max_entries = max_entries
+        self.max_versions = max_versions
+        # ETags from an earlier run (or another process) never match
+        self._epoch = secrets.token_hex(4)
+        self._lock = threading.Lock()
+        self._counter = count(1)
+        self._versions = OrderedDict()
+        # Version of keys without an entry, raised whenever one is evicted so
+        # a forgotten key never goes back to a version handed out before
+        self._floor = 0
+        self._entries = OrderedDict()
+
+    def init_app(self, app):
+        self.max_entries = app.config['LISTING_CACHE_SIZE']
+
+    def version(self, key):
+        with self._lock:
+            return self._versions.get(key, self._floor)
+
+    def bump(self, keys):
+        with self._lock:
+            for key in keys:
+                self._versions[key] = next(self._counter)
+                self._versions.move_to_end(key)
+            while len(self._versions) > self.max_versions:
+                self._versions.popitem(last=False)
+                self._floor = next(self._counter)
+
+    def etag(self, user_id, version):
+        return f"{self._epoch}-{user_id}-{version}"
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        with self._lock:
+            self._entries[key] = body
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'versions': len(self._versions)}
+
+
+listing_cache = ListingCache()
+
+
+def folder_key(user_id, folder_id):
+    return ('folder', user_id, folder_id)
+
+
+def storage_key(user_id):
+    return ('storage', user_id)
+
+
+def invalidate(user_id, folder_ids=(), storage=False):
+    """
+    Marks the listings of folder_ids (None is the root) and, with storage, the
+    user's usage as changed once the current transaction commits.
+    """
+    pending = db.session.info.setdefault('listing_invalidations', set())
+    pending.update(folder_key(user_id, folder_id) for folder_id in folder_ids)
+    if storage:
+        pending.add(storage_key(user_id))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_invalidations(session):
+    pending = session.info.pop('listing_invalidations', None)
+    if pending:
+        listing_cache.bump(pending)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_invalidations(session):
+    session.info.pop('listing_invalidations', None)
@@ -0,0 +1,264 @@
+"""
+Prometheus-style metrics, rendered in the text exposition format at /metrics.
+
+Counters and histograms are recorded where the work happens; gauges are
+callbacks read at scrape time. Values are per process, like the caches.
+
+Tracing: while a trace is started for a request (see app.py), span() records
+the time of every Telegram call made on its behalf, on the runtime loops too,
+since asyncio tasks inherit the context of the thread that submitted them.
+"""
+import abc
+import contextlib
+import contextvars
+import functools
+import inspect
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+_lock = threading.Lock()
+_registry = []
+
+_trace = contextvars.ContextVar('trace', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format(name, labels, value):
+    if labels:
+        name += '{' + ','.join(f'{key}="{_escape(val)}"' for key, val in labels.items()) + '}'
+    return f'{name} {value}'
+
+
+class _Metric(abc.ABC):
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Label values -> value
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _labels(self, key):
+        return dict(zip(self.labelnames, key))
+
+    @abc.abstractmethod
+    def samples(self):
+        """Yields (name, labels, value) for each line of the metric."""
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def total(self):
+        """Sum over every label combination."""
+        with _lock:
+            return sum(self._values.values())
+
+    def samples(self):
+        with _lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield self.name + '_total', self._labels(key), value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            # Per-bucket counts, sum, count
+            state = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def total(self):
+        """Observations over every label combination."""
+        with _lock:
+            return sum(count for _, _, count in self._values.values())
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def samples(self):
+        with _lock:
+            values = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        for key, counts, total, count in values:
+            labels = self._labels(key)
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield self.name + '_bucket', dict(labels, le=repr(float(bound))), bucket_count
+            yield self.name + '_bucket', dict(labels, le='+Inf'), count
+            yield self.name + '_sum', labels, total
+            yield self.name + '_count', labels, count
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, read):
+        super().__init__(name, documentation)
+        self.read = read
+
+    def samples(self):
+        yield self.name, {}, self.read()
+
+
+def _register(metric):
+    with _lock:
+        _registry.append(metric)
+    return metric
+
+
+def counter(name, documentation, labelnames=()):
+    return _register(Counter(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram(name, documentation, labelnames, buckets))
+
+
+def gauge(name, documentation, read):
+    """Registers a gauge whose value is read() at scrape time."""
+    return _register(Gauge(name, documentation, read))
+
+
+def render():
+    """Every registered metric in the Prometheus text format."""
+    with _lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        try:
+            samples = list(metric.samples())
+        except Exception as e:
+            print(f"metrics: could not read {metric.name}: {e}")
+            continue
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(_format(name, labels, value) for name, labels, value in samples)
+    return '\n'.join(lines) + '\n'
+
+
+def instrument(seconds, failures):
+    """
+    Class decorator timing every public method into the histogram seconds,
+    and counting exceptions in the counter failures, both labelled by
+    method. Coroutines are timed until they finish, returned generators
+    until they are exhausted or closed. Each call is a trace span as well.
+    """
+    def wrap(name, method):
+        def finish(start, failed):
+            seconds.observe(time.monotonic() - start, method=name)
+            if failed:
+                failures.inc(method=name)
+            record_span(name, start)
+
+        if inspect.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def timed_async(*args, **kwargs):
+                start, failed = time.monotonic(), True
+                try:
+                    result = await method(*args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    finish(start, failed)
+            return timed_async
+
+        def timed_generator(generator, start):
+            failed = True
+            try:
+                yield from generator
+                failed = False
+            except GeneratorExit:
+                failed = False
+                raise
+            finally:
+                finish(start, failed)
+
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            start = time.monotonic()
+            try:
+                result = method(*args, **kwargs)
+            except BaseException:
+                finish(start, True)
+                raise
+            if inspect.isgenerator(result):
+                return timed_generator(result, start)
+            finish(start, False)
+            return result
+        return timed
+
+    def decorate(cls):
+        for name, member in list(vars(cls).items()):
+            if not name.startswith('_') and inspect.isfunction(member):
+                setattr(cls, name, wrap(name, member))
+        return cls
+    return decorate
+
+
+def start_trace():
+    """Starts collecting spans for the current request. Returns the list they go to."""
+    spans = []
+    _trace.set(spans)
+    return spans
+
+
+def stop_trace():
+    _trace.set(None)
+
+
+def record_span(name, start):
+    """Records a span from start (a time.monotonic() value) until now, if the current request is traced."""
+    spans = _trace.get()
+    if spans is not None:
+        spans.append((name, start, time.monotonic() - start))
+
+
+@contextlib.contextmanager
+def span(name):
+    """Records the time spent in the block, if the current request is traced."""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        record_span(name, start)
+
+
+def server_timing(spans):
+    """Spans summed up by name as a Server-Timing header value, slowest first."""
+    totals = {}
+    for name, _, seconds in spans:
+        count, total = totals.get(name, (0, 0.0))
+        totals[name] = (count + 1, total + seconds)
+    ordered = sorted(totals.items(), key=lambda item: -item[1][1])
+    return ', '.join(
+        f'{name};dur={total * 1000:.1f};desc="{count} calls"' for name, (count, total) in ordered
+    )
@@ -0,0 +1,163 @@
+"""
+In-place upgrades for databases created by an older version.
+
+db.create_all() adds missing tables but never alters existing ones, so
+columns added later are created and backfilled here on startup.
+"""
+from sqlalchemy import inspect, text
+
+import json
+
+from models import db, File, FilePart, Folder
+from telegram_manager import part_spans
+from usage import reconcile
+
+
+def has_column(table, column):
+    return column in [c['name'] for c in inspect(db.engine).get_columns(table)]
+
+
+def add_column(table, column, ddl):
+    """Adds column to table unless it exists. Returns whether it was added."""
+    if has_column(table, column):
+        return False
+    print(f"Migrating: adding {table}.{column}")
+    with db.engine.begin() as conn:
+        # Quoted, "user" is a reserved word in PostgreSQL
+        conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}'))
+    return True
+
+
+def drop_column(table, column):
+    """Drops column in the session's transaction, the caller commits."""
+    print(f"Migrating: dropping {table}.{column}")
+    db.session.execute(text(f'ALTER TABLE "{table}" DROP COLUMN {column}'))
+
+
+def drop_not_null(table, column):
+    """Lets rows be inserted without column. PostgreSQL only, SQLite cannot alter a column."""
+    if db.engine.dialect.name != 'postgresql':
+        return
+    with db.engine.begin() as conn:
+        conn.execute(text(f'ALTER TABLE "{table}" ALTER COLUMN {column} DROP NOT NULL'))
+
+
+def drop_index(table, name):
+    if name not in [index['name'] for index in inspect(db.engine).get_indexes(table)]:
+        return
+    print(f"Migrating: dropping index {name}")
+    with db.engine.begin() as conn:
+        conn.execute(text(f'DROP INDEX {name}'))
+
+
+def use_bytewise_collation(table, column, ddl):
+    """Makes PostgreSQL compare column bytewise, as SQLite always does."""
+    if db.engine.dialect.name != 'postgresql':
+        return
+    with db.engine.begin() as conn:
+        collation = conn.execute(
+            text("SELECT collation_name FROM information_schema.columns WHERE table_name = :table AND column_name = :column"),
+            {'table': table, 'column': column}
+        ).scalar()
+        if collation != 'C':
+            print(f"Migrating: collating {table}.{column} bytewise")
+            conn.execute(text(f'ALTER TABLE "{table}" ALTER COLUMN {column} TYPE {ddl} COLLATE "C"'))
+
+
+def create_indexes(model, column):
+    for index in model.__table__.indexes:
+        if column in index.columns:
+            index.create(db.engine, checkfirst=True)
+
+
+def backfill_folder_paths():
+    """Computes Folder.path for every folder from the parent_id links."""
+    parents = dict(db.session.query(Folder.id, Folder.parent_id).all())
+    paths = {}
+
+    def path_of(folder_id):
+        if folder_id not in paths:
+            # Walk up iteratively, deep trees would overflow the recursion limit
+            chain = []
+            current = folder_id
+            while current is not None and current not in paths:
+                chain.append(current)
+                current = parents.get(current)
+            prefix = paths[current] if current is not None else '/'
+            for node in reversed(chain):
+                prefix = paths[node] = prefix + node + '/'
+        return paths[folder_id]
+
+    db.session.bulk_update_mappings(Folder, [
+        {'id': folder_id, 'path': path_of(folder_id)} for folder_id in parents
+    ])
+    db.session.commit()
+    print(f"Migrating: backfilled paths of {len(parents)} folders")
+
+
+def move_message_ids_to_parts(batch_size=1000):
+    """
+    Copies the JSON file._message_ids lists into FilePart rows, with their
+    byte spans, and drops the column in the same transaction: a run that
+    stops halfway leaves nothing behind. Files added while the column was
+    nullable have NULL there and their parts already.
+    """
+    select = text(
+        "SELECT id, size, _message_ids FROM file WHERE id > :after AND _message_ids IS NOT NULL "
+        "ORDER BY id LIMIT :limit"
+    )
+    moved, after = 0, ''
+    while True:
+        rows = db.session.execute(select, {'after': after, 'limit': batch_size}).all()
+        if not rows:
+            break
+        # Parts an earlier version of this migration committed before failing to drop the column
+        FilePart.query.filter(FilePart.file_id.in_([file_id for file_id, _, _ in rows])).delete(
+            synchronize_session=False
+        )
+        parts = [
+            {'file_id': file_id, 'part_index': i, 'message_id': msg_id, 'offset': start, 'size': end - start}
+            for file_id, size, raw in rows
+            for i, (msg_id, start, end, _) in enumerate(part_spans(size or 0, json.loads(raw)))
+        ]
+        if parts:
+            db.session.execute(db.insert(FilePart), parts)
+        moved += len(rows)
+        after = rows[-1][0]
+    print(f"Migrating: moving message ids of {moved} files to file_part")
+    drop_column('file', '_message_ids')
+    db.session.commit()
+
+
+def upgrade():
+    if add_column('folder', 'path', "VARCHAR(2048) NOT NULL DEFAULT ''"):
+        backfill_folder_paths()
+    # Subtrees are ranges of paths: compared bytewise, on a (user_id, path) index
+    use_bytewise_collation('folder', 'path', 'VARCHAR(2048)')
+    drop_index('folder', 'ix_folder_path')
+    create_indexes(Folder, 'path')
+
+    # Usage counters, computed once from the files
+    added_used = add_column('user', 'used_bytes', "BIGINT NOT NULL DEFAULT 0")
+    added_size = add_column('folder', 'size', "BIGINT NOT NULL DEFAULT 0")
+    if added_used or added_size:
+        users, folders = reconcile()
+        print(f"Migrating: computed usage of {users} users and {folders} folders")
+
+    # Message ids from a JSON text column to the file_part table. New files
+    # have no value for it, so it stops being required first
+    if has_column('file', '_message_ids'):
+        drop_not_null('file', '_message_ids')
+        move_message_ids_to_parts()
+
+    # Packed files start part way into their message, older parts never do
+    add_column('file_part', 'message_offset', "BIGINT NOT NULL DEFAULT 0")
+
+    # Content hashes for deduplication, files uploaded before have none
+    if add_column('file', 'blob_id', "VARCHAR(20) REFERENCES blob (id)"):
+        create_indexes(File, 'blob_id')
+    add_column('upload_session', 'chunk_hashes', "TEXT NOT NULL DEFAULT ''")
+
+    # Composite listing indexes, create_all() only adds them to new tables
+    create_indexes(Folder, 'parent_id')
+    create_indexes(File, 'parent_id')
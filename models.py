@@ -16,49 +16,129 @@ class User(db.Model):
     phone = db.Column(db.String(20), unique=True, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     session_string = db.Column(db.Text, nullable=True)
+    # Total size of the user's files, kept up to date by usage.py
+    used_bytes = db.Column(db.BigInteger, nullable=False, default=0)
 
     # Relationships
     folders = db.relationship('Folder', backref='owner', lazy=True)
     files = db.relationship('File', backref='owner', lazy=True)
 
 class Folder(db.Model):
+    # Listing a folder's subfolders, sorted by name
+    # Subtrees, as a range of paths
+    __table_args__ = (
+        db.Index('ix_folder_user_parent_name', 'user_id', 'parent_id', 'name'),
+        db.Index('ix_folder_user_path', 'user_id', 'path'),
+    )
+
     id = db.Column(db.String(20), primary_key=True, default=generate_codeword)
     name = db.Column(db.String(255), nullable=False)
     parent_id = db.Column(db.String(20), db.ForeignKey('folder.id'), nullable=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # Materialized path: ids from the root down to this folder, as '/a/b/c/'.
+    # A subtree is every folder whose path starts with this one's. Compared
+    # bytewise (the "C" collation on PostgreSQL) so that is a range of paths.
+    path = db.Column(
+        db.String(2048).with_variant(db.String(2048, collation='C'), 'postgresql'), nullable=False, default=''
+    )
+    # Total size of the files anywhere below this folder, kept up to date by usage.py
+    size = db.Column(db.BigInteger, nullable=False, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     # Relationships
     subfolders = db.relationship('Folder', backref=db.backref('parent', remote_side=[id]), lazy=True)
     files = db.relationship('File', backref='parent', lazy=True)
 
+    def place(self, parent):
+        """Puts a new folder under parent (a Folder, or None for the root)."""
+        if not self.id:
+            self.id = generate_codeword()
+        self.parent_id = parent.id if parent else None
+        self.path = (parent.path if parent else '/') + self.id + '/'
+
+    @staticmethod
+    def under(path):
+        """
+        Condition matching the folders whose path starts with path (a folder's,
+        ending in '/'). Written as a range, which an index on path can serve
+        where LIKE can't: '0' is the character right after '/'.
+        """
+        return db.and_(Folder.path >= path, Folder.path < path[:-1] + '0')
+
+    def move_to(self, parent):
+        """Moves the folder under parent, rewriting the paths of its whole subtree in one UPDATE."""
+        old_path = self.path
+        new_path = (parent.path if parent else '/') + self.id + '/'
+        Folder.query.filter(Folder.user_id == self.user_id, Folder.under(old_path)).update(
+            {Folder.path: new_path + db.func.substr(Folder.path, len(old_path) + 1)},
+            synchronize_session=False
+        )
+        self.parent_id = parent.id if parent else None
+        self.path = new_path
+
+    @property
+    def ancestor_ids(self):
+        """Ids from the root down to this folder, itself included."""
+        return self.path.strip('/').split('/')
+
+    def contains(self, folder):
+        """Whether folder is this folder or somewhere below it."""
+        return folder.path.startswith(self.path)
+
+    def subtree(self):
+        """Query for this folder and every folder below it, parents before children."""
+        return Folder.query.filter(
+            Folder.user_id == self.user_id, Folder.under(self.path)
+        ).order_by(Folder.path)
+
     def to_dict(self):
         return {
             'id': self.id,
             'name': self.name,
             'type': 'folder',
+            'size': self.size,
             'parent_id': self.parent_id,
             'created_at': self.created_at.isoformat()
         }
 
 class File(db.Model):
+    # Listing a folder's files, sorted by name
+    __table_args__ = (db.Index('ix_file_user_parent_name', 'user_id', 'parent_id', 'name'),)
+
     id = db.Column(db.String(20), primary_key=True, default=generate_codeword)
     name = db.Column(db.String(255), nullable=False)
     parent_id = db.Column(db.String(20), db.ForeignKey('folder.id'), nullable=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     size = db.Column(db.BigInteger, default=0)
     mime_type = db.Column(db.String(100))
-    # Store list of message IDs as a JSON string
-    _message_ids = db.Column(db.Text, nullable=False, default='[]')
+    # Content shared with the user's other copies, None for files uploaded before hashing
+    blob_id = db.Column(db.String(20), db.ForeignKey('blob.id'), nullable=True, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # The Telegram messages holding the file, in order
+    parts = db.relationship('FilePart', order_by='FilePart.part_index', cascade='all, delete-orphan', lazy=True)
+
     @property
     def message_ids(self):
-        return json.loads(self._message_ids)
+        return [part.message_id for part in self.parts]
+
+    @property
+    def spans(self):
+        """
+        (message id, start, end, message offset) byte spans of the parts, end
+        exclusive. The message offset is where start sits inside the message.
+        """
+        return [
+            (part.message_id, part.offset, part.offset + part.size, part.message_offset)
+            for part in self.parts
+        ]
 
-    @message_ids.setter
-    def message_ids(self, value):
-        self._message_ids = json.dumps(value)
+    def set_parts(self, spans):
+        """Stores the parts from (message id, start, end, message offset) spans, in order."""
+        self.parts = [
+            FilePart(part_index=i, message_id=msg_id, offset=start, size=end - start, message_offset=message_offset)
+            for i, (msg_id, start, end, message_offset) in enumerate(spans)
+        ]
 
     def to_dict(self):
         return {
@@ -70,3 +150,137 @@ class File(db.Model):
             'parent_id': self.parent_id,
             'created_at': self.created_at.isoformat()
         }
+
+class FilePart(db.Model):
+    """One Telegram message holding the bytes [offset, offset + size) of a file."""
+    file_id = db.Column(db.String(20), db.ForeignKey('file.id', ondelete='CASCADE'), primary_key=True)
+    part_index = db.Column(db.Integer, primary_key=True)
+    # Indexed to find which files a message belongs to, packs hold many
+    message_id = db.Column(db.BigInteger, nullable=False, index=True)
+    offset = db.Column(db.BigInteger, nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    # Where the bytes start inside the message's document, 0 unless packed
+    message_offset = db.Column(db.BigInteger, nullable=False, default=0)
+
+class Pack(db.Model):
+    """A Telegram document holding many small files back to back, see packing.py."""
+    id = db.Column(db.String(20), primary_key=True, default=generate_codeword)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    message_id = db.Column(db.BigInteger, nullable=False, index=True)
+    # Bytes in the document, live or not
+    size = db.Column(db.BigInteger, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Blob(db.Model):
+    """Content stored for one or more of a user's files, see dedup.py."""
+    __table_args__ = (db.Index('ix_blob_user_hash', 'user_id', 'hash', unique=True),)
+
+    id = db.Column(db.String(20), primary_key=True, default=generate_codeword)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # dedup.content_hash of the bytes, hex
+    hash = db.Column(db.String(64), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    # Files pointing at this blob
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class UploadSession(db.Model):
+    id = db.Column(db.String(20), primary_key=True, default=generate_codeword)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    name = db.Column(db.String(255), nullable=False)
+    parent_id = db.Column(db.String(20), db.ForeignKey('folder.id'), nullable=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    mime_type = db.Column(db.String(100))
+    chunk_size = db.Column(db.Integer, nullable=False)
+    # Part bitmap, one character per chunk: '1' once the chunk is saved on Telegram
+    received = db.Column(db.Text, nullable=False, default='')
+    # Hex sha256 of each chunk, 64 characters per chunk in order, filled in like received
+    chunk_hashes = db.Column(db.Text, nullable=False, default='')
+    # Telegram file ids the parts are saved against, one per CHUNK_SIZE segment, as JSON
+    _file_ids = db.Column(db.Text, nullable=False, default='[]')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @property
+    def file_ids(self):
+        return json.loads(self._file_ids)
+
+    @file_ids.setter
+    def file_ids(self, value):
+        self._file_ids = json.dumps(value)
+
+    @property
+    def chunk_count(self):
+        return max(1, (self.size + self.chunk_size - 1) // self.chunk_size)
+
+    def chunk_length(self, index):
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+    def missing_chunks(self):
+        return [i for i, bit in enumerate(self.received) if bit != '1']
+
+    def chunk_digests(self):
+        """Digests of all chunks, or None for sessions started before uploads were hashed."""
+        if len(self.chunk_hashes) != 64 * self.chunk_count:
+            return None
+        return [self.chunk_hashes[i:i + 64] for i in range(0, len(self.chunk_hashes), 64)]
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'parent_id': self.parent_id,
+            'size': self.size,
+            'chunk_size': self.chunk_size,
+            'chunk_count': self.chunk_count,
+            'received': self.received,
+            'missing': self.missing_chunks(),
+            'created_at': self.created_at.isoformat()
+        }
+
+class Job(db.Model):
+    """A long-running tree operation (copy/delete) run by the background workers in jobs.py."""
+    id = db.Column(db.String(20), primary_key=True, default=generate_codeword)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)
+    # queued -> running -> done | failed
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    # What was asked for, and the checkpoint the job resumes from, as JSON
+    _payload = db.Column(db.Text, nullable=False, default='{}')
+    _state = db.Column(db.Text, nullable=False, default='{}')
+    total = db.Column(db.Integer, nullable=False, default=0)
+    done = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @property
+    def payload(self):
+        return json.loads(self._payload)
+
+    @payload.setter
+    def payload(self, value):
+        self._payload = json.dumps(value)
+
+    @property
+    def state(self):
+        return json.loads(self._state)
+
+    @state.setter
+    def state(self, value):
+        self._state = json.dumps(value)
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'total': self.total,
+            'done': self.done,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
@@ -0,0 +1,197 @@
+"""
+Small-file packing.
+
+Files below PACK_THRESHOLD are uploaded in batches, each batch written back
+to back into one Telegram document, a pack. The offset table lives in the
+database: every packed file has a single FilePart pointing at its byte range
+inside the pack, so downloading one file fetches only that range.
+
+Deleting a packed file leaves a hole in its pack, the document goes once no
+file refers to it. compact_packs rewrites packs whose live bytes dropped
+below PACK_COMPACT_RATIO of their size into a new one, and release_packs
+deletes the old ones once the files pointing at the new one are committed.
+"""
+import os
+from collections import defaultdict
+
+from dedup import attach_blobs, hash_bytes, lock_blobs, stored_copies
+from models import db, Blob, File, FilePart, Pack, generate_codeword
+from tree_ops import release_messages
+from usage import add_usage, sizes_by_parent
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_part_table = FilePart.__table__
+_move_part = (
+    db.update(_part_table)
+    .where(
+        _part_table.c.message_id == db.bindparam('old_message_id'),
+        _part_table.c.message_offset == db.bindparam('old_offset'),
+        _part_table.c.file_id.in_(db.select(File.id).where(File.user_id == db.bindparam('owner_id')))
+    )
+    .values(message_id=db.bindparam('new_message_id'), message_offset=db.bindparam('new_offset'))
+)
+
+
+def _upload_pack(pack_id, chunks, manager):
+    """
+    Uploads the concatenation of chunks, an iterable of bytes, as one document.
+    Returns its message id and size.
+    """
+    os.makedirs(os.path.join(BASE_DIR, 'tmp'), exist_ok=True)
+    temp_path = os.path.join(BASE_DIR, 'tmp', f'pack-{pack_id}')
+    try:
+        with open(temp_path, 'wb') as out:
+            for chunk in chunks:
+                out.write(chunk)
+        size = os.path.getsize(temp_path)
+        (message_id,) = manager.upload_file(temp_path, pack_id, file_name=f'pack-{pack_id}.bin')
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return message_id, size
+
+
+def store_pack(entries, user_id, manager, chunk_size):
+    """
+    Uploads entries, a list of (name, parent_id, mime_type, data), as one pack
+    and adds a File for each. Content the user already has (or that comes
+    twice in entries) is not packed again. Returns the new files, the caller
+    commits; it must not have other changes pending, the transaction is
+    rolled back before going to Telegram. chunk_size is the upload chunk size
+    the content is hashed by.
+    """
+    hashes = [hash_bytes(data, chunk_size) for _, _, _, data in entries]
+    data_of = {content: data for (_, _, _, data), content in zip(entries, hashes)}
+
+    # content -> spans in the packs this call sent
+    uploaded, packs = {}, []
+    while True:
+        spans = stored_copies(user_id, [content for content in data_of if content not in uploaded])
+        spans.update(uploaded)
+        # Where each new content goes in the pack, empty files need no bytes at all
+        packed, offset = {}, 0
+        for content, data in data_of.items():
+            if content in spans:
+                continue
+            if not data:
+                spans[content] = []
+                continue
+            packed[content] = (offset, data)
+            offset += len(data)
+        if not packed:
+            break
+
+        # Not even the blobs stored_copies found stay locked while the pack uploads.
+        # Those a delete takes meanwhile are packed on the next round
+        db.session.rollback()
+        pack = Pack(id=generate_codeword(), user_id=user_id)
+        pack.message_id, pack.size = _upload_pack(pack.id, (data for _, data in packed.values()), manager)
+        packs.append(pack)
+        for content, (offset, data) in packed.items():
+            uploaded[content] = [(pack.message_id, 0, len(data), offset)]
+
+    db.session.add_all(packs)
+    files = []
+    for (name, parent_id, mime_type, data), content in zip(entries, hashes):
+        new_file = File(name=name, parent_id=parent_id, user_id=user_id, size=len(data), mime_type=mime_type)
+        new_file.set_parts(spans[content])
+        db.session.add(new_file)
+        files.append(new_file)
+    attach_blobs(user_id, list(zip(files, hashes)))
+
+    add_usage(user_id, sizes_by_parent((f.parent_id, f.size) for f in files))
+    return files
+
+
+def live_ranges(message_ids, user_id):
+    """message id -> sorted (message offset, size) ranges still referenced by the user's files."""
+    ranges = defaultdict(set)
+    for message_id, message_offset, size in (
+        db.session.query(FilePart.message_id, FilePart.message_offset, FilePart.size)
+        .filter(
+            FilePart.message_id.in_(message_ids),
+            # Checked by the file's key, as in tree_ops.release_messages
+            db.exists().where(File.id == FilePart.file_id, File.user_id == user_id)
+        )
+    ):
+        ranges[message_id].add((message_offset, size))
+    return {message_id: sorted(spans) for message_id, spans in ranges.items()}
+
+
+def sparse_packs(user_id, ratio, max_size):
+    """
+    Groups of the user's packs worth compacting: live bytes below ratio of
+    their size. Each group's live bytes fit in one pack of max_size.
+    """
+    packs = Pack.query.filter_by(user_id=user_id).order_by(Pack.created_at).all()
+    live = {
+        message_id: sum(size for _, size in spans)
+        for message_id, spans in live_ranges([p.message_id for p in packs], user_id).items()
+    }
+
+    groups, group, group_bytes = [], [], 0
+    for pack in packs:
+        live_bytes = live.get(pack.message_id, 0)
+        if live_bytes >= pack.size * ratio:
+            continue
+        if group and group_bytes + live_bytes > max_size:
+            groups.append(group)
+            group, group_bytes = [], 0
+        group.append(pack.id)
+        group_bytes += live_bytes
+    if group:
+        groups.append(group)
+    return groups
+
+
+def compact_packs(pack_ids, user_id, manager, chunk_size=512 * 1024):
+    """
+    Copies the live ranges of pack_ids into a new pack and points the files
+    at it. Files sharing a range (copies) stay shared. The old packs are
+    left in place: the caller commits first, then calls release_packs.
+    """
+    packs = Pack.query.filter(Pack.user_id == user_id, Pack.id.in_(pack_ids)).all()
+    ranges = live_ranges([p.message_id for p in packs], user_id)
+    old = [(pack, message_offset, size) for pack in packs for message_offset, size in ranges.get(pack.message_id, [])]
+
+    if old:
+        def chunks():
+            for pack, message_offset, size in old:
+                span = [(pack.message_id, 0, pack.size, 0)]
+                yield from manager.iter_file(span, pack.size, message_offset, size, chunk_size=chunk_size)
+
+        new_pack = Pack(id=generate_codeword(), user_id=user_id)
+        new_pack.message_id, new_pack.size = _upload_pack(new_pack.id, chunks(), manager)
+        db.session.add(new_pack)
+
+        # Files taking these parts by dedup meanwhile are moved too, see lock_blobs
+        lock_blobs(Blob.id.in_(
+            db.select(File.blob_id).join(FilePart, FilePart.file_id == File.id)
+            .where(File.user_id == user_id, FilePart.message_id.in_([pack.message_id for pack in packs]))
+        ))
+        moves, offset = [], 0
+        for pack, message_offset, size in old:
+            moves.append({
+                'old_message_id': pack.message_id,
+                'old_offset': message_offset,
+                'owner_id': user_id,
+                'new_message_id': new_pack.message_id,
+                'new_offset': offset
+            })
+            offset += size
+        db.session.execute(_move_part, moves)
+
+
+def release_packs(pack_ids, user_id, manager):
+    """
+    Deletes those of pack_ids no file refers to anymore, once compact_packs'
+    changes are committed. Packs already gone are skipped, so it can be
+    repeated after a crash.
+    """
+    message_ids = [
+        message_id for (message_id,) in
+        db.session.query(Pack.message_id).filter(Pack.user_id == user_id, Pack.id.in_(pack_ids))
+    ]
+    # Nothing refers to them now, unless files were copied into them meanwhile
+    release_messages(message_ids, user_id, manager)
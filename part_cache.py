@@ -0,0 +1,181 @@
+"""
+On-disk LRU cache of downloaded file bytes.
+
+Telegram documents are cached in fixed blocks of PART_CACHE_BLOCK_SIZE
+bytes, one file per (user, message id, block) under PART_CACHE_DIR, until
+PART_CACHE_SIZE bytes are used and the least recently read blocks go.
+Messages never change once sent, so blocks never need invalidating.
+
+Blocks are written to a temporary name and renamed into place, so readers
+never see half a block. A block being fetched is claimed, and other
+downloads needing it wait for that fetch instead of starting their own, for
+at most PART_CACHE_WAIT_TIMEOUT seconds before fetching it themselves.
+Like the other caches in this app, the index is per process.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+
+class PartCache:
+    def __init__(self):
+        self.directory = None
+        self.max_bytes = 0
+        self.block_size = 1024 * 1024
+        self.wait_timeout = 30
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        # Key -> size of the block on disk, least recently used first
+        self._blocks = OrderedDict()
+        self._bytes = 0
+        # Key -> Event set once the claimed block is filled or given up
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evictions = 0
+
+    def init_app(self, app):
+        self.max_bytes = app.config['PART_CACHE_SIZE']
+        self.block_size = app.config['PART_CACHE_BLOCK_SIZE']
+        self.directory = app.config['PART_CACHE_DIR']
+        self.wait_timeout = app.config['PART_CACHE_WAIT_TIMEOUT']
+        # Fills run on their own threads, outside any app context
+        self.logger = app.logger
+        if not self.enabled:
+            return
+        if self.max_bytes < self.block_size:
+            # Every block would be evicted as soon as it is stored
+            raise ValueError(
+                f"PART_CACHE_SIZE ({self.max_bytes}) must be at least PART_CACHE_BLOCK_SIZE ({self.block_size})"
+            )
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Blocks from an earlier run are kept, oldest first; half written ones are not
+        found = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.tmp'):
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            found.append((stat.st_mtime, name, stat.st_size))
+        with self._lock:
+            for _, name, size in sorted(found):
+                self._blocks[name] = size
+                self._bytes += size
+            self._evict()
+
+    @property
+    def enabled(self):
+        return bool(self.directory) and self.max_bytes > 0
+
+    @staticmethod
+    def key(scope, message_id, block):
+        return f"{scope}-{message_id}-{block}"
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._blocks:
+            key, size = self._blocks.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def claim(self, key):
+        """
+        Looks key up. Returns ('hit', None) if the block is cached, ('wait',
+        event) if another download is fetching it, else ('fill', None): the
+        caller now owns the block and must fill() or abandon() it.
+        """
+        with self._lock:
+            if key in self._blocks:
+                self._blocks.move_to_end(key)
+                return 'hit', None
+            if key in self._inflight:
+                return 'wait', self._inflight[key]
+            self._inflight[key] = threading.Event()
+            self.misses += 1
+            return 'fill', None
+
+    def try_claim(self, key):
+        """Claims key only if it is neither cached nor being fetched."""
+        with self._lock:
+            if key in self._blocks or key in self._inflight:
+                return False
+            self._inflight[key] = threading.Event()
+            self.misses += 1
+            return True
+
+    def contains(self, keys):
+        with self._lock:
+            return all(key in self._blocks for key in keys)
+
+    def read(self, key, start, end):
+        """Bytes [start, end) of a cached block, or None if it was evicted meanwhile."""
+        try:
+            with open(self._path(key), 'rb') as f:
+                f.seek(start)
+                data = f.read(end - start)
+        except FileNotFoundError:
+            with self._lock:
+                if key in self._blocks:
+                    self._bytes -= self._blocks.pop(key)
+            return None
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += len(data)
+        return data
+
+    def fill(self, key, data):
+        """Stores a claimed block and wakes whoever waits for it."""
+        path = self._path(key)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            self.logger.warning("Part cache could not store %s: %s", key, e)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            self.abandon(key)
+            return
+
+        with self._lock:
+            self._blocks[key] = len(data)
+            self._bytes += len(data)
+            self._evict()
+            event = self._inflight.pop(key, None)
+        if event:
+            event.set()
+
+    def abandon(self, key):
+        """Releases a claimed block that could not be fetched, a waiter will fetch it instead."""
+        with self._lock:
+            event = self._inflight.pop(key, None)
+        if event:
+            event.set()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'blocks': len(self._blocks),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'bytes_saved': self.bytes_saved,
+                'evictions': self.evictions
+            }
+
+
+part_cache = PartCache()
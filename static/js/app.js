@@ -12,9 +12,14 @@ document.addEventListener('DOMContentLoaded', () => {
     fetchStorageUsage();
     setupEventListeners();
     updateViewModeUI();
+    updateSortUI();
 });
 
 function setupEventListeners() {
+    // Virtualized listing follows scrolling and resizing
+    document.querySelector('.file-area').addEventListener('scroll', scheduleRender);
+    window.addEventListener('resize', scheduleRender);
+
     // File Input
     document.getElementById('file-input').addEventListener('change', (e) => {
         if (e.target.files.length > 0) {
@@ -87,8 +92,9 @@ function toggleView() {
     viewMode = viewMode === 'grid' ? 'list' : 'grid';
     localStorage.setItem('viewMode', viewMode);
     updateViewModeUI();
-    if (window.lastFiles) {
-        renderFiles(window.lastFiles);
+    rowHeight = 0; // Cards have another height in the other view
+    if (listing.items.length > 0) {
+        renderFiles();
     } else {
         fetchFiles();
     }
@@ -143,8 +149,43 @@ async function createFolder() {
 
 // --- File Functions ---
 
+// Items per /api/files page, and rows rendered beyond the visible part of the listing
+const LIST_PAGE_SIZE = 200;
+const OVERSCAN_ROWS = 4;
+
+// The open folder's listing, filled a page at a time as the user scrolls
+let listing = { items: [], byId: new Map(), next: null, loading: false };
+let listSort = { sort: localStorage.getItem('listSort') || 'name', order: localStorage.getItem('listOrder') || 'asc' };
+// Height of one row of cards, measured from a rendered card (0 = measure again)
+let rowHeight = 0;
+let renderedWindow = null;
 let fetchFilesCounter = 0;
 
+function listUrl(folderId, after, sort = listSort) {
+    const params = new URLSearchParams({ parent_id: folderId || 'null', limit: LIST_PAGE_SIZE, sort: sort.sort, order: sort.order });
+    if (after) params.set('after', after);
+    return `/api/files?${params}`;
+}
+
+async function fetchPage(folderId, after) {
+    const response = await fetch(listUrl(folderId, after), { headers: authHeaders() });
+
+    if (response.status === 401) {
+        window.location.href = '/login';
+        return null;
+    }
+    if (!response.ok) throw new Error(`Listing failed with ${response.status}`);
+    return response.json();
+}
+
+function appendPage(page) {
+    page.items.forEach(item => {
+        listing.items.push(item);
+        listing.byId.set(item.id, item);
+    });
+    listing.next = page.next;
+}
+
 async function fetchFiles(folderId = currentFolderId) {
     const isNavigation = folderId !== currentFolderId;
     currentFolderId = folderId;
@@ -159,100 +200,178 @@ async function fetchFiles(folderId = currentFolderId) {
 
     // Only show full loading state if navigating to a new folder
     if (isNavigation || grid.children.length === 0) {
+        grid.style.paddingTop = grid.style.paddingBottom = '0px';
         grid.innerHTML = '<div class="file-card loading"><div class="icon"><i class="fa-solid fa-spinner fa-spin"></i></div><div class="name">Loading...</div></div>';
     }
 
     try {
-        const response = await fetch(`/api/files?parent_id=${folderId || 'null'}`, { headers: { 'Authorization': 'Bearer ' + localStorage.getItem('token') } });
-
-        if (response.status === 401) {
-            window.location.href = '/login';
-            return;
-        }
-
-        const files = await response.json();
+        const page = await fetchPage(folderId, null);
 
         // Ignore if a newer fetch was started
-        if (currentFetchId !== fetchFilesCounter) return;
+        if (!page || currentFetchId !== fetchFilesCounter) return;
 
-        window.lastFiles = files; // Store for view toggling
-        renderFiles(files);
+        listing = { items: [], byId: new Map(), next: null, loading: false };
+        appendPage(page);
+        if (isNavigation) document.querySelector('.file-area').scrollTop = 0;
+        renderFiles();
     } catch (error) {
         console.error('Error fetching files:', error);
         grid.innerHTML = '<div class="error">Failed to load files</div>';
     }
 }
 
-function renderFiles(files) {
+async function loadMoreFiles() {
+    const current = listing;
+    if (current.loading || !current.next) return;
+
+    const currentFetchId = fetchFilesCounter;
+    current.loading = true;
+    try {
+        const page = await fetchPage(currentFolderId, current.next);
+        // The folder was reloaded or left meanwhile
+        if (!page || currentFetchId !== fetchFilesCounter) return;
+
+        appendPage(page);
+        renderFiles();
+    } catch (error) {
+        console.error('Error loading more files:', error);
+    } finally {
+        current.loading = false;
+    }
+}
+
+function setSort(sort) {
+    // Clicking the current column again flips the order
+    const order = listSort.sort === sort && listSort.order === 'asc' ? 'desc' : 'asc';
+    listSort = { sort, order };
+    localStorage.setItem('listSort', sort);
+    localStorage.setItem('listOrder', order);
+    updateSortUI();
+    fetchFiles();
+}
+
+function updateSortUI() {
+    document.querySelectorAll('#list-header [data-sort]').forEach(col => {
+        const arrow = listSort.order === 'asc' ? 'fa-arrow-up' : 'fa-arrow-down';
+        col.querySelector('.sort-icon').innerHTML = col.dataset.sort === listSort.sort ? `<i class="fa-solid ${arrow}"></i>` : '';
+    });
+}
+
+function gridColumns(grid) {
+    if (viewMode === 'list') return 1;
+    return getComputedStyle(grid).gridTemplateColumns.split(' ').length || 1;
+}
+
+// Only the rows in view (plus OVERSCAN_ROWS) are in the DOM, padding on the
+// grid stands in for the rest so the scrollbar covers the whole listing
+function renderFiles(force = true) {
     const grid = document.getElementById('file-grid');
-    grid.innerHTML = '';
+    const area = document.querySelector('.file-area');
+    const files = listing.items;
 
     if (files.length === 0) {
+        renderedWindow = null;
+        grid.style.paddingTop = grid.style.paddingBottom = '0px';
         grid.innerHTML = '<div class="empty-state" style="padding: 20px; text-align: center; color: #5f6368;">Folder is empty</div>';
         return;
     }
 
-    files.forEach(file => {
-        const card = document.createElement('div');
-        card.className = `file-card ${file.type}`;
-        card.dataset.id = file.id;
-        card.dataset.type = file.type;
-
-        let iconClass = 'fa-file';
-        let color = '#5f6368';
-
-        if (file.type === 'folder') {
-            iconClass = 'fa-folder';
-            color = '#5f6368';
-        } else if (file.name.endsWith('.txt')) {
-            iconClass = 'fa-file-lines';
-            color = '#1a73e8';
-        } else if (file.name.match(/\.(jpg|jpeg|png|gif)$/i)) {
-            iconClass = 'fa-image';
-            color = '#d93025';
-        } else if (file.name.match(/\.(pdf)$/i)) {
-            iconClass = 'fa-file-pdf';
-            color = '#d93025';
-        }
-
-        // Content depends on view mode
-        if (viewMode === 'list') {
-            card.innerHTML = `
-                <div class="icon" style="color: ${color}"><i class="fa-solid ${iconClass}"></i></div>
-                <div class="name">${file.name}</div>
-                <div class="col-owner">me</div>
-                <div class="col-modified">-</div>
-                <div class="col-size">-</div>
-            `;
-        } else {
-            card.innerHTML = `
-                <div class="icon" style="color: ${color}"><i class="fa-solid ${iconClass}"></i></div>
-                <div class="name">${file.name}</div>
-            `;
-        }
-
-        // Click to select
-        card.addEventListener('click', (e) => handleItemClick(e, file));
-
-        // Double click to open
-        card.addEventListener('dblclick', (e) => handleItemDblClick(e, file));
-
-        // Right click for context menu
-        card.addEventListener('contextmenu', (e) => {
-            e.preventDefault();
-            // Select item on right click if not already selected
-            if (!selectedItems.has(file.id)) {
-                selectedItems.clear();
-                selectedItems.add(file.id);
-                updateSelectionUI();
-            }
-            showContextMenu(e, file);
-        });
+    if (!rowHeight) {
+        grid.style.paddingTop = grid.style.paddingBottom = '0px';
+        grid.replaceChildren(createFileCard(files[0]));
+        const gap = parseFloat(getComputedStyle(grid).rowGap) || 0;
+        rowHeight = grid.firstChild.offsetHeight + gap;
+        if (!rowHeight) return; // Not laid out yet
+    }
+
+    const columns = gridColumns(grid);
+    const rows = Math.ceil(files.length / columns);
+    const offset = grid.getBoundingClientRect().top - area.getBoundingClientRect().top + area.scrollTop;
+    const visibleTop = area.scrollTop - offset;
+    const firstRow = Math.max(0, Math.floor(visibleTop / rowHeight) - OVERSCAN_ROWS);
+    const lastRow = Math.min(rows, Math.ceil((visibleTop + area.clientHeight) / rowHeight) + OVERSCAN_ROWS);
+
+    const visible = `${firstRow}:${lastRow}:${columns}:${files.length}`;
+    if (force || visible !== renderedWindow) {
+        renderedWindow = visible;
+        grid.style.paddingTop = `${firstRow * rowHeight}px`;
+        grid.style.paddingBottom = `${(rows - lastRow) * rowHeight}px`;
+        grid.replaceChildren(...files.slice(firstRow * columns, lastRow * columns).map(createFileCard));
+        updateSelectionUI();
+    }
 
-        grid.appendChild(card);
+    // Fetch the next page before the user reaches the end
+    if (lastRow >= rows - OVERSCAN_ROWS) loadMoreFiles();
+}
+
+let renderFrame = null;
+
+function scheduleRender() {
+    if (renderFrame) return;
+    renderFrame = requestAnimationFrame(() => {
+        renderFrame = null;
+        renderFiles(false);
     });
+}
 
-    updateSelectionUI();
+function createFileCard(file) {
+    const card = document.createElement('div');
+    card.className = `file-card ${file.type}`;
+    card.dataset.id = file.id;
+    card.dataset.type = file.type;
+
+    let iconClass = 'fa-file';
+    let color = '#5f6368';
+
+    if (file.type === 'folder') {
+        iconClass = 'fa-folder';
+        color = '#5f6368';
+    } else if (file.name.endsWith('.txt')) {
+        iconClass = 'fa-file-lines';
+        color = '#1a73e8';
+    } else if (file.name.match(/\.(jpg|jpeg|png|gif)$/i)) {
+        iconClass = 'fa-image';
+        color = '#d93025';
+    } else if (file.name.match(/\.(pdf)$/i)) {
+        iconClass = 'fa-file-pdf';
+        color = '#d93025';
+    }
+
+    // Content depends on view mode
+    if (viewMode === 'list') {
+        card.innerHTML = `
+            <div class="icon" style="color: ${color}"><i class="fa-solid ${iconClass}"></i></div>
+            <div class="name">${file.name}</div>
+            <div class="col-owner">me</div>
+            <div class="col-modified">${new Date(file.created_at).toLocaleDateString()}</div>
+            <div class="col-size">${formatSize(file.size || 0)}</div>
+        `;
+    } else {
+        card.innerHTML = `
+            <div class="icon" style="color: ${color}"><i class="fa-solid ${iconClass}"></i></div>
+            <div class="name">${file.name}</div>
+        `;
+    }
+
+    // Click to select
+    card.addEventListener('click', (e) => handleItemClick(e, file));
+
+    // Double click to open
+    card.addEventListener('dblclick', (e) => handleItemDblClick(e, file));
+
+    // Right click for context menu
+    card.addEventListener('contextmenu', (e) => {
+        e.preventDefault();
+        // Select item on right click if not already selected
+        if (!selectedItems.has(file.id)) {
+            selectedItems.clear();
+            selectedItems.add(file.id);
+            updateSelectionUI();
+        }
+        showContextMenu(e, file);
+    });
+
+    return card;
 }
 
 function handleItemClick(e, file) {
@@ -312,6 +431,9 @@ function toggleUploadContainer() {
 function closeUploadContainer() {
     document.getElementById('upload-status-container').style.display = 'none';
     document.getElementById('upload-list').innerHTML = ''; // Clear completed
+    if (uploadScheduler.queue.length === 0 && uploadScheduler.active.size === 0) {
+        uploadScheduler.total = uploadScheduler.finished = 0;
+    }
 }
 
 
@@ -351,6 +473,30 @@ function createActionItemUI(actionName, itemName) {
     return item;
 }
 
+// Copy and delete run as background jobs; poll until the job finishes,
+// showing its progress on the action item.
+const JOB_POLL_INTERVAL = 1000;
+
+async function waitForJob(jobId, uiItem) {
+    const progressBar = uiItem.querySelector('.upload-progress-bar');
+    const sizeText = uiItem.querySelector('.upload-size');
+
+    while (true) {
+        const response = await fetch(`/api/jobs/${jobId}`, { headers: authHeaders() });
+        if (!response.ok) throw new Error('Could not fetch job status');
+        const job = await response.json();
+
+        if (job.total > 0) {
+            progressBar.classList.remove('indeterminate');
+            progressBar.style.width = `${Math.round(job.done / job.total * 100)}%`;
+            sizeText.textContent = `${job.done} of ${job.total} items`;
+        }
+        if (job.status === 'done' || job.status === 'failed') return job;
+
+        await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL));
+    }
+}
+
 function createUploadItemUI(file) {
     const container = document.getElementById('upload-status-container');
     const list = document.getElementById('upload-list');
@@ -377,6 +523,7 @@ function createUploadItemUI(file) {
     item.innerHTML = `
         <div class="upload-item-header">
             <div class="upload-filename" title="${file.name}">${file.name}</div>
+            <button class="upload-cancel" title="Cancel upload"><i class="fa-solid fa-xmark"></i></button>
             <div class="upload-status-icon"><i class="fa-solid fa-spinner fa-spin"></i></div>
         </div>
         <div class="upload-progress-bar-container">
@@ -400,86 +547,570 @@ function formatSize(bytes) {
     return parseFloat((bytes / Math.pow(k, i)).toFixed(1)) + ' ' + sizes[i];
 }
 
+// Chunked uploads: how many chunks are in flight per file (all files together stay
+// within the server's per-user cap, see acquireUploadRequest), and how often a chunk is retried
+const UPLOAD_PARALLEL_CHUNKS = 4;
+const UPLOAD_CHUNK_RETRIES = 5;
+// Longest wait after a 429/503 before asking the server again
+const UPLOAD_MAX_BACKOFF = 60000;
+// Throughput shown in the upload header is averaged over this window
+const UPLOAD_SPEED_WINDOW = 5000;
+
+function authHeaders(extra = {}) {
+    return { 'Authorization': 'Bearer ' + localStorage.getItem('token'), ...extra };
+}
+
+// --- Upload Scheduler ---
+// Files wait in a queue and at most `parallel` of them upload at once, picked
+// smallest first or in the order they were added. Saved in localStorage as
+// uploadParallel / uploadPolicy ('smallest' or 'fifo').
+const uploadScheduler = {
+    parallel: parseInt(localStorage.getItem('uploadParallel'), 10) || 3,
+    policy: localStorage.getItem('uploadPolicy') || 'smallest',
+    queue: [],
+    active: new Set(),
+    paused: false,
+    // Set by a 429/503: no upload request goes out before this time
+    blockedUntil: 0,
+    waiters: [],
+    // Upload requests in flight across all files, kept within the server's
+    // per-user cap (UPLOAD_LIMITS.concurrency, set by the page)
+    requestLimit: typeof UPLOAD_LIMITS !== 'undefined' ? UPLOAD_LIMITS.concurrency : Infinity,
+    requests: 0,
+    requestWaiters: [],
+    speedSamples: [],
+    // Upload slots in use, a pack of small files takes one
+    running: 0,
+    pumpScheduled: false,
+    total: 0,
+    finished: 0,
+    nextSeq: 0
+};
+
+// Files below PACK_LIMITS.threshold bytes (set by the page) are uploaded
+// together through /api/uploads/pack, a batch per upload slot
+function isPackable(file) {
+    return typeof PACK_LIMITS !== 'undefined' && file.size < PACK_LIMITS.threshold;
+}
+
+class UploadCancelled extends Error {}
+
+function sleep(ms) {
+    return new Promise(resolve => setTimeout(resolve, ms));
+}
+
+function retryAfterMs(retryAfter, attempt) {
+    const seconds = parseInt(retryAfter, 10);
+    const wait = Number.isFinite(seconds) ? seconds * 1000 : 1000 * Math.pow(2, attempt - 1);
+    return Math.min(wait, UPLOAD_MAX_BACKOFF);
+}
+
+// Holds an upload back while the queue is paused or the server asked to back off
+async function waitForUploadTurn(task) {
+    while (true) {
+        if (task.cancelled) throw new UploadCancelled();
+        if (uploadScheduler.paused) {
+            await new Promise(resolve => uploadScheduler.waiters.push(resolve));
+        } else if (Date.now() < uploadScheduler.blockedUntil) {
+            await sleep(uploadScheduler.blockedUntil - Date.now());
+        } else {
+            return;
+        }
+    }
+}
+
+// Waits for the upload's turn and a free request slot, given back with releaseUploadRequest.
+// Throws UploadCancelled if any of the tasks is cancelled meanwhile
+async function acquireUploadRequest(...tasks) {
+    while (true) {
+        for (const task of tasks) await waitForUploadTurn(task);
+        if (uploadScheduler.requests < uploadScheduler.requestLimit) {
+            uploadScheduler.requests++;
+            return;
+        }
+        await new Promise(resolve => uploadScheduler.requestWaiters.push(resolve));
+    }
+}
+
+function releaseUploadRequest() {
+    uploadScheduler.requests--;
+    // All of them check again, some may have been cancelled meanwhile
+    uploadScheduler.requestWaiters.splice(0).forEach(resolve => resolve());
+}
+
+function backOffUploads(retryAfter, attempt) {
+    uploadScheduler.blockedUntil = Math.max(uploadScheduler.blockedUntil, Date.now() + retryAfterMs(retryAfter, attempt));
+}
+
+function recordUploadBytes(bytes) {
+    const now = Date.now();
+    const samples = uploadScheduler.speedSamples;
+    samples.push({ time: now, bytes });
+    while (samples.length > 0 && samples[0].time < now - UPLOAD_SPEED_WINDOW) samples.shift();
+    updateUploadHeader();
+}
+
+function updateUploadHeader() {
+    const { total, finished, paused, speedSamples } = uploadScheduler;
+    if (total === 0) return;
+
+    const bytes = speedSamples.reduce((sum, sample) => sum + sample.bytes, 0);
+    const remaining = total - finished;
+    let text = remaining > 0 ? `Uploading ${remaining} of ${total} item${total !== 1 ? 's' : ''}` : `${total} upload${total !== 1 ? 's' : ''} done`;
+    if (paused) {
+        text += ' · paused';
+    } else if (remaining > 0 && bytes > 0) {
+        text += ` · ${formatSize(bytes / (UPLOAD_SPEED_WINDOW / 1000))}/s`;
+    }
+    document.getElementById('upload-header-text').textContent = text;
+
+    const pauseBtn = document.getElementById('upload-pause-btn');
+    pauseBtn.style.display = remaining > 0 ? '' : 'none';
+    pauseBtn.innerHTML = `<i class="fa-solid ${paused ? 'fa-play' : 'fa-pause'}"></i>`;
+    pauseBtn.title = paused ? 'Resume uploads' : 'Pause uploads';
+    document.getElementById('upload-cancel-btn').style.display = remaining > 0 ? '' : 'none';
+}
+
 function uploadFile(file, targetParentId = undefined) {
-    const uiItem = createUploadItemUI(file);
-    const progressBar = uiItem.querySelector('.upload-progress-bar');
-    const sizeText = uiItem.querySelector('.upload-size');
-    const speedText = uiItem.querySelector('.upload-speed');
-    const statusIcon = uiItem.querySelector('.upload-status-icon');
+    // A new batch starts counting from zero
+    if (uploadScheduler.queue.length === 0 && uploadScheduler.active.size === 0) {
+        uploadScheduler.total = uploadScheduler.finished = 0;
+    }
 
-    const formData = new FormData();
-    formData.append('file', file);
-    formData.append('parent_id', targetParentId !== undefined ? (targetParentId || '') : (currentFolderId || ''));
+    const task = {
+        file,
+        parentId: targetParentId !== undefined ? targetParentId : currentFolderId,
+        targetParentId,
+        packed: isPackable(file),
+        seq: uploadScheduler.nextSeq++,
+        uiItem: createUploadItemUI(file),
+        cancelled: false,
+        session: null,
+        xhrs: new Set()
+    };
+    task.uiItem.querySelector('.upload-size').textContent = 'Queued';
+    task.uiItem.querySelector('.upload-cancel').addEventListener('click', () => cancelUpload(task));
 
-    const xhr = new XMLHttpRequest();
-    let startTime = Date.now();
-    let lastLoaded = 0;
+    uploadScheduler.queue.push(task);
+    uploadScheduler.total++;
+    updateUploadHeader();
+    schedulePump();
+}
 
-    xhr.upload.addEventListener('loadstart', () => {
-        startTime = Date.now();
-        lastLoaded = 0;
-    });
+// Pumps once the caller is done queueing, so a folder's small files are
+// already waiting when the first pack is put together
+function schedulePump() {
+    if (uploadScheduler.pumpScheduled) return;
+    uploadScheduler.pumpScheduled = true;
+    setTimeout(() => {
+        uploadScheduler.pumpScheduled = false;
+        pumpUploads();
+    }, 0);
+}
 
-    xhr.upload.addEventListener('progress', (e) => {
-        if (e.lengthComputable) {
-            const percentComplete = (e.loaded / e.total) * 100;
-            progressBar.style.width = percentComplete + '%';
+function nextQueuedUpload() {
+    const queue = uploadScheduler.queue;
+    let best = 0;
+    if (uploadScheduler.policy === 'smallest') {
+        for (let i = 1; i < queue.length; i++) {
+            if (queue[i].file.size < queue[best].file.size) best = i;
+        }
+    }
+    return queue.splice(best, 1)[0];
+}
 
-            const currentTime = Date.now();
-            const timeDiff = (currentTime - startTime) / 1000; // seconds
+// The next upload to start, with the queued small files packed along with it
+function nextUploadBatch() {
+    const first = nextQueuedUpload();
+    if (!first.packed) return [first];
+
+    const batch = [first];
+    let bytes = first.file.size;
+    const queue = uploadScheduler.queue;
+    for (let i = 0; i < queue.length && batch.length < PACK_LIMITS.max_files;) {
+        const task = queue[i];
+        if (task.packed && bytes + task.file.size <= PACK_LIMITS.max_size) {
+            batch.push(queue.splice(i, 1)[0]);
+            bytes += task.file.size;
+        } else {
+            i++;
+        }
+    }
+    return batch;
+}
 
-            // Calculate speed
-            if (timeDiff > 0) {
-                const speed = e.loaded / timeDiff; // bytes per second
-                speedText.textContent = `${formatSize(speed)}/s`;
-            }
+function pumpUploads() {
+    while (!uploadScheduler.paused && uploadScheduler.running < uploadScheduler.parallel && uploadScheduler.queue.length > 0) {
+        const tasks = nextUploadBatch();
+        uploadScheduler.running++;
+        tasks.forEach(task => uploadScheduler.active.add(task));
+        const run = tasks[0].packed ? runPackUpload(tasks) : runUpload(tasks[0]);
+        run.finally(() => {
+            uploadScheduler.running--;
+            tasks.forEach(task => uploadScheduler.active.delete(task));
+            uploadScheduler.finished += tasks.length;
+            updateUploadHeader();
+            pumpUploads();
+        });
+    }
+}
+
+function toggleUploadsPaused() {
+    uploadScheduler.paused = !uploadScheduler.paused;
+    if (!uploadScheduler.paused) {
+        uploadScheduler.waiters.splice(0).forEach(resolve => resolve());
+        pumpUploads();
+    }
+    updateUploadHeader();
+}
+
+function cancelUpload(task) {
+    if (task.cancelled) return;
+    task.cancelled = true;
+    task.xhrs.forEach(xhr => xhr.abort());
+
+    const queued = uploadScheduler.queue.indexOf(task);
+    if (queued !== -1) {
+        uploadScheduler.queue.splice(queued, 1);
+        uploadScheduler.finished++;
+        showUploadCancelled(task);
+    }
+    // Paused uploads wake up to notice they were cancelled
+    uploadScheduler.waiters.splice(0).forEach(resolve => resolve());
+    updateUploadHeader();
+}
 
-            sizeText.textContent = `${formatSize(e.loaded)} / ${formatSize(e.total)}`;
+function cancelAllUploads() {
+    [...uploadScheduler.queue, ...uploadScheduler.active].forEach(cancelUpload);
+}
+
+function showUploadCancelled(task) {
+    const uiItem = task.uiItem;
+    uiItem.querySelector('.upload-status-icon').innerHTML = '<i class="fa-solid fa-ban" style="color: #5f6368;"></i>';
+    uiItem.querySelector('.upload-size').textContent = 'Cancelled';
+    uiItem.querySelector('.upload-speed').textContent = '';
+    uiItem.querySelector('.upload-progress-bar').style.backgroundColor = '#5f6368';
+}
+
+// fetch for upload requests, waiting out 429/503 answers as the server asks
+async function uploadFetch(task, url, options) {
+    for (let attempt = 1; ; attempt++) {
+        await acquireUploadRequest(task);
+        let response;
+        try {
+            response = await fetch(url, options);
+        } finally {
+            releaseUploadRequest();
         }
+        if (response.status !== 429 && response.status !== 503) return response;
+        backOffUploads(response.headers.get('Retry-After'), attempt);
+    }
+}
+
+// Remembers the upload session of a file so a failed upload resumes instead of restarting
+function uploadSessionKey(file, parentId) {
+    return `upload:${parentId || ''}:${file.name}:${file.size}:${file.lastModified}`;
+}
+
+async function openUploadSession(task) {
+    const { file, parentId } = task;
+    const key = uploadSessionKey(file, parentId);
+    const existingId = localStorage.getItem(key);
+
+    if (existingId) {
+        const response = await uploadFetch(task, `/api/uploads/${existingId}`, { headers: authHeaders() });
+        if (response.ok) return response.json();
+        localStorage.removeItem(key);
+    }
+
+    const response = await uploadFetch(task, '/api/uploads', {
+        method: 'POST',
+        headers: authHeaders({ 'Content-Type': 'application/json' }),
+        body: JSON.stringify({
+            name: file.name,
+            size: file.size,
+            mime_type: file.type || null,
+            parent_id: parentId || null
+        })
     });
+    if (response.status === 401) {
+        window.location.href = '/login';
+    }
+    if (!response.ok) throw new Error('Could not start upload');
 
-    xhr.addEventListener('load', () => {
-        if (xhr.status >= 200 && xhr.status < 300) {
-            progressBar.style.width = '100%';
-            progressBar.style.backgroundColor = '#1e8e3e'; // Green
-            statusIcon.innerHTML = '<i class="fa-solid fa-check" style="color: #1e8e3e;"></i>';
-            sizeText.textContent = 'Upload complete';
-            speedText.textContent = '';
-            speedText.textContent = '';
+    const session = await response.json();
+    localStorage.setItem(key, session.id);
+    return session;
+}
 
-            // Only refresh the file list if the upload happened in the current viewed folder
-            const isTargetCurrentFolder = (targetParentId === undefined) || (targetParentId === currentFolderId) || (!targetParentId && !currentFolderId);
-            if (isTargetCurrentFolder) {
-                fetchFiles();
+function sendChunk(task, index, onProgress) {
+    const { session, file } = task;
+    return new Promise((resolve, reject) => {
+        const offset = index * session.chunk_size;
+        const blob = file.slice(offset, offset + session.chunk_size);
+        const xhr = new XMLHttpRequest();
+        task.xhrs.add(xhr);
+
+        xhr.upload.addEventListener('progress', (e) => onProgress(e.loaded));
+        xhr.addEventListener('loadend', () => task.xhrs.delete(xhr));
+        xhr.addEventListener('load', () => {
+            if (xhr.status >= 200 && xhr.status < 300) {
+                onProgress(blob.size);
+                resolve();
+            } else {
+                onProgress(0);
+                reject(Object.assign(new Error(`Chunk ${index} failed`), {
+                    status: xhr.status,
+                    retryAfter: xhr.getResponseHeader('Retry-After')
+                }));
             }
+        });
+        xhr.addEventListener('error', () => {
+            onProgress(0);
+            reject(new Error(`Chunk ${index} network error`));
+        });
+        xhr.addEventListener('abort', () => {
+            onProgress(0);
+            reject(new UploadCancelled());
+        });
 
-            fetchStorageUsage(); // Update storage
-        } else if (xhr.status === 401) {
-            window.location.href = '/login';
-        } else {
-            statusIcon.innerHTML = '<i class="fa-solid fa-triangle-exclamation" style="color: #d93025;"></i>';
-            sizeText.textContent = 'Upload failed';
-            speedText.textContent = '';
-            progressBar.style.backgroundColor = '#d93025'; // Red
-        }
+        xhr.open('PUT', `/api/uploads/${session.id}/chunks/${index}?offset=${offset}`);
+        xhr.setRequestHeader('Authorization', 'Bearer ' + localStorage.getItem('token'));
+        xhr.send(blob);
     });
+}
+
+async function sendChunkWithRetry(task, index, onProgress) {
+    let failures = 0;
+    for (let attempt = 1; ; attempt++) {
+        try {
+            await acquireUploadRequest(task);
+            try {
+                return await sendChunk(task, index, onProgress);
+            } finally {
+                releaseUploadRequest();
+            }
+        } catch (error) {
+            if (error instanceof UploadCancelled) throw error;
+            if (error.status === 401) {
+                window.location.href = '/login';
+            }
+            // The server is busy: wait as long as it asks, without giving up
+            if (error.status === 429 || error.status === 503) {
+                backOffUploads(error.retryAfter, attempt);
+                continue;
+            }
+            if (++failures >= UPLOAD_CHUNK_RETRIES || error.status === 401 || error.status === 404) throw error;
+            // Back off before retrying just this chunk
+            await sleep(1000 * Math.pow(2, failures - 1));
+        }
+    }
+}
+
+async function runUpload(task) {
+    const { file, parentId, targetParentId, uiItem } = task;
+    const progressBar = uiItem.querySelector('.upload-progress-bar');
+    const sizeText = uiItem.querySelector('.upload-size');
+    const speedText = uiItem.querySelector('.upload-speed');
+    const statusIcon = uiItem.querySelector('.upload-status-icon');
 
-    xhr.addEventListener('error', () => {
+    const showFailure = (message) => {
         statusIcon.innerHTML = '<i class="fa-solid fa-triangle-exclamation" style="color: #d93025;"></i>';
-        sizeText.textContent = 'Network error';
+        sizeText.textContent = message;
         speedText.textContent = '';
-        progressBar.style.backgroundColor = '#d93025';
-    });
+        progressBar.style.backgroundColor = '#d93025'; // Red
+    };
 
-    xhr.addEventListener('abort', () => {
-        statusIcon.innerHTML = '<i class="fa-solid fa-ban"></i>';
-        sizeText.textContent = 'Cancelled';
+    try {
+        sizeText.textContent = 'Starting...';
+        const session = await openUploadSession(task);
+        task.session = session;
+
+        // Bytes already on the server count as done; in-flight chunks report their own progress
+        const missing = session.missing;
+        const inFlight = {};
+        const alreadyDone = file.size - missing.reduce((sum, i) => sum + Math.min(session.chunk_size, file.size - i * session.chunk_size), 0);
+        let completed = alreadyDone;
+        let reported = alreadyDone;
+        const startTime = Date.now();
+
+        const updateProgress = () => {
+            const loaded = completed + Object.values(inFlight).reduce((a, b) => a + b, 0);
+            if (loaded > reported) recordUploadBytes(loaded - reported);
+            reported = loaded;
+            progressBar.style.width = (file.size ? (loaded / file.size) * 100 : 100) + '%';
+            const timeDiff = (Date.now() - startTime) / 1000;
+            if (timeDiff > 0) {
+                speedText.textContent = `${formatSize((loaded - alreadyDone) / timeDiff)}/s`;
+            }
+            sizeText.textContent = `${formatSize(loaded)} / ${formatSize(file.size)}`;
+        };
+        updateProgress();
+
+        const queue = [...missing];
+        const worker = async () => {
+            while (queue.length > 0) {
+                const index = queue.shift();
+                await sendChunkWithRetry(task, index, (loaded) => {
+                    inFlight[index] = loaded;
+                    updateProgress();
+                });
+                delete inFlight[index];
+                completed += Math.min(session.chunk_size, file.size - index * session.chunk_size);
+                updateProgress();
+            }
+        };
+        await Promise.all(Array.from({ length: Math.min(UPLOAD_PARALLEL_CHUNKS, queue.length) }, worker));
+
+        sizeText.textContent = 'Saving to Telegram...';
         speedText.textContent = '';
+        const response = await uploadFetch(task, `/api/uploads/${session.id}/complete`, { method: 'POST', headers: authHeaders() });
+
+        if (response.status === 401) {
+            window.location.href = '/login';
+            return;
+        }
+        if (!response.ok) {
+            showFailure('Upload failed');
+            return;
+        }
+
+        localStorage.removeItem(uploadSessionKey(file, parentId));
+        showUploadComplete(task);
+
+        // Only refresh the file list if the upload happened in the current viewed folder
+        const isTargetCurrentFolder = (targetParentId === undefined) || (targetParentId === currentFolderId) || (!targetParentId && !currentFolderId);
+        if (isTargetCurrentFolder) {
+            fetchFiles();
+        }
+
+        fetchStorageUsage(); // Update storage
+    } catch (error) {
+        if (error instanceof UploadCancelled) {
+            // Drop what the server holds, a later upload of the file starts fresh
+            if (task.session) {
+                fetch(`/api/uploads/${task.session.id}`, { method: 'DELETE', headers: authHeaders() }).catch(() => {});
+            }
+            localStorage.removeItem(uploadSessionKey(file, parentId));
+            showUploadCancelled(task);
+            return;
+        }
+        console.error('Upload error:', error);
+        showFailure(error.status ? 'Upload failed' : 'Network error');
+    }
+}
+
+function showUploadComplete(task) {
+    const uiItem = task.uiItem;
+    const progressBar = uiItem.querySelector('.upload-progress-bar');
+    progressBar.style.width = '100%';
+    progressBar.style.backgroundColor = '#1e8e3e'; // Green
+    uiItem.querySelector('.upload-status-icon').innerHTML = '<i class="fa-solid fa-check" style="color: #1e8e3e;"></i>';
+    uiItem.querySelector('.upload-size').textContent = 'Upload complete';
+    uiItem.querySelector('.upload-speed').textContent = '';
+    uiItem.querySelector('.upload-cancel').remove();
+}
+
+function sendPack(tasks, onProgress) {
+    return new Promise((resolve, reject) => {
+        const form = new FormData();
+        tasks.forEach(task => {
+            form.append('files', task.file);
+            form.append('parent_ids', task.parentId || '');
+        });
+        const xhr = new XMLHttpRequest();
+        // Cancelling any file of the pack aborts the request, see runPackUpload
+        tasks.forEach(task => task.xhrs.add(xhr));
+
+        xhr.upload.addEventListener('progress', (e) => onProgress(e.loaded, e.total));
+        xhr.addEventListener('loadend', () => tasks.forEach(task => task.xhrs.delete(xhr)));
+        xhr.addEventListener('load', () => {
+            if (xhr.status >= 200 && xhr.status < 300) {
+                resolve(JSON.parse(xhr.responseText));
+            } else {
+                reject(Object.assign(new Error('Pack upload failed'), {
+                    status: xhr.status,
+                    retryAfter: xhr.getResponseHeader('Retry-After')
+                }));
+            }
+        });
+        xhr.addEventListener('error', () => reject(new Error('Pack upload network error')));
+        xhr.addEventListener('abort', () => reject(new UploadCancelled()));
+
+        xhr.open('POST', '/api/uploads/pack');
+        xhr.setRequestHeader('Authorization', 'Bearer ' + localStorage.getItem('token'));
+        xhr.send(form);
     });
+}
+
+// Uploads small files in one request, stored on Telegram as a single pack
+async function runPackUpload(tasks) {
+    const packBytes = tasks.reduce((sum, task) => sum + task.file.size, 0);
+    let reported = 0;
+    const updateProgress = (loaded, total) => {
+        // Multipart overhead included, so scale to the files' bytes
+        const bytes = total ? Math.round(packBytes * loaded / total) : 0;
+        if (bytes > reported) recordUploadBytes(bytes - reported);
+        reported = bytes;
+        tasks.forEach(task => {
+            task.uiItem.querySelector('.upload-progress-bar').style.width = (total ? (loaded / total) * 100 : 0) + '%';
+            task.uiItem.querySelector('.upload-size').textContent = `Packed with ${tasks.length - 1} other${tasks.length !== 2 ? 's' : ''}`;
+        });
+    };
+
+    let failures = 0;
+    for (let attempt = 1; ; attempt++) {
+        try {
+            // Every file of the pack waits, any of them may have been cancelled meanwhile
+            await acquireUploadRequest(...tasks);
+            try {
+                updateProgress(0, 0);
+                await sendPack(tasks, updateProgress);
+            } finally {
+                releaseUploadRequest();
+            }
+            break;
+        } catch (error) {
+            if (error instanceof UploadCancelled) {
+                // The others go back in the queue, counted again when they finish
+                tasks.filter(task => task.cancelled).forEach(showUploadCancelled);
+                const rest = tasks.filter(task => !task.cancelled);
+                rest.forEach(task => {
+                    task.uiItem.querySelector('.upload-size').textContent = 'Queued';
+                    task.uiItem.querySelector('.upload-progress-bar').style.width = '0%';
+                });
+                uploadScheduler.queue.push(...rest);
+                uploadScheduler.finished -= rest.length;
+                return;
+            }
+            if (error.status === 401) {
+                window.location.href = '/login';
+                return;
+            }
+            if (error.status === 429 || error.status === 503) {
+                backOffUploads(error.retryAfter, attempt);
+                continue;
+            }
+            if (++failures >= UPLOAD_CHUNK_RETRIES || (error.status >= 400 && error.status < 500)) {
+                console.error('Pack upload error:', error);
+                tasks.forEach(task => {
+                    const uiItem = task.uiItem;
+                    uiItem.querySelector('.upload-status-icon').innerHTML = '<i class="fa-solid fa-triangle-exclamation" style="color: #d93025;"></i>';
+                    uiItem.querySelector('.upload-size').textContent = error.status ? 'Upload failed' : 'Network error';
+                    uiItem.querySelector('.upload-progress-bar').style.backgroundColor = '#d93025'; // Red
+                });
+                return;
+            }
+            await sleep(1000 * Math.pow(2, failures - 1));
+        }
+    }
 
-    xhr.open('POST', '/api/upload');
-    xhr.setRequestHeader('Authorization', 'Bearer ' + localStorage.getItem('token'));
-    xhr.send(formData);
+    tasks.forEach(showUploadComplete);
+    // Only refresh the file list if a file landed in the current viewed folder
+    if (tasks.some(task => (task.targetParentId === undefined) || (task.targetParentId === currentFolderId) || (!task.targetParentId && !currentFolderId))) {
+        fetchFiles();
+    }
+    fetchStorageUsage();
 }
 
 function updateBreadcrumbs() {
@@ -536,11 +1167,12 @@ async function deleteItem() {
     if (selectedItems.has(contextMenuItem.id)) {
         // Delete all selected items
         selectedItems.forEach(id => {
-            const card = document.querySelector(`.file-card[data-id="${id}"]`);
-            if (card) {
+            // Looked up in the listing, the card may be scrolled out of the DOM
+            const item = listing.byId.get(id);
+            if (item) {
                 itemsToDelete.push({
                     id: id,
-                    type: card.dataset.type
+                    type: item.type
                 });
             }
         });
@@ -567,6 +1199,8 @@ async function deleteItem() {
                 items: itemsToDelete
             })
         });
+        const data = await response.json();
+        const job = response.ok ? await waitForJob(data.job_id, uiItem) : null;
 
         const progressBar = uiItem.querySelector('.upload-progress-bar');
         const statusIcon = uiItem.querySelector('.upload-status-icon');
@@ -574,7 +1208,7 @@ async function deleteItem() {
 
         progressBar.classList.remove('indeterminate');
 
-        if (response.ok) {
+        if (job && job.status === 'done') {
             progressBar.style.width = '100%';
             progressBar.style.backgroundColor = '#1e8e3e';
             statusIcon.innerHTML = '<i class="fa-solid fa-check" style="color: #1e8e3e;"></i>';
@@ -588,6 +1222,11 @@ async function deleteItem() {
             progressBar.style.backgroundColor = '#d93025';
             statusIcon.innerHTML = '<i class="fa-solid fa-circle-exclamation error"></i>';
             sizeText.textContent = 'Failed';
+            if (job) {
+                // Part of the items may already be gone
+                fetchFiles();
+                fetchStorageUsage();
+            }
         }
     } catch (error) {
         console.error('Delete error:', error);
@@ -696,12 +1335,12 @@ function openDestinationModal(action) {
     actionItems = [];
     if (selectedItems.has(contextMenuItem.id)) {
         selectedItems.forEach(id => {
-            const card = document.querySelector(`.file-card[data-id="${id}"]`);
-            if (card) {
+            const item = listing.byId.get(id);
+            if (item) {
                 actionItems.push({
                     id: id,
-                    type: card.dataset.type,
-                    name: card.querySelector('.name').textContent
+                    type: item.type,
+                    name: item.name
                 });
             }
         });
@@ -737,9 +1376,16 @@ async function fetchDestinationFolders(parentId) {
     list.innerHTML = '<div style="padding: 10px;">Loading...</div>';
 
     try {
-        const response = await fetch(`/api/files?parent_id=${parentId || 'null'}`, { headers: { 'Authorization': 'Bearer ' + localStorage.getItem('token') } });
-        const items = await response.json();
-        const folders = items.filter(item => item.type === 'folder');
+        // Folders are listed before files, so stop at the first page that reaches them
+        const folders = [];
+        let after = null;
+        do {
+            const response = await fetch(listUrl(parentId, after, { sort: 'name', order: 'asc' }), { headers: authHeaders() });
+            const page = await response.json();
+            const pageFolders = page.items.filter(item => item.type === 'folder');
+            folders.push(...pageFolders);
+            after = pageFolders.length === page.items.length ? page.next : null;
+        } while (after);
 
         renderDestinationFolders(folders);
     } catch (error) {
@@ -828,6 +1474,7 @@ async function confirmMove() {
                 new_parent_id: newParentId
             })
         });
+        const data = await response.json();
 
         const progressBar = uiItem.querySelector('.upload-progress-bar');
         const statusIcon = uiItem.querySelector('.upload-status-icon');
@@ -845,7 +1492,6 @@ async function confirmMove() {
             selectedItems.clear();
             updateSelectionUI();
         } else {
-            const data = await response.json();
             progressBar.style.backgroundColor = '#d93025';
             statusIcon.innerHTML = '<i class="fa-solid fa-circle-exclamation error"></i>';
             sizeText.textContent = 'Failed';
@@ -883,6 +1529,8 @@ async function confirmCopy() {
                 new_parent_id: newParentId
             })
         });
+        const data = await response.json();
+        const job = response.ok ? await waitForJob(data.job_id, uiItem) : null;
 
         const progressBar = uiItem.querySelector('.upload-progress-bar');
         const statusIcon = uiItem.querySelector('.upload-status-icon');
@@ -890,21 +1538,22 @@ async function confirmCopy() {
 
         progressBar.classList.remove('indeterminate');
 
-        if (response.ok) {
+        if (job && job.status === 'done') {
             progressBar.style.width = '100%';
             progressBar.style.backgroundColor = '#1e8e3e';
             statusIcon.innerHTML = '<i class="fa-solid fa-check" style="color: #1e8e3e;"></i>';
             sizeText.textContent = 'Completed';
 
             fetchFiles(); // Refresh current view
+            fetchStorageUsage();
             selectedItems.clear();
             updateSelectionUI();
         } else {
-            const data = await response.json();
             progressBar.style.backgroundColor = '#d93025';
             statusIcon.innerHTML = '<i class="fa-solid fa-circle-exclamation error"></i>';
             sizeText.textContent = 'Failed';
-            alert(data.error || 'Copy failed');
+            if (job) fetchFiles();
+            alert((job ? job.error : data.error) || 'Copy failed');
         }
     } catch (error) {
         console.error('Copy error:', error);
@@ -954,7 +1603,7 @@ async function handleFolderUpload(files) {
     const fileArray = Array.from(files);
     if (fileArray.length === 0) return;
 
-    // Track paths to create folders
+    // Directories holding files, the server adds the ones in between
     const paths = new Set();
 
     fileArray.forEach(file => {
@@ -962,44 +1611,28 @@ async function handleFolderUpload(files) {
             const parts = file.webkitRelativePath.split('/');
             parts.pop(); // Remove filename
             const dirPath = parts.join('/');
-
-            if (dirPath) {
-                let currentPath = '';
-                parts.forEach(part => {
-                    currentPath = currentPath ? `${currentPath}/${part}` : part;
-                    paths.add(currentPath);
-                });
-            }
+            if (dirPath) paths.add(dirPath);
         }
     });
 
-    const sortedPaths = Array.from(paths).sort((a, b) => a.split('/').length - b.split('/').length);
+    // The whole tree is created in one request
     const folderIdMap = { '': currentFolderId };
 
-    for (const path of sortedPaths) {
-        const parts = path.split('/');
-        const folderName = parts[parts.length - 1];
-
-        let parentPath = '';
-        if (parts.length > 1) {
-            parentPath = parts.slice(0, parts.length - 1).join('/');
-        }
-
-        const parentId = folderIdMap[parentPath];
-
+    if (paths.size > 0) {
         try {
-            const response = await fetch('/api/folders', {
+            const response = await fetch('/api/folders/bulk', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json', 'Authorization': 'Bearer ' + localStorage.getItem('token') },
-                body: JSON.stringify({ name: folderName, parent_id: parentId || null })
+                headers: authHeaders({ 'Content-Type': 'application/json' }),
+                body: JSON.stringify({ paths: Array.from(paths), parent_id: currentFolderId || null })
             });
 
-            if (response.ok) {
-                const data = await response.json();
-                folderIdMap[path] = data.id;
-            }
+            if (!response.ok) throw new Error(`Creating folders failed with ${response.status}`);
+            const data = await response.json();
+            Object.assign(folderIdMap, data.folders);
         } catch (error) {
-            console.error('Error creating folder for upload:', error);
+            console.error('Error creating folders for upload:', error);
+            alert('Failed to create folders');
+            return;
         }
     }
 
@@ -1,28 +1,139 @@
 import os
 import asyncio
 import threading
-import inspect
+import itertools
 import random
-from telethon import TelegramClient, errors
-from telethon.tl.functions.upload import SaveBigFilePartRequest
+import time
+from telethon import TelegramClient, errors, utils
+from telethon.network import MTProtoSender
+from telethon.tl.alltlobjects import LAYER
+from telethon.tl.functions import InvokeWithLayerRequest, PingRequest
+from telethon.tl.functions.auth import ExportAuthorizationRequest, ImportAuthorizationRequest
+from telethon.tl.functions.upload import SaveBigFilePartRequest, SaveFilePartRequest, GetFileRequest
 from telethon.tl.types import DocumentAttributeFilename, InputFileBig, InputFile
 from config import Config
 from telethon.sessions import StringSession
 import math
 import shutil
+import metrics
+from call_scheduler import CallScheduler, mark_bulk, reconnects
+from upload_tuning import AdaptiveWorkers, pick_part_size, record_upload
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # 2GB limit (leaving a small buffer)
 CHUNK_SIZE = 2000 * 1024 * 1024
 
+# Most message ids Telegram accepts in one forward/delete request
+TELEGRAM_BATCH_SIZE = 100
+
+# Streamed uploads are cut into parts of this size (the largest Telegram accepts)
+UPLOAD_PART_SIZE = 512 * 1024
+# Above this size a document must be uploaded as a "big" file
+BIG_FILE_SIZE = 10 * 1024 * 1024
+
+# upload.getFile limits: requests are multiples of 4KB that divide 1MB, at most 512KB
+MIN_REQUEST_SIZE = 4 * 1024
+MAX_REQUEST_SIZE = 512 * 1024
+
+
+def part_spans(file_size, message_ids):
+    """
+    Maps a file split by upload_file onto its messages.
+    Returns (message id, start, end, message offset) byte spans, end
+    exclusive. Each part fills its own message, so message offsets are 0.
+    """
+    spans = []
+    for i, msg_id in enumerate(message_ids):
+        start = i * CHUNK_SIZE
+        spans.append((msg_id, start, min(start + CHUNK_SIZE, file_size), 0))
+    return spans
+
+
+def _request_size(chunk_size):
+    """Largest valid getFile request size not above chunk_size."""
+    size = MIN_REQUEST_SIZE
+    while size * 2 <= min(chunk_size, MAX_REQUEST_SIZE):
+        size *= 2
+    return size
+
+
+class AsyncRuntime:
+    """
+    A small pool of background threads, each running an asyncio loop forever.
+    Every TelegramClient lives on one of these loops; request threads submit
+    coroutines with run_coroutine_threadsafe and wait on the futures, so
+    calls from many requests run concurrently instead of taking turns.
+    """
+
+    def __init__(self, threads=1):
+        self.threads = max(1, threads)
+        self._loops = []
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+
+    @staticmethod
+    def _run_loop(loop):
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    def get_loop(self):
+        """Returns the loop a new client should live on, starting the threads on first use."""
+        with self._lock:
+            if not self._loops:
+                for i in range(self.threads):
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(
+                        target=self._run_loop, args=(loop,), name=f"telegram-runtime-{i}", daemon=True
+                    ).start()
+                    self._loops.append(loop)
+            return self._loops[next(self._counter) % len(self._loops)]
+
+
+_runtime = AsyncRuntime(Config.TELEGRAM_RUNTIME_THREADS)
+
+_method_seconds = metrics.histogram(
+    'telegram_manager_seconds', 'Calls of TelegramManager methods, until done or streamed out', ['method']
+)
+_method_failures = metrics.counter('telegram_manager_failures', 'TelegramManager calls that raised', ['method'])
+_bytes_moved = metrics.counter('telegram_bytes', 'File bytes sent to or fetched from Telegram', ['direction'])
+
+
+class ScheduledClient(TelegramClient):
+    """
+    A TelegramClient whose every request, on any sender, goes through a
+    CallScheduler. Telethon makes a single attempt and raises what failed,
+    FloodWaits included, so the scheduler parks the method and does the
+    retrying instead.
+    """
+
+    def __init__(self, *args, scheduler, reconnect=None, **kwargs):
+        super().__init__(
+            *args, flood_sleep_threshold=0, request_retries=0, raise_last_call_error=True, **kwargs
+        )
+        self.scheduler = scheduler
+        self._reconnect = reconnect
+
+    async def _call(self, sender, request, ordered=False, flood_sleep_threshold=None):
+        async def send():
+            return await TelegramClient._call(self, sender, request, ordered=ordered, flood_sleep_threshold=0)
+
+        # Dedicated transfer senders die with their transfer, only the client's own is reconnected
+        reconnect = self._reconnect if sender is self._sender else None
+        return await self.scheduler.call(type(request).__name__, send, reconnect)
+
+
+@metrics.instrument(_method_seconds, _method_failures)
 class TelegramManager:
     def __init__(self, session_name=None, session_string=None):
-        self._lock = threading.Lock()
         self.session_name = session_name
-        self.loop = asyncio.new_event_loop()
-        # Set the event loop for the current thread
-        asyncio.set_event_loop(self.loop)
+        # Shared runtime loop that hosts this manager's client
+        self.loop = _runtime.get_loop()
+        # Usage tracking for the pool: busy managers are never evicted
+        self._usage_lock = threading.Lock()
+        self.active_calls = 0
+        self.last_used = time.monotonic()
+        self.healthy = True
 
         # Use StringSession if provided, otherwise create a new one (will be saved later)
         if session_string:
@@ -30,82 +141,128 @@ class TelegramManager:
         else:
             self.session = StringSession()
 
-        self.client = TelegramClient(self.session, Config.API_ID, Config.API_HASH, loop=self.loop)
+        async def create_client():
+            # Built on the runtime loop they will be used from
+            client = ScheduledClient(
+                self.session, Config.API_ID, Config.API_HASH,
+                scheduler=CallScheduler.from_config(Config), reconnect=self._reconnect_if_needed
+            )
+            return client, asyncio.Lock()
+
+        # The lock serializes (re)connects of this client
+        self.client, self._connect_lock = self._run(create_client())
         self.phone = None
         self.phone_code_hash = None
         self.is_connected = False
+        # When is_user_authorized last said yes, for the auth-state cache
+        self._authorized_at = 0
 
-        # Initial check (without connecting fully, just check if authorized locally)
-        # Note: can't check easily without connecting.
-        pass
-
-    def _ensure_loop(self):
+    def _run(self, awaitable, touch=True):
         """
-        Ensure the event loop is set for the current thread.
-        This is crucial for Flask's multi-threaded environment where
-        each request might run in a thread without a loop set.
+        Runs an awaitable on the runtime loop and waits for its result, without retries.
+        touch=False keeps housekeeping calls from counting as use of the manager.
         """
+        async def wait():
+            return await awaitable
+
+        with self._usage_lock:
+            self.active_calls += 1
         try:
-            loop = asyncio.get_event_loop()
-            if loop != self.loop:
-                asyncio.set_event_loop(self.loop)
-        except RuntimeError:
-            asyncio.set_event_loop(self.loop)
+            return asyncio.run_coroutine_threadsafe(wait(), self.loop).result()
+        except errors.UnauthorizedError:
+            # Session revoked or key unregistered: stop trusting the cached state
+            self.invalidate_auth()
+            raise
+        finally:
+            with self._usage_lock:
+                self.active_calls -= 1
+                if touch:
+                    self.last_used = time.monotonic()
+
+    async def _connect(self, reconnect=False):
+        async with self._connect_lock:
+            if reconnect:
+                try:
+                    await self.client.disconnect()
+                except Exception:
+                    pass
+            if not self.client.is_connected():
+                await self.client.connect()
+
+    async def _reconnect_if_needed(self):
+        # Left to whoever is already (re)connecting, their requests wait on the same lock otherwise
+        if not self.client.is_connected() and not self._connect_lock.locked():
+            await self._connect()
+
+    async def _disconnect(self):
+        await self.client.disconnect()
 
     def _run_with_retry(self, callback, *args, **kwargs):
         """
         Runs a coroutine callback with retry logic for connection issues.
         callback: method that returns a coroutine (e.g. self.client.send_message)
         """
-        self._ensure_loop()
-        
+        async def call():
+            return await callback(*args, **kwargs)
+
         # 1. Ensure connected initially (best effort)
         try:
-             if not self.client.is_connected():
-                 with self._lock:
-                     self.loop.run_until_complete(self.client.connect())
+            self._run(self._connect())
         except Exception:
-             pass # Will be caught by main try/except or retry logic
+            pass # Will be caught by main try/except or retry logic
 
         try:
-            with self._lock:
-                coro = callback(*args, **kwargs)
-                return self.loop.run_until_complete(coro)
+            return self._run(call())
         except Exception as e:
             error_str = str(e).lower()
             # Catch "disconnected", "cannot send requests", or ConnectionError
-            if "disconnected" in error_str or "request" in error_str or isinstance(e, (ConnectionError, sqlite3.OperationalError)):
+            if "disconnected" in error_str or "request" in error_str or isinstance(e, ConnectionError):
                 print(f"TelegramManager: Connection issue detected ({e}). Reconnecting and retrying...")
+                reconnects.inc()
                 try:
-                    self.loop.run_until_complete(self.client.disconnect())
-                except:
-                    pass
-                
-                # Reconnect
-                try:
-                    with self._lock:
-                        self.loop.run_until_complete(self.client.connect())
+                    self._run(self._connect(reconnect=True))
                 except Exception as connect_err:
-                     print(f"TelegramManager: Reconnect failed: {connect_err}")
-                     raise connect_err
-                
+                    print(f"TelegramManager: Reconnect failed: {connect_err}")
+                    raise connect_err
+
                 # Retry
-                with self._lock:
-                    return self.loop.run_until_complete(callback(*args, **kwargs))
+                return self._run(call())
             else:
                 raise e
 
     def connect(self):
-        # Managed by _run_with_retry usually, but for explicit connect check:
-        self._ensure_loop()
-        if not self.client.is_connected():
-            with self._lock:
-                self.loop.run_until_complete(self.client.connect())
+        # Managed by _run_with_retry usually, but for explicit connect check.
+        # A positive answer is trusted for AUTH_CACHE_TTL seconds, or until an auth error.
+        if self.is_connected and time.monotonic() - self._authorized_at < Config.AUTH_CACHE_TTL:
+            return True
 
-        with self._lock:
-            self.is_connected = self.loop.run_until_complete(self.client.is_user_authorized())
+        self._run(self._connect())
+        self.is_connected = self._run(self.client.is_user_authorized())
+        if self.is_connected:
+            self._authorized_at = time.monotonic()
         return self.is_connected
 
+    def invalidate_auth(self):
+        """Forgets the cached authorization state so the next connect() asks Telegram."""
+        self.is_connected = False
+        self._authorized_at = 0
+
+    def ping(self):
+        """Keepalive round trip for connected clients. Returns False if the connection looks dead."""
+        if not self.client.is_connected():
+            return True
+        try:
+            self._run(asyncio.wait_for(self.client(PingRequest(random.randint(1, 2**63 - 1))), 10), touch=False)
+            self.healthy = True
+        except Exception:
+            # Drop the dead connection, the next call reconnects
+            self.healthy = False
+            try:
+                self._run(self._disconnect(), touch=False)
+            except Exception:
+                pass
+        return self.healthy
+
     def send_code(self, phone):
         # Use _run_with_retry to handle potential disconnects
         try:
@@ -127,6 +284,7 @@ class TelegramManager:
                     self.client.sign_in, self.phone, code, phone_code_hash=self.phone_code_hash
                 )
             self.is_connected = True
+            self._authorized_at = time.monotonic()
             return True, None
         except errors.SessionPasswordNeededError:
             return False, "PASSWORD_REQUIRED"
@@ -134,150 +292,567 @@ class TelegramManager:
             return False, str(e)
 
     def ensure_connected(self):
-        self._ensure_loop()
         if not self.is_connected:
             self.connect()
         if not self.is_connected:
             raise Exception("Not authenticated")
 
-    async def fast_upload(self, file_path, chunk_size=512 * 1024):
-        file_size = os.path.getsize(file_path)
-        file_name = os.path.basename(file_path)
-
-        # Use built-in upload for small files (< 10MB)
-        if file_size <= 10 * 1024 * 1024:
-             return await self.client.upload_file(file_path)
+    async def fast_upload(self, file_path, offset=0, length=None, name=None, chunk_size=None, workers=None,
+                          limiter=None):
+        """
+        Uploads `length` bytes of a file from `offset` (the whole file by
+        default) as parallel parts, for send_file. The part size is picked
+        from the length unless chunk_size is given, and the number of parts
+        in flight adapts to the link (see upload_tuning.py) unless fixed by
+        workers. Uploads sharing a limiter share its budget.
+        """
+        if length is None:
+            length = os.path.getsize(file_path) - offset
+        file_name = name or os.path.basename(file_path)
 
+        # A single part has nothing to parallelize
+        if length <= UPLOAD_PART_SIZE:
+            with open(file_path, 'rb') as f:
+                f.seek(offset)
+                data = f.read(length)
+            input_file = await self.client.upload_file(data, file_name=file_name)
+            _bytes_moved.inc(len(data), direction='upload')
+            return input_file
+
+        if limiter is None:
+            if workers:
+                limiter = AdaptiveWorkers(workers, workers, workers)
+            else:
+                limiter = AdaptiveWorkers(Config.UPLOAD_WORKERS, 1, Config.UPLOAD_MAX_WORKERS)
+        workers_start = limiter.workers
+        part_size = chunk_size or pick_part_size(length, workers_start)
+        part_count = (length + part_size - 1) // part_size
+        big = length > BIG_FILE_SIZE
         file_id = random.randint(1, 2**63 - 1)
-        part_count = (file_size + chunk_size - 1) // chunk_size
+        scheduler = self.client.scheduler
+        parts = iter(range(part_count))
+        started = time.monotonic()
+
+        async def worker():
+            mark_bulk()
+            with open(file_path, 'rb') as f:
+                for part_index in parts:
+                    async with limiter.slot() as epoch:
+                        f.seek(offset + part_index * part_size)
+                        data = f.read(min(part_size, length - part_index * part_size))
+                        if big:
+                            request = SaveBigFilePartRequest(file_id, part_index, part_count, data)
+                        else:
+                            request = SaveFilePartRequest(file_id, part_index, data)
+
+                        # Retried by the client's scheduler, its FloodWaits slow us down
+                        floods = scheduler.flood_waits
+                        sent = time.monotonic()
+                        await self.client(request)
+                        _bytes_moved.inc(len(data), direction='upload')
+                        limiter.record(
+                            epoch, time.monotonic() - sent, len(data), congested=scheduler.flood_waits != floods
+                        )
+
+        tasks = [asyncio.ensure_future(worker()) for _ in range(limiter.maximum)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+        elapsed = time.monotonic() - started
+        record_upload({
+            'file_size': length,
+            'part_size': part_size,
+            'parts': part_count,
+            'workers_start': workers_start,
+            'workers_peak': limiter.peak,
+            'workers_end': limiter.workers,
+            'decreases': limiter.decreases,
+            'seconds': round(elapsed, 3),
+            'bytes_per_second': int(length / elapsed) if elapsed else None
+        })
+
+        if big:
+            return InputFileBig(id=file_id, parts=part_count, name=file_name)
+        return InputFile(id=file_id, parts=part_count, name=file_name, md5_checksum='')
+
+    async def _acquire_senders(self, dc_id, connections=1):
+        """
+        Returns (senders, release) for a transfer against dc_id.
+        A single connection reuses the client's sender, or Telethon's borrowed
+        sender for a foreign DC. More than one opens dedicated MTProto
+        connections that live only as long as the transfer.
+        """
+        client = self.client
+        home = dc_id is None or dc_id == client.session.dc_id
+
+        if connections <= 1:
+            if home:
+                async def release():
+                    pass
+                return [client._sender], release
+
+            sender = await client._borrow_exported_sender(dc_id)
+
+            async def release():
+                await client._return_exported_sender(sender)
+            return [sender], release
+
+        dc = await client._get_dc(dc_id or client.session.dc_id)
+        auth_key = client.session.auth_key if home else None
+        senders = []
+        try:
+            for _ in range(connections):
+                sender = MTProtoSender(auth_key, loggers=client._log)
+                await sender.connect(client._connection(
+                    dc.ip_address, dc.port, dc.id, loggers=client._log, proxy=client._proxy
+                ))
+                if auth_key is None:
+                    # Export our authorization once, the key is reused by the rest
+                    auth = await client(ExportAuthorizationRequest(dc.id))
+                    client._init_request.query = ImportAuthorizationRequest(id=auth.id, bytes=auth.bytes)
+                    await sender.send(InvokeWithLayerRequest(LAYER, client._init_request))
+                    auth_key = sender.auth_key
+                senders.append(sender)
+        except Exception:
+            for sender in senders:
+                await sender.disconnect()
+            raise
 
-        # 4 concurrent workers
-        sem = asyncio.Semaphore(4)
+        async def release():
+            for sender in senders:
+                await sender.disconnect()
+        return senders, release
 
-        async def upload_part(part_index):
+    async def _iter_document(self, media, offset=0, length=None, chunk_size=512 * 1024, workers=4, connections=1):
+        """
+        Async generator over the bytes of a document from offset to offset + length.
+        The span is split into aligned GetFileRequest ranges fetched by up to
+        `workers` concurrent tasks, spread over `connections` senders. Finished
+        ranges wait in a reorder buffer of at most 2 * workers chunks so bytes
+        come out in file order.
+        """
+        dc_id, location = utils.get_input_location(media)
+        if length is None:
+            length = media.document.size - offset
+        end = offset + length
+        chunk_size = _request_size(chunk_size)
+        first = offset // chunk_size
+        last = (end + chunk_size - 1) // chunk_size
+
+        senders, release = await self._acquire_senders(dc_id, connections)
+        sem = asyncio.Semaphore(workers)
+
+        async def fetch(index):
+            mark_bulk()
+            request = GetFileRequest(location, offset=index * chunk_size, limit=chunk_size)
+            sender = senders[index % len(senders)]
             async with sem:
-                offset = part_index * chunk_size
-                with open(file_path, 'rb') as f:
-                    f.seek(offset)
-                    data = f.read(chunk_size)
+                result = await self.client._call(sender, request)
+                _bytes_moved.inc(len(result.bytes), direction='download')
+                return result.bytes
+
+        pending = {}
+        scheduled = first
+        try:
+            for index in range(first, last):
+                while scheduled < last and len(pending) < 2 * workers:
+                    pending[scheduled] = asyncio.ensure_future(fetch(scheduled))
+                    scheduled += 1
+                data = await pending.pop(index)
+                start = index * chunk_size
+                yield data[max(offset - start, 0):end - start]
+        finally:
+            for task in pending.values():
+                task.cancel()
+            await release()
+
+    async def fast_download(self, media, out, chunk_size=512 * 1024, workers=4, connections=1):
+        """
+        Downloads a whole document into the file object `out` using parallel
+        GetFileRequest workers. Returns the number of bytes written.
+        """
+        written = 0
+        async for chunk in self._iter_document(
+                media, chunk_size=chunk_size, workers=workers, connections=connections):
+            out.write(chunk)
+            written += len(chunk)
+        return written
+
+    async def _upload_parts(self, file_path, codeword, file_name, sent):
+        file_size = os.path.getsize(file_path)
+        total_parts = max(1, math.ceil(file_size / CHUNK_SIZE))
+        # One limit on parts in flight for the whole file, however many of its documents upload at once
+        limiter = AdaptiveWorkers(Config.UPLOAD_WORKERS, 1, Config.UPLOAD_MAX_WORKERS)
+        uploading = asyncio.Semaphore(Config.UPLOAD_PARALLEL_DOCUMENTS)
+        done = {part_num: asyncio.Event() for part_num in range(1, total_parts + 1)}
+
+        async def upload(part_num):
+            if part_num not in sent:
+                start = (part_num - 1) * CHUNK_SIZE
+                length = min(CHUNK_SIZE, file_size - start)
+                attributes = []
+                if total_parts == 1 and file_name:
+                    attributes.append(DocumentAttributeFilename(file_name=file_name))
+                elif file_name:
+                    attributes.append(DocumentAttributeFilename(file_name=f"{file_name}.part{part_num}"))
+
+                name = f"{os.path.basename(file_path)}.part{part_num}" if total_parts > 1 else None
+                async with uploading:
+                    input_file = await self.fast_upload(file_path, start, length, name=name, limiter=limiter)
+                # Sent in order, so the parts of a file keep ascending message ids
+                if part_num > 1:
+                    await done[part_num - 1].wait()
+                msg = await self.client.send_file(
+                    "me",
+                    file=input_file,
+                    caption=f"Codeword: {codeword} | Part: {part_num}/{total_parts}",
+                    attributes=attributes,
+                    force_document=True
+                )
+                sent[part_num] = msg.id
+            done[part_num].set()
+
+        tasks = [asyncio.ensure_future(upload(part_num)) for part_num in done]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        return [sent[part_num] for part_num in done]
+
+    def upload_file(self, file_path, codeword, file_name=None, sent=None):
+        """
+        Uploads a file as one document per CHUNK_SIZE part, read straight
+        from the file. Up to UPLOAD_PARALLEL_DOCUMENTS parts upload at once
+        and each is sent as soon as it and those before it are. Returns the
+        message ids.
+
+        sent (part number -> message id) records the parts already sent: a
+        call that fails leaves them there, and calling again with the same
+        dict only uploads the rest. Without it, the parts sent by a call that
+        fails are deleted. A dropped connection is retried once either way.
+        """
+        self.ensure_connected()
+        resumable = sent is not None
+        if sent is None:
+            sent = {}
+        try:
+            return self._run_with_retry(self._upload_parts, file_path, codeword, file_name, sent)
+        except Exception:
+            # Nothing will resume the upload, so nothing would ever refer to them
+            if not resumable and sent:
+                try:
+                    self.delete_file(list(sent.values()))
+                except Exception as e:
+                    print(f"TelegramManager: could not delete the parts of a failed upload: {e}")
+            raise
+
+    def new_upload(self, file_size):
+        """
+        Plans a streamed upload: one random Telegram file id per CHUNK_SIZE
+        segment. Parts saved against these ids are turned into documents by
+        finish_upload once every byte has arrived.
+        """
+        return [random.randint(1, 2**63 - 1) for _ in range(max(1, math.ceil(file_size / CHUNK_SIZE)))]
 
-                if not data:
+    async def _save_part(self, file_ids, file_size, position, data):
+        """Saves one UPLOAD_PART_SIZE part that starts at `position` in the file."""
+        segment = position // CHUNK_SIZE
+        segment_size = min(CHUNK_SIZE, file_size - segment * CHUNK_SIZE)
+        part_index = (position % CHUNK_SIZE) // UPLOAD_PART_SIZE
+
+        if segment_size > BIG_FILE_SIZE:
+            part_count = (segment_size + UPLOAD_PART_SIZE - 1) // UPLOAD_PART_SIZE
+            request = SaveBigFilePartRequest(file_ids[segment], part_index, part_count, data)
+        else:
+            request = SaveFilePartRequest(file_ids[segment], part_index, data)
+        await self.client(request)
+        _bytes_moved.inc(len(data), direction='upload')
+
+    async def _upload_stream(self, stream, file_ids, file_size, offset, length, workers, queue_size, digest):
+        loop = asyncio.get_event_loop()
+        # Bounded, so a slow Telegram link stops us reading more of the request
+        queue = asyncio.Queue(maxsize=queue_size)
+
+        def read_part(size):
+            data = b''
+            while len(data) < size:
+                more = stream.read(size - len(data))
+                if not more:
+                    break
+                data += more
+            return data
+
+        async def reader():
+            position = offset
+            end = offset + length
+            while position < end:
+                size = min(UPLOAD_PART_SIZE, end - position)
+                data = await loop.run_in_executor(None, read_part, size)
+                if len(data) < size:
+                    raise Exception("Upload stream ended early")
+                if digest is not None:
+                    digest.update(data)
+                await queue.put((position, data))
+                position += size
+            for _ in range(workers):
+                await queue.put(None)
+
+        async def worker():
+            mark_bulk()
+            while True:
+                item = await queue.get()
+                if item is None:
                     return
+                position, data = item
+                await self._save_part(file_ids, file_size, position, data)
 
-                # Retry logic
-                for attempt in range(3):
-                    try:
-                         await self.client(SaveBigFilePartRequest(
-                             file_id, part_index, part_count, data
-                         ))
-                         return
-                    except Exception as e:
-                        if attempt == 2:
-                            raise e
-                        await asyncio.sleep(1)
-
-        tasks = [upload_part(i) for i in range(part_count)]
-        await asyncio.gather(*tasks)
-
-        return InputFileBig(
-            id=file_id,
-            parts=part_count,
-            name=file_name
-        )
+        tasks = [asyncio.ensure_future(reader())] + [asyncio.ensure_future(worker()) for _ in range(workers)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
 
-    def upload_file(self, file_path, codeword, file_name=None):
+    def upload_stream(self, stream, file_ids, file_size, offset, length, workers=4, queue_size=8, digest=None):
+        """
+        Reads `length` bytes of the file (starting at `offset`, a multiple of
+        UPLOAD_PART_SIZE) from `stream`, cutting them into parts that are
+        pushed to Telegram by `workers` concurrent tasks while the rest is
+        still being read. At most `queue_size` parts wait in memory. The bytes
+        are fed to `digest` (a hashlib object), if given, as they are read.
+        """
+        self.ensure_connected()
+        # Not retried as a whole: the stream can't be replayed
+        self._run(self._upload_stream(stream, file_ids, file_size, offset, length, workers, queue_size, digest))
+
+    def finish_upload(self, file_ids, file_size, codeword, file_name=None):
+        """Sends the parts saved by upload_stream as documents, in order. Returns their message ids."""
         self.ensure_connected()
-        file_size = os.path.getsize(file_path)
         message_ids = []
+        total_parts = len(file_ids)
+        name = file_name or codeword
+
+        for part_num, file_id in enumerate(file_ids, start=1):
+            segment_size = min(CHUNK_SIZE, file_size - (part_num - 1) * CHUNK_SIZE)
+            part_count = max(1, (segment_size + UPLOAD_PART_SIZE - 1) // UPLOAD_PART_SIZE)
+            part_name = name if total_parts == 1 else f"{name}.part{part_num}"
 
-        attributes = []
-        if file_name:
-            attributes.append(DocumentAttributeFilename(file_name=file_name))
+            if segment_size > BIG_FILE_SIZE:
+                input_file = InputFileBig(id=file_id, parts=part_count, name=part_name)
+            else:
+                input_file = InputFile(id=file_id, parts=part_count, name=part_name, md5_checksum='')
+
+            attributes = []
+            if file_name:
+                attributes.append(DocumentAttributeFilename(file_name=part_name))
 
-        
-        if file_size <= CHUNK_SIZE:
-            input_file = self._run_with_retry(self.fast_upload, file_path)
             msg = self._run_with_retry(
                 self.client.send_file,
                 "me",
                 file=input_file,
-                caption=f"Codeword: {codeword} | Part: 1/1",
+                caption=f"Codeword: {codeword} | Part: {part_num}/{total_parts}",
                 attributes=attributes,
                 force_document=True
             )
             message_ids.append(msg.id)
-        else:
-            total_parts = math.ceil(file_size / CHUNK_SIZE)
-            with open(file_path, 'rb') as f:
-                for part_num in range(1, total_parts + 1):
-                    chunk_data = f.read(CHUNK_SIZE)
-                    temp_chunk_path = f"{file_path}.part{part_num}"
-                    with open(temp_chunk_path, 'wb') as temp_f:
-                        temp_f.write(chunk_data)
-
-                    try:
-                        part_attributes = []
-                        if file_name:
-                             part_attributes.append(DocumentAttributeFilename(file_name=f"{file_name}.part{part_num}"))
-
-                        input_file = self._run_with_retry(self.fast_upload, temp_chunk_path)
-                        msg = self._run_with_retry(
-                            self.client.send_file,
-                            "me",
-                            file=input_file,
-                            caption=f"Codeword: {codeword} | Part: {part_num}/{total_parts}",
-                            attributes=part_attributes,
-                            force_document=True
-                        )
-                        message_ids.append(msg.id)
-                    finally:
-                        if os.path.exists(temp_chunk_path):
-                            os.remove(temp_chunk_path)
 
         return message_ids
 
-    def download_file(self, message_ids, output_path):
+    def download_file(self, message_ids, output_path, chunk_size=512 * 1024, workers=4, connections=1):
         self.ensure_connected()
+        msgs = self._run_with_retry(self.client.get_messages, "me", ids=list(message_ids))
         with open(output_path, 'wb') as f:
-            for msg_id in message_ids:
-                msg = self._run_with_retry(self.client.get_messages, "me", ids=msg_id)
+            for msg_id, msg in zip(message_ids, msgs):
                 if msg and msg.media:
-                    self._run_with_retry(self.client.download_media, msg, f)
+                    self._run(self.fast_download(
+                        msg.media, f, chunk_size=chunk_size, workers=workers, connections=connections
+                    ))
                 else:
                     raise Exception(f"Message {msg_id} not found or has no media")
 
-    def delete_file(self, message_ids):
-        self.ensure_connected()
-        self._run_with_retry(self.client.delete_messages, "me", message_ids)
+    def iter_file(self, spans, file_size, offset=0, length=None,
+                  chunk_size=512 * 1024, workers=4, connections=1, cache=None):
+        """
+        Returns a generator over length bytes of the file starting at offset,
+        pulled from Telegram by parallel workers in chunks of chunk_size.
+        spans are the file's parts as (message id, start, end, message offset),
+        see part_spans; packed files start part way into their message.
+        Only the parts covering that span are fetched, each from the right
+        offset inside the part. Nothing is staged on disk and at most
+        2 * workers chunks are held in memory, unless cache (a PartCache) is
+        given: then blocks are read from it and what it lacks is stored in it.
+        """
+        if length is None:
+            length = file_size - offset
+
+        # (message id, offset inside that part, bytes wanted from it)
+        pieces = []
+        end = offset + length
+        for msg_id, part_start, part_end, message_offset in spans:
+            if part_end <= offset or part_start >= end:
+                continue
+            start = max(offset, part_start)
+            pieces.append((msg_id, message_offset + start - part_start, min(end, part_end) - start))
+
+        msgs = {}
+
+        def load_messages():
+            self.ensure_connected()
+            msg_ids = [msg_id for msg_id, _, _ in pieces]
+            found = self._run_with_retry(self.client.get_messages, "me", ids=msg_ids) if msg_ids else []
+            for msg_id, msg in zip(msg_ids, found):
+                if not msg or not msg.media:
+                    raise Exception(f"Message {msg_id} not found or has no media")
+                msgs[msg_id] = msg
 
-    def copy_file(self, message_ids, new_codeword):
-        self.ensure_connected()
-        new_message_ids = []
+        def media(msg_id):
+            if not msgs:
+                load_messages()
+            return msgs[msg_id].media
 
-        for i, msg_id in enumerate(message_ids):
-            # Forward the message to "me" (Saved Messages)
-            forwarded_msgs = self._run_with_retry(
-                self.client.forward_messages, "me", [msg_id], from_peer="me"
+        def stream(media, inner, wanted):
+            chunks = self._iter_document(
+                media, inner, wanted,
+                chunk_size=chunk_size, workers=workers, connections=connections
             )
+            try:
+                while True:
+                    try:
+                        yield self._run(chunks.__anext__())
+                    except StopAsyncIteration:
+                        break
+            finally:
+                self._run(chunks.aclose())
+
+        if cache is not None and not cache.enabled:
+            cache = None
+        # Looked up before the response starts, so a missing message is an
+        # error rather than a cut off download. Fully cached files skip Telegram.
+        if cache is None or not cache.contains(self._block_keys(cache, pieces)):
+            load_messages()
+
+        def generate():
+            for msg_id, inner, wanted in pieces:
+                if cache is None:
+                    yield from stream(media(msg_id), inner, wanted)
+                else:
+                    yield from self._iter_cached(cache, msg_id, inner, wanted, media, stream)
 
-            if not forwarded_msgs:
-                raise Exception(f"Failed to forward message {msg_id}")
-
-            new_msg = forwarded_msgs[0]
-
-            # Calculate part info if multiple parts
-            total_parts = len(message_ids)
-            part_num = i + 1
+        return generate()
 
-            # Update caption with new codeword
-            new_caption = f"Codeword: {new_codeword} | Part: {part_num}/{total_parts}"
+    def _block_keys(self, cache, pieces):
+        return [
+            cache.key(self.session_name, msg_id, block)
+            for msg_id, inner, wanted in pieces
+            for block in range(inner // cache.block_size, (inner + wanted - 1) // cache.block_size + 1)
+        ]
 
-            # Edit the caption of the forwarded message
-            self._run_with_retry(self.client.edit_message, new_msg, new_caption)
+    def _iter_cached(self, cache, msg_id, inner, wanted, media, stream, max_run=16):
+        """
+        Bytes [inner, inner + wanted) of a message through the block cache.
+        Cached blocks are read from disk and blocks another download is
+        fetching are waited for. Runs of up to max_run missing blocks are
+        fetched by a background thread with one ranged stream and stored
+        block by block, so how fast this download's client reads never holds
+        up others waiting for the same blocks. A wait longer than
+        cache.wait_timeout gives up on the cache and fetches the block directly.
+        """
+        block_size = cache.block_size
+        end = inner + wanted
+        block = inner // block_size
+        last = (end - 1) // block_size
+        # Key -> error of the fill thread we started for it, for blocks it left unfilled
+        failures = {}
+        # More blocks than the cache holds would evict the first before it is read
+        max_run = max(1, min(max_run, cache.max_bytes // block_size))
+
+        while block <= last:
+            block_start = block * block_size
+            start, stop = max(inner, block_start), min(end, block_start + block_size)
+            key = cache.key(self.session_name, msg_id, block)
+            state, event = cache.claim(key)
+            if state == 'wait':
+                if not event.wait(cache.wait_timeout):
+                    # Stuck elsewhere, don't hang with it
+                    yield from stream(media(msg_id), start, stop - start)
+                    block += 1
+                elif key in failures:
+                    raise failures[key]
+                continue
+            if state == 'hit':
+                data = cache.read(key, start - block_start, stop - block_start)
+                # Evicted since, claimed on the next pass
+                if data is not None:
+                    yield data
+                    block += 1
+                continue
+
+            run = [key]
+            while block + len(run) <= last and len(run) < max_run:
+                next_key = cache.key(self.session_name, msg_id, block + len(run))
+                if not cache.try_claim(next_key):
+                    break
+                run.append(next_key)
 
-            new_message_ids.append(new_msg.id)
+            try:
+                document = media(msg_id)
+                threading.Thread(
+                    target=self._fill_blocks, args=(cache, run, document, block_start, stream, failures),
+                    name=f"part-cache-fill-{msg_id}-{block}", daemon=True
+                ).start()
+            except BaseException:
+                for claimed in run:
+                    cache.abandon(claimed)
+                raise
+            # The next pass waits for the first block like any other download
+
+    @staticmethod
+    def _fill_blocks(cache, run, document, block_start, stream, failures):
+        """
+        Fetches the claimed blocks run, the first starting at block_start, into
+        the cache. On an error, the blocks left unfilled map to it in failures.
+        """
+        block_size = cache.block_size
+        fetch_end = min(block_start + len(run) * block_size, document.document.size)
+        filled = 0
+        try:
+            buffer = bytearray()
+            for chunk in stream(document, block_start, fetch_end - block_start):
+                buffer += chunk
+                while filled < len(run):
+                    size = min(block_size, fetch_end - block_start - filled * block_size)
+                    if len(buffer) < size:
+                        break
+                    cache.fill(run[filled], bytes(buffer[:size]))
+                    del buffer[:size]
+                    filled += 1
+            if filled < len(run):
+                raise Exception(f"Document ended before block {block_start // block_size + filled}")
+        except Exception as e:
+            for key in run[filled:]:
+                failures[key] = e
+        finally:
+            # Whoever waits for the rest fetches it
+            for key in run[filled:]:
+                cache.abandon(key)
+
+    async def _delete_messages(self, message_ids):
+        mark_bulk()
+        for i in range(0, len(message_ids), TELEGRAM_BATCH_SIZE):
+            await self.client.delete_messages("me", message_ids[i:i + TELEGRAM_BATCH_SIZE])
 
-        return new_message_ids
+    def delete_file(self, message_ids):
+        """Deletes any number of messages, TELEGRAM_BATCH_SIZE ids per request."""
+        self.ensure_connected()
+        # Deleting is idempotent, so a retry after a reconnect is safe
+        self._run_with_retry(self._delete_messages, list(message_ids))
 
     def logout(self):
         # We don't always need retry for logout, but good to have
@@ -292,20 +867,13 @@ class TelegramManager:
                 self.phone_code_hash = None
                 # Clean disconnect
                 if self.client:
-                    with self._lock:
-                        dis = self.client.disconnect()
-                        if inspect.isawaitable(dis):
-                            self.loop.run_until_complete(dis)
+                    self._run(self._disconnect())
 
     def close(self):
         """Safely disconnect the client."""
-        self._ensure_loop()
         try:
             if self.client and self.client.is_connected():
-                with self._lock:
-                    dis = self.client.disconnect()
-                    if inspect.isawaitable(dis):
-                        self.loop.run_until_complete(dis)
+                self._run(self._disconnect())
         except Exception as e:
             # Ignore if already disconnected or other trivial errors during cleanup
             print(f"Error closing manager: {e}")
@@ -315,29 +883,139 @@ class TelegramManager:
         return StringSession.save(self.client.session)
 
 
-# Global registry for active managers
-# Key: user_id (str or int) or phone (str) for pending logins
-_active_managers = {}
-_registry_lock = threading.Lock()
+class ManagerPool:
+    """
+    Bounded registry of active managers.
+    Key: user_id (str or int), or pending_<phone> during logins.
+
+    Least recently used managers are disconnected once there are more than
+    max_size, and any manager idle for longer than its timeout is dropped
+    by a background sweeper, which also pings the rest to catch dead
+    connections. Dropped user managers are rebuilt lazily from
+    User.session_string on the next request.
+    """
+
+    def __init__(self, max_size, idle_timeout, pending_timeout, keepalive_interval):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.pending_timeout = pending_timeout
+        self.keepalive_interval = keepalive_interval
+        self._managers = {}
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.ping_failures = 0
+
+    def get(self, key, session_string=None):
+        key = str(key)
+        with self._lock:
+            manager = self._managers.get(key)
+            if manager:
+                self.hits += 1
+                manager.last_used = time.monotonic()
+                return manager
+
+            self.misses += 1
+            manager = TelegramManager(session_name=key, session_string=session_string)
+            self._managers[key] = manager
+            # Others finishing calls meanwhile may look more recent, never evict the new one
+            evicted = self._evict_over_capacity(keep=key)
+            self._start_sweeper()
+
+        for old in evicted:
+            self._close(old)
+        return manager
+
+    def remove(self, key):
+        with self._lock:
+            manager = self._managers.pop(str(key), None)
+        if manager:
+            self._close(manager)
+
+    def _evict_over_capacity(self, keep=None):
+        evicted = []
+        while len(self._managers) > self.max_size:
+            idle = [(m.last_used, k) for k, m in self._managers.items() if m.active_calls == 0 and k != keep]
+            if not idle:
+                break
+            _, key = min(idle)
+            evicted.append(self._managers.pop(key))
+            self.evictions += 1
+        return evicted
+
+    def sweep(self):
+        """Drops managers idle past their timeout and pings the ones that stay."""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for key, manager in list(self._managers.items()):
+                timeout = self.pending_timeout if key.startswith('pending_') else self.idle_timeout
+                if manager.active_calls == 0 and now - manager.last_used > timeout:
+                    expired.append(self._managers.pop(key))
+                    self.evictions += 1
+            alive = list(self._managers.values())
+
+        for manager in expired:
+            self._close(manager)
+        for manager in alive:
+            if manager.active_calls == 0 and not manager.ping():
+                self.ping_failures += 1
+
+    def _start_sweeper(self):
+        if self._sweeper is None:
+            self._sweeper = threading.Thread(target=self._sweep_forever, name="telegram-pool-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def _sweep_forever(self):
+        while True:
+            time.sleep(self.keepalive_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"ManagerPool: sweep failed: {e}")
+
+    @staticmethod
+    def _close(manager):
+        try:
+            manager.close()
+        except:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._managers),
+                'busy': sum(1 for m in self._managers.values() if m.active_calls),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'ping_failures': self.ping_failures
+            }
+
+
+_pool = ManagerPool(
+    max_size=Config.MANAGER_POOL_SIZE,
+    idle_timeout=Config.MANAGER_IDLE_TIMEOUT,
+    pending_timeout=Config.PENDING_LOGIN_TIMEOUT,
+    keepalive_interval=Config.MANAGER_KEEPALIVE_INTERVAL
+)
+
+metrics.gauge('telegram_managers', 'Telegram clients in the manager pool', lambda: _pool.stats()['size'])
+metrics.gauge('telegram_managers_busy', 'Pooled Telegram clients with calls running', lambda: _pool.stats()['busy'])
 
 def get_manager(key, session_string=None):
     """
     Get or create a TelegramManager for the given key (user_id or phone).
     session_string: Optional existing session string to load.
     """
-    key = str(key)
-    with _registry_lock:
-        if key not in _active_managers:
-            _active_managers[key] = TelegramManager(session_name=key, session_string=session_string)
-        return _active_managers[key]
+    return _pool.get(key, session_string=session_string)
 
 def remove_manager(key):
-    key = str(key)
-    with _registry_lock:
-        if key in _active_managers:
-            manager = _active_managers[key]
-            try:
-                manager.close()
-            except:
-                pass
-            del _active_managers[key]
+    _pool.remove(key)
+
+def pool_stats():
+    """Hit, miss and eviction counters of the manager pool."""
+    return _pool.stats()
@@ -0,0 +1,7 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Clients are never connected, any credentials do
+os.environ.setdefault('API_ID', '1')
+os.environ.setdefault('API_HASH', 'test')
@@ -0,0 +1,109 @@
+"""
+ScheduledClient against a stub MTProto sender: what Telethon raises has to
+reach the CallScheduler, which does the waiting and retrying.
+"""
+import asyncio
+import os
+import time
+
+from telethon import errors
+from telethon.sessions import StringSession
+from telethon.tl.functions.help import GetConfigRequest
+
+from call_scheduler import CallScheduler, call_stats
+from telegram_manager import ScheduledClient, TelegramManager
+from upload_tuning import AdaptiveWorkers
+
+
+class FakeSender:
+    """Answers each request with the next of replies, raising those that are exceptions."""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.sent = []
+
+    def send(self, request, ordered=False):
+        self.sent.append(request)
+        reply = self.replies.pop(0)
+        future = asyncio.get_running_loop().create_future()
+        if isinstance(reply, Exception):
+            future.set_exception(reply)
+        else:
+            future.set_result(reply)
+        return future
+
+
+class FakeLink:
+    """A sender saving file parts, answering with a FloodWait beyond max_in_flight at once."""
+
+    def __init__(self, max_in_flight):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.parts = set()
+
+    def send(self, request, ordered=False):
+        return asyncio.ensure_future(self.save(request))
+
+    async def save(self, request):
+        if self.in_flight >= self.max_in_flight:
+            raise errors.FloodWaitError(request=request, capture=1)
+        self.in_flight += 1
+        try:
+            await asyncio.sleep(0.01)
+        finally:
+            self.in_flight -= 1
+        self.parts.add(request.file_part)
+        return True
+
+
+def make_client(sender, **scheduler_options):
+    client = ScheduledClient(StringSession(), 1, 'test', scheduler=CallScheduler(100, **scheduler_options))
+    client._sender = sender
+    return client
+
+
+def test_flood_wait_parks_the_method():
+    request = GetConfigRequest()
+    sender = FakeSender([errors.FloodWaitError(request=request, capture=1), 'config'])
+
+    async def run():
+        client = make_client(sender)
+        start = time.monotonic()
+        result = await client(request)
+        return client.scheduler, result, time.monotonic() - start
+
+    scheduler, result, elapsed = asyncio.run(run())
+    assert result == 'config'
+    assert len(sender.sent) == 2
+    assert scheduler.flood_waits == 1
+    assert 'GetConfigRequest' in scheduler._parked
+    # Parked for the wait plus a second of margin, not slept inside Telethon
+    assert elapsed >= 2
+
+
+def test_server_errors_are_retried_by_the_scheduler_only():
+    request = GetConfigRequest()
+    sender = FakeSender([errors.ServerError(request, 'INTERNAL'), 'config'])
+
+    async def run():
+        return await make_client(sender, backoff=0.01)(request)
+
+    retries = call_stats()['retries']
+    assert asyncio.run(run()) == 'config'
+    assert len(sender.sent) == 2
+    assert call_stats()['retries'] == retries + 1
+
+
+def test_fast_upload_backs_off_on_flood_waits(tmp_path):
+    path = tmp_path / 'file'
+    path.write_bytes(os.urandom(4 * 1024 * 1024))
+    link = FakeLink(4)
+    manager = TelegramManager('test')
+    manager.client = make_client(link)
+    limiter = AdaptiveWorkers(8, 1, 8)
+
+    input_file = manager._run(manager.fast_upload(str(path), chunk_size=128 * 1024, limiter=limiter))
+    assert link.parts == set(range(input_file.parts))
+    assert manager.client.scheduler.flood_waits >= 1
+    assert limiter.decreases >= 1
+    assert limiter.limit < 8
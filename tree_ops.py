@@ -0,0 +1,204 @@
+"""
+Bulk operations on folder subtrees, shared by the copy/delete jobs in jobs.py.
+
+Subtrees are found through Folder.path and rows are read as plain columns
+and written with bulk INSERT/DELETE statements, so the number of queries
+does not grow with the size of the tree.
+"""
+from collections import Counter, defaultdict
+
+from dedup import add_blob_refs, lock_blobs
+from listing_cache import invalidate
+from models import db, Blob, File, FilePart, Folder, Pack, generate_codeword
+from usage import add_usage, sizes_by_parent
+
+
+def in_subtree(folder, user_id):
+    """Condition matching folder and every folder below it."""
+    # An empty path would match every folder of the user
+    if not folder.path:
+        raise Exception(f"Folder {folder.id} has no path")
+    return db.and_(Folder.user_id == user_id, Folder.under(folder.path))
+
+
+def subtree_rows(folder, user_id):
+    """
+    The tree rooted at folder, in two queries: folders as (id, parent_id, name)
+    rows, parents before children, and files as (id, parent_id) rows.
+    """
+    folders = (
+        db.session.query(Folder.id, Folder.parent_id, Folder.name)
+        .filter(in_subtree(folder, user_id))
+        .order_by(Folder.path)
+        .all()
+    )
+    files = (
+        db.session.query(File.id, File.parent_id)
+        .join(Folder, File.parent_id == Folder.id)
+        .filter(File.user_id == user_id, in_subtree(folder, user_id))
+        .all()
+    )
+    return folders, files
+
+
+def delete_telegram_messages(message_ids, manager):
+    if message_ids:
+        try:
+            manager.delete_file(message_ids)
+        except Exception as e:
+            print(f"Error deleting files from Telegram: {e}")
+
+
+def release_messages(message_ids, user_id, manager):
+    """
+    Deletes those of message_ids no file of the user refers to anymore, with
+    their Pack rows. A pack stays until the last file in it is gone.
+    """
+    message_ids = set(message_ids)
+    if not message_ids:
+        return
+    # Driven by the message id index, the file of each part is checked by its key
+    in_use = set(db.session.scalars(
+        db.select(FilePart.message_id).distinct()
+        .where(
+            FilePart.message_id.in_(message_ids),
+            db.exists().where(File.id == FilePart.file_id, File.user_id == user_id)
+        )
+    ))
+    unused = list(message_ids - in_use)
+    if unused:
+        Pack.query.filter(Pack.user_id == user_id, Pack.message_id.in_(unused)).delete(synchronize_session=False)
+        delete_telegram_messages(unused, manager)
+
+
+def delete_matching_files(matching, user_id, manager):
+    """Deletes the files matching a condition: their usage, the rows and the Telegram messages left unused."""
+    files = db.session.query(File.id, File.parent_id, File.size, File.blob_id).filter(matching).all()
+    if not files:
+        return
+    # By id, so files added meanwhile are neither deleted nor uncounted
+    file_ids = [f.id for f in files]
+    parts = FilePart.file_id.in_(file_ids)
+    message_ids = [msg_id for (msg_id,) in db.session.query(FilePart.message_id).filter(parts)]
+    add_usage(user_id, {parent_id: -size for parent_id, size in sizes_by_parent((f.parent_id, f.size) for f in files).items()})
+    FilePart.query.filter(parts).delete(synchronize_session=False)
+    File.query.filter(File.id.in_(file_ids)).delete(synchronize_session=False)
+    add_blob_refs({blob_id: -count for blob_id, count in Counter(f.blob_id for f in files).items()})
+    release_messages(message_ids, user_id, manager)
+
+
+def owned_files(file_ids, user_id):
+    """
+    Those of file_ids that belong to user_id. Looked up by key alone: with
+    user_id in the query SQLite, lacking statistics, walks all the user's
+    files through the listing index instead.
+    """
+    return [
+        file_id for file_id, owner in db.session.query(File.id, File.user_id).filter(File.id.in_(file_ids))
+        if owner == user_id
+    ]
+
+
+def delete_files(file_ids, user_id, manager):
+    """Deletes file_ids with their Telegram messages, the rows in one DELETE."""
+    delete_matching_files(File.id.in_(owned_files(file_ids, user_id)), user_id, manager)
+
+
+def delete_subtree(folder_id, user_id, manager):
+    """
+    Deletes folder_id and everything below it. Files are normally gone already
+    (see delete_files), this only catches ones added since the job was planned.
+    """
+    folder = Folder.query.filter_by(id=folder_id, user_id=user_id).first()
+    if not folder:
+        return
+
+    folder_ids = db.select(Folder.id).where(in_subtree(folder, user_id))
+    delete_matching_files(db.and_(File.user_id == user_id, File.parent_id.in_(folder_ids)), user_id, manager)
+    # The deleted folders' own listings go too
+    invalidate(user_id, [folder.parent_id, *db.session.scalars(folder_ids)])
+    Folder.query.filter(in_subtree(folder, user_id)).delete(synchronize_session=False)
+
+
+def create_folders(folders, user_id, target):
+    """
+    Creates folders, a list of (key, parent key, name) with parents first, under
+    target (a Folder, or None for the root) in one bulk INSERT. Top-level folders
+    have None as parent key. Returns key -> new id.
+    """
+    ids = {None: target.id if target else None}
+    paths = {None: target.path if target else '/'}
+    rows = []
+    for key, parent_key, name in folders:
+        # Parent was skipped, so is its subtree
+        if parent_key not in ids:
+            continue
+        new_id = generate_codeword()
+        ids[key] = new_id
+        paths[key] = paths[parent_key] + new_id + '/'
+        rows.append({
+            'id': new_id,
+            'name': name,
+            'parent_id': ids[parent_key],
+            'path': paths[key],
+            'user_id': user_id
+        })
+
+    if rows:
+        db.session.execute(db.insert(Folder), rows)
+        invalidate(user_id, [ids[None]])
+    del ids[None]
+    return ids
+
+
+def copy_files(pending_files, user_id):
+    """
+    Copies pending_files, a list of (file row, new_parent_id), adding the new
+    File and FilePart rows in bulk INSERTs. File rows need id, name, size,
+    mime_type and blob_id. Nothing is sent to Telegram: the copies share
+    their source's messages, which stay until no file refers to them.
+    """
+    if not pending_files:
+        return
+
+    # Keeps the sources' parts from being released before the copies are committed
+    blob_ids = {item.blob_id for item, _ in pending_files} - {None}
+    if blob_ids:
+        lock_blobs(Blob.id.in_(blob_ids))
+    parts = defaultdict(list)
+    for part in (
+        db.session.query(FilePart.file_id, FilePart.message_id, FilePart.offset, FilePart.size, FilePart.message_offset)
+        .filter(FilePart.file_id.in_([file.id for file, _ in pending_files]))
+        .order_by(FilePart.file_id, FilePart.part_index)
+    ):
+        parts[part.file_id].append(part)
+
+    codewords = [generate_codeword() for _ in pending_files]
+    db.session.execute(db.insert(File), [
+        {
+            'id': codeword,
+            'name': item.name,
+            'parent_id': new_parent_id,
+            'user_id': user_id,
+            'size': item.size,
+            'mime_type': item.mime_type,
+            'blob_id': item.blob_id
+        }
+        for (item, new_parent_id), codeword in zip(pending_files, codewords)
+    ])
+    new_parts = [
+        {
+            'file_id': codeword,
+            'part_index': i,
+            'message_id': part.message_id,
+            'offset': part.offset,
+            'size': part.size,
+            'message_offset': part.message_offset
+        }
+        for (item, _), codeword in zip(pending_files, codewords)
+        for i, part in enumerate(parts[item.id])
+    ]
+    if new_parts:
+        db.session.execute(db.insert(FilePart), new_parts)
+    add_blob_refs(Counter(item.blob_id for item, _ in pending_files))
+    add_usage(user_id, sizes_by_parent((new_parent_id, item.size) for item, new_parent_id in pending_files))
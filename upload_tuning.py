@@ -0,0 +1,115 @@
+"""
+Tuning of parallel part uploads (see TelegramManager.fast_upload).
+
+The part size is picked per file among the sizes Telegram accepts, large
+enough to keep the request count down and small enough that a medium file
+still has parts for every worker.
+
+The number of parts in flight is adjusted while the upload runs, AIMD
+style: it grows by one every time a window of parts went through at about
+the best time per byte seen so far (doubling per window until the first
+setback, like TCP slow start), and halves when a part comes back much
+slower (the link is saturated) or the account hit a FloodWait meanwhile.
+A FloodWait also caps the limit below where it happened for the rest of
+the upload, probing past it again would only earn another one.
+
+The parameters and outcome of recent uploads are kept for /api/stats.
+"""
+import asyncio
+import contextlib
+import math
+import threading
+from collections import deque
+
+# upload.saveFilePart limits: a part is a power of two from 1KB to 512KB, at most 4000 parts per file
+UPLOAD_PART_SIZES = [1024 * 2 ** i for i in range(10)]
+MAX_UPLOAD_PARTS = 4000
+# Smaller parts cost more in per-request overhead than they gain in parallelism
+MIN_PART_SIZE = 128 * 1024
+
+_recent_lock = threading.Lock()
+_recent = deque(maxlen=50)
+
+
+def pick_part_size(file_size, workers):
+    """
+    Largest allowed part size that still gives each of workers a part, but
+    not below MIN_PART_SIZE, nor so small the file would need more than
+    MAX_UPLOAD_PARTS parts.
+    """
+    sizes = [s for s in UPLOAD_PART_SIZES if s >= MIN_PART_SIZE and math.ceil(file_size / s) <= MAX_UPLOAD_PARTS]
+    if not sizes:
+        raise ValueError(f"A file of {file_size} bytes is too large for one upload")
+    for size in reversed(sizes):
+        if file_size >= workers * size:
+            return size
+    return sizes[0]
+
+
+class AdaptiveWorkers:
+    """
+    AIMD limit on concurrent part uploads. Uploads hold a slot() while their
+    request is out and record() how it went.
+    """
+
+    def __init__(self, initial, minimum, maximum, tolerance=2.0):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.tolerance = tolerance
+        self.in_flight = 0
+        self.peak = int(self.limit)
+        self.decreases = 0
+        self.slow_start = True
+        # Best seconds per byte seen, the uncongested pace
+        self.baseline = None
+        # Bumped by every decrease, so parts sent before it can't cause another
+        self._epoch = 0
+        self._cond = asyncio.Condition()
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """Waits until the limit allows one more part. Yields the value to pass to record()."""
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        try:
+            yield self._epoch
+        finally:
+            async with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+
+    def record(self, epoch, seconds, size, congested=False):
+        """Call while still holding the slot. congested: the account hit a FloodWait during the part."""
+        pace = seconds / max(size, 1)
+        if self.baseline is None or pace < self.baseline:
+            self.baseline = pace
+
+        if congested:
+            self.maximum = max(self.minimum, min(self.maximum, self.in_flight - 1))
+        if congested or pace > self.baseline * self.tolerance:
+            if epoch == self._epoch and self.limit > self.minimum:
+                self.limit = max(self.minimum, self.limit / 2)
+                self.decreases += 1
+                self._epoch += 1
+                self.slow_start = False
+        else:
+            # One more worker per good part in slow start, else per full window of them
+            self.limit = min(self.maximum, self.limit + (1 if self.slow_start else 1 / self.limit))
+            self.peak = max(self.peak, int(self.limit))
+
+    @property
+    def workers(self):
+        return int(self.limit)
+
+
+def record_upload(report):
+    with _recent_lock:
+        _recent.append(report)
+
+
+def recent_uploads():
+    """Reports of the last uploads, oldest first."""
+    with _recent_lock:
+        return list(_recent)
@@ -0,0 +1,100 @@
+"""
+Storage usage counters: User.used_bytes, and Folder.size for everything
+below a folder, recursively.
+
+They are changed with relative UPDATEs in the same transaction as the file
+rows they account for, so concurrent uploads and jobs don't lose each
+other's changes. reconcile() recomputes them from the files to repair drift.
+"""
+from collections import defaultdict
+
+from listing_cache import invalidate
+from models import db, File, Folder, User
+
+_folder_table = Folder.__table__
+_add_to_folder = (
+    db.update(_folder_table)
+    .where(_folder_table.c.id == db.bindparam('folder_id'))
+    .values(size=_folder_table.c.size + db.bindparam('delta'))
+)
+
+
+def add_folder_sizes(user_id, deltas):
+    """
+    Applies deltas, folder id -> bytes added (or removed, if negative) directly
+    in that folder, to those folders and all their ancestors in one statement.
+    None stands for the root and is ignored.
+    """
+    deltas = {folder_id: delta for folder_id, delta in deltas.items() if folder_id is not None and delta}
+    if not deltas:
+        return
+
+    paths = db.session.query(Folder.id, Folder.path).filter(Folder.user_id == user_id, Folder.id.in_(deltas))
+    totals = defaultdict(int)
+    for folder_id, path in paths:
+        for ancestor_id in path.strip('/').split('/'):
+            totals[ancestor_id] += deltas[folder_id]
+
+    rows = [{'folder_id': folder_id, 'delta': delta} for folder_id, delta in totals.items() if delta]
+    if rows:
+        db.session.execute(_add_to_folder, rows)
+        # Each folder's size shows in its parent's listing
+        invalidate(user_id, [None, *totals])
+
+
+def add_usage(user_id, deltas):
+    """Counts new (or, if negative, removed) files: deltas is parent folder id -> bytes."""
+    total = sum(deltas.values())
+    invalidate(user_id, deltas, storage=True)
+    if total:
+        User.query.filter_by(id=user_id).update(
+            {User.used_bytes: User.used_bytes + total}, synchronize_session=False
+        )
+    add_folder_sizes(user_id, deltas)
+
+
+def sizes_by_parent(files):
+    """Sums (parent_id, size) rows into parent id -> bytes."""
+    deltas = defaultdict(int)
+    for parent_id, size in files:
+        deltas[parent_id] += size or 0
+    return deltas
+
+
+def reconcile(user_id=None):
+    """
+    Recomputes the counters of user_id (or of every user) from their files.
+    Returns how many users and folders were off.
+    """
+    users = User.query if user_id is None else User.query.filter_by(id=user_id)
+    folders = Folder.query if user_id is None else Folder.query.filter_by(user_id=user_id)
+    files = File.query if user_id is None else File.query.filter_by(user_id=user_id)
+
+    used = dict(files.with_entities(File.user_id, db.func.sum(File.size)).group_by(File.user_id))
+    direct = dict(files.with_entities(File.parent_id, db.func.sum(File.size)).group_by(File.parent_id))
+
+    sizes = defaultdict(int)
+    folder_rows = folders.with_entities(Folder.id, Folder.path, Folder.size, Folder.user_id).all()
+    for folder_id, path, _, _ in folder_rows:
+        for ancestor_id in path.strip('/').split('/'):
+            sizes[ancestor_id] += direct.get(folder_id) or 0
+
+    user_fixes = [
+        {'id': uid, 'used_bytes': used.get(uid) or 0}
+        for uid, used_bytes in users.with_entities(User.id, User.used_bytes)
+        if used_bytes != (used.get(uid) or 0)
+    ]
+    folder_fixes = []
+    for folder_id, path, size, owner_id in folder_rows:
+        if size != sizes[folder_id]:
+            folder_fixes.append({'id': folder_id, 'size': sizes[folder_id]})
+            # Listed in its parent, the second to last id of its path
+            ancestors = path.strip('/').split('/')
+            invalidate(owner_id, [ancestors[-2] if len(ancestors) > 1 else None])
+    for fix in user_fixes:
+        invalidate(fix['id'], storage=True)
+
+    db.session.bulk_update_mappings(User, user_fixes)
+    db.session.bulk_update_mappings(Folder, folder_fixes)
+    db.session.commit()
+    return len(user_fixes), len(folder_fixes)
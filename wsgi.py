@@ -1,6 +1,10 @@
 from app import app
+from jobs import job_runner
 from waitress import serve
 
+# Only the server imports this module (python wsgi.py, or waitress-serve wsgi:app)
+job_runner.start()
+
 if __name__ == "__main__":
     print("Starting server on http://0.0.0.0:8080")
-    serve(app, host="0.0.0.0", port=8080)
+    serve(app, host="0.0.0.0", port=8080, threads=app.config['SERVER_THREADS'])